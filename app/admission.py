@@ -0,0 +1,193 @@
+# app/admission.py
+"""
+Kontrola wpuszczania żądań (admission control) dla drogich endpointów.
+
+Każda klasa tras ma limit równoległych żądań, ograniczoną kolejkę i maksymalny
+czas czekania; wszystkie klasy „ciężkie” dzielą dodatkowo wspólny limit
+(ADMIT_HEAVY_TOTAL ~ liczba rdzeni). Zwolnione miejsce dostaje najpierw klasa
+o wyższym priorytecie (ai przed ingestem). Żądanie, które nie zmieści się
+w kolejce albo nie doczeka się miejsca, dostaje 429 z Retry-After. Trasy
+interaktywne (podgląd, wyszukiwanie, lista) nie są limitowane.
+
+Stan działa na pętli zdarzeń (middleware) — bez blokad.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from dataclasses import dataclass
+
+from app.metrics import Counter, QUEUE_DEPTH
+
+ADMISSION_SHED = Counter(
+    "smartdoc_admission_shed_total", "Requests rejected with 429 by route class and reason (queue_full/timeout).",
+    ["route_class", "reason"],
+)
+
+
+@dataclass
+class RouteClass:
+    name: str
+    limit: int             # ile żądań tej klasy naraz
+    max_queue: int         # ile może czekać
+    max_wait: float        # sekundy w kolejce, potem 429
+    priority: int          # mniejsza liczba = wyższy priorytet
+    inflight: int = 0
+    queued: int = 0
+    shed: int = 0
+    ewma_s: float | None = None
+
+
+HEAVY_TOTAL = int(os.getenv("ADMIT_HEAVY_TOTAL", str(max(2, os.cpu_count() or 2))))
+
+CLASSES = {
+    "ai": RouteClass("ai", int(os.getenv("ADMIT_AI_LIMIT", "4")), 16, float(os.getenv("ADMIT_AI_WAIT", "10")), 0),
+    "ingest": RouteClass("ingest", int(os.getenv("ADMIT_INGEST_LIMIT", "2")), 8, float(os.getenv("ADMIT_INGEST_WAIT", "30")), 1),
+}
+
+# (metoda, prefiks ścieżki) → klasa; pierwsze dopasowanie wygrywa
+ROUTES = [
+    ("POST", "/documents/upload-pdf", "ingest"),
+    ("POST", "/documents/upload-multiple", "ingest"),
+    ("POST", "/documents/upload-jobs", "ingest"),
+    ("POST", "/documents/import", "ingest"),
+    ("POST", "/documents/reindex-all", "ingest"),
+    ("GET", "/documents/ai/", "ai"),
+    ("POST", "/documents/qa", "ai"),
+]
+
+_waiters: list = []        # kopiec (priorytet, seq, future, klasa)
+_seq = itertools.count()
+_heavy_inflight = 0
+
+
+class Rejected(Exception):
+    def __init__(self, route_class: RouteClass, reason: str):
+        super().__init__(reason)
+        self.route_class = route_class
+        self.reason = reason
+
+    @property
+    def retry_after(self) -> int:
+        """Szacowany czas do zwolnienia miejsca: kolejka × średni czas obsługi / limit."""
+        rc = self.route_class
+        per_slot = rc.ewma_s or rc.max_wait
+        return max(1, math.ceil(per_slot * (rc.queued + 1) / rc.limit))
+
+
+def classify(method: str, path: str) -> RouteClass | None:
+    for m, prefix, name in ROUTES:
+        if method == m and path.startswith(prefix):
+            return CLASSES[name]
+    return None
+
+
+def _can_run(rc: RouteClass) -> bool:
+    return rc.inflight < rc.limit and _heavy_inflight < HEAVY_TOTAL
+
+
+def _start(rc: RouteClass):
+    global _heavy_inflight
+    rc.inflight += 1
+    _heavy_inflight += 1
+
+
+def _wake():
+    """Wpuszcza oczekujących w kolejności priorytetu, dopóki są wolne miejsca."""
+    skipped = []
+    while _waiters and _heavy_inflight < HEAVY_TOTAL:
+        item = heapq.heappop(_waiters)
+        _, _, future, rc = item
+        if future.done():
+            continue
+        if rc.inflight < rc.limit:
+            _start(rc)
+            future.set_result(True)
+        else:
+            skipped.append(item)   # klasa wysycona — niech czeka, nie blokując innych klas
+    for item in skipped:
+        heapq.heappush(_waiters, item)
+
+
+def _publish(rc: RouteClass):
+    QUEUE_DEPTH.set(rc.queued, queue=f"admission_{rc.name}")
+
+
+async def acquire(rc: RouteClass):
+    """Czeka na miejsce dla klasy albo rzuca Rejected (kolejka pełna / za długie czekanie)."""
+    if _can_run(rc) and not any(w[3] is rc or w[0] < rc.priority for w in _waiters if not w[2].done()):
+        _start(rc)
+        return
+    if rc.queued >= rc.max_queue:
+        rc.shed += 1
+        ADMISSION_SHED.inc(route_class=rc.name, reason="queue_full")
+        raise Rejected(rc, "queue_full")
+
+    future = asyncio.get_running_loop().create_future()
+    heapq.heappush(_waiters, (rc.priority, next(_seq), future, rc))
+    rc.queued += 1
+    _publish(rc)
+    _wake()   # oczekujący wyżej mogą być zablokowani limitem własnej klasy
+    try:
+        await asyncio.wait_for(asyncio.shield(future), timeout=rc.max_wait)
+    except asyncio.TimeoutError:
+        if future.done():   # miejsce przyznane w ostatniej chwili — bierzemy je
+            return
+        future.cancel()
+        rc.shed += 1
+        ADMISSION_SHED.inc(route_class=rc.name, reason="timeout")
+        raise Rejected(rc, "timeout")
+    except BaseException:
+        # klient się rozłączył: oddaj miejsce, jeśli zostało już przyznane
+        if future.done() and not future.cancelled():
+            release(rc, 0.0, record=False)
+        else:
+            future.cancel()
+        raise
+    finally:
+        rc.queued -= 1
+        _publish(rc)
+
+
+def release(rc: RouteClass, elapsed_s: float, record: bool = True):
+    global _heavy_inflight
+    rc.inflight -= 1
+    _heavy_inflight -= 1
+    if record:
+        rc.ewma_s = elapsed_s if rc.ewma_s is None else 0.8 * rc.ewma_s + 0.2 * elapsed_s
+    _wake()
+
+
+class admitted:
+    """`async with admitted(rc):` — miejsce w klasie na czas obsługi żądania."""
+
+    def __init__(self, rc: RouteClass):
+        self.rc = rc
+
+    async def __aenter__(self):
+        await acquire(self.rc)
+        self.t0 = time.perf_counter()
+
+    async def __aexit__(self, *exc):
+        release(self.rc, time.perf_counter() - self.t0)
+
+
+def stats() -> dict:
+    """In-flight / w kolejce / odrzucone per klasa (dla /admin/health)."""
+    return {
+        "heavy_inflight": _heavy_inflight,
+        "heavy_limit": HEAVY_TOTAL,
+        "classes": {
+            rc.name: {
+                "inflight": rc.inflight,
+                "queued": rc.queued,
+                "limit": rc.limit,
+                "max_queue": rc.max_queue,
+                "shed": rc.shed,
+                "avg_s": round(rc.ewma_s, 3) if rc.ewma_s is not None else None,
+            }
+            for rc in CLASSES.values()
+        },
+    }
@@ -1,40 +1,67 @@
 # app/ai_chat.py
+import html
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextvars import copy_context
 from typing import List, Dict
+from app import cache, extractive_qa, model_router
 from app.elasticsearch_utils import search as es_search, check_connection
-from app.vertex_utils import summarize_text  # użyjemy go jako stabilnego generatora (Gemini/Bison)
+from app.vertex_utils import summarize_text, ACTIVE_MODEL  # użyjemy go jako stabilnego generatora (Gemini/Bison)
+from app.prompt_builder import select_context, budget_for, estimate_tokens
 from app.pdf_utils import extract_text_from_pdf
+from app.tracing import span
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
+QA_MODES = ("extractive", "generative", "auto")
+QA_LATENCY_BUDGET_MS = float(os.getenv("QA_LATENCY_BUDGET_MS", "8000"))
+_llm_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="qa-llm")
+
 SYSTEM_RULES = (
     "You are a helpful assistant for Q&A over a document collection. "
     "Answer concisely and ONLY from the provided context. "
     "If the answer is not in the context, say you don't know."
 )
 
+def _plain(fragment: str) -> str:
+    """Fragment z highlightu ES (encoder html, znaczniki <em>) → czysty tekst do promptu."""
+    return html.unescape(re.sub(r"</?em>", "", fragment))
+
 def get_context_for_query(query: str, k: int = 5) -> List[Dict]:
     """
     Pobierz top-k dokumentów z ES. Jeśli ES niedostępny, kontekst = pusty.
     """
-    if not check_connection():
-        return []
-
-    results = es_search(query) or []
-    # Bierzemy filename + summary (jeśli brak summary, spróbujmy krótki preview)
-    ctx = []
-    for r in results[:k]:
-        ctx.append({
-            "filename": r.get("filename", "unknown"),
-            "summary": r.get("summary", "") or r.get("content", "")[:600]
-        })
-    return ctx
-
-def build_prompt(question: str, context_docs: List[Dict]) -> str:
+    with span("get_context_for_query", k=k) as sp:
+        if not check_connection():
+            return []
+
+        results = es_search(query) or []
+        # Bierzemy filename + summary (jeśli brak summary, spróbujmy krótki preview)
+        ctx = []
+        for r in results[:k]:
+            ctx.append({
+                "doc_id": r.get("doc_id"),
+                "filename": r.get("filename", "unknown"),
+                "summary": r.get("summary", "") or _plain(" … ".join(r.get("highlight", [])))[:600],
+                "score": r.get("_score") or 0.0,
+            })
+        sp.set(docs=len(ctx), context_chars=sum(len(d["summary"]) for d in ctx))
+        return ctx
+
+def build_prompt(question: str, context_docs: List[Dict], budget_tokens: int | None = None) -> str:
     """
     Zbuduj prompt: system rules + pozycje kontekstu + pytanie.
+    Kontekst jest deduplikowany i przycinany do budżetu tokenów modelu.
     """
+    selected = select_context(
+        context_docs, budget_tokens or budget_for(ACTIVE_MODEL), text_key="summary"
+    )
     context_block = "\n".join(
         f"- [{i+1}] {d['filename']}: {d['summary']}"
-        for i, d in enumerate(context_docs)
+        for i, d in enumerate(selected)
     ) or "(no context)"
 
     prompt = (
@@ -45,12 +72,56 @@ def build_prompt(question: str, context_docs: List[Dict]) -> str:
     )
     return prompt
 
-def answer_question(question: str) -> Dict:
+def _generate(question: str, ctx: List[Dict], latency_budget_ms: float | None = None) -> str:
+    with span("build_prompt") as psp:
+        prompt = build_prompt(question, ctx)
+        psp.set(prompt_chars=len(prompt), prompt_tokens_est=estimate_tokens(prompt))
+    return summarize_text(prompt, max_length=600, task="answer", latency_budget_ms=latency_budget_ms)
+
+def answer_question(question: str, mode: str = "auto", latency_budget_ms: float | None = None) -> Dict:
     """
-    Zwraca: { 'answer': str, 'sources': [filenames] }
+    Zwraca: { 'answer': str, 'sources': [filenames], 'mode': str, 'citations': [...] (extractive) }
+    mode: extractive — zdania z dokumentów (bez LLM); generative — LLM;
+    auto — LLM, o ile zmieści się w budżecie opóźnienia, inaczej (albo po przekroczeniu) extractive.
     """
-    ctx = get_context_for_query(question, k=5)
-    prompt = build_prompt(question, ctx)
-    answer = summarize_text(prompt, max_length=600) or "I don't know based on the available context."
-    sources = [d["filename"] for d in ctx]
-    return {"answer": answer, "sources": sources}
\ No newline at end of file
+    budget = latency_budget_ms or QA_LATENCY_BUDGET_MS
+    answers = cache.namespace("answer")
+    key = cache.make_key("qa", mode, question)
+    cached = answers.get(key)
+    if cached:
+        return cached
+    result = _answer_question(question, mode, budget)
+    if not result.get("fallback"):  # awaryjnych odpowiedzi (timeout LLM) nie zapamiętujemy
+        answers.set(key, result)
+    return result
+
+def _answer_question(question: str, mode: str, budget: float) -> Dict:
+    with span("answer_question", question_chars=len(question), mode=mode) as sp:
+        ctx = get_context_for_query(question, k=5)
+        sources = [d["filename"] for d in ctx]
+
+        if mode == "extractive":
+            return extractive_qa.answer(question, ctx)
+
+        if mode == "generative":
+            answer = _generate(question, ctx) or "I don't know based on the available context."
+            sp.set(answer_chars=len(answer))
+            return {"answer": answer, "sources": sources, "mode": "generative"}
+
+        # auto: nie czekamy na LLM, który i tak nie zdąży (wolny / wyłączony / niedostępny)
+        if not model_router.fits_budget("answer", budget):
+            sp.set(fallback="no_model_in_budget")
+            return {**extractive_qa.answer(question, ctx), "fallback": "no_model_in_budget"}
+
+        future = _llm_pool.submit(copy_context().run, _generate, question, ctx, budget)
+        try:
+            answer = future.result(timeout=budget / 1000)
+        except FutureTimeout:
+            logger.info("[QA] LLM exceeded %.0f ms – answering extractively", budget)
+            sp.set(fallback="timeout")
+            return {**extractive_qa.answer(question, ctx), "fallback": "timeout"}
+        if not answer:
+            sp.set(fallback="empty_answer")
+            return {**extractive_qa.answer(question, ctx), "fallback": "empty_answer"}
+        sp.set(answer_chars=len(answer))
+        return {"answer": answer, "sources": sources, "mode": "generative"}
@@ -1,23 +1,30 @@
 from app.vertex_utils import summarize_text, generate_embedding
 from app.pdf_utils import extract_text_from_pdf
+from app.metrics import timed, timed_stage
+from app.tracing import traced, span, current_span
+from app.prompt_builder import clean_passage, select_context, compact_prompt, budget_for
+import hashlib
 import logging
 import re
-import random
 from collections import Counter
-from langdetect import detect, DetectorFactory
+from app import cache
+from app.lang_id import identify
 
 logger = logging.getLogger(__name__)
-DetectorFactory.seed = 0  # stabilniejsze wyniki
 
 # =============================
 # 🧠 ANALIZA PDF
 # =============================
-def analyze_pdf(path_or_bytes) -> str:
+@timed_stage("summarization")
+def analyze_pdf(path_or_bytes=None, text: str | None = None) -> str:
     """Generate a meaningful summary for the document using Vertex AI if available,
-    otherwise keyword-based local summary. Automatically matches document language."""
+    otherwise keyword-based local summary. Automatically matches document language.
+    Pass `text` when it has already been extracted to skip re-reading the PDF."""
     try:
         # 1️⃣ Extract text
-        if isinstance(path_or_bytes, (bytes, bytearray)):
+        if text is not None:
+            pass
+        elif isinstance(path_or_bytes, (bytes, bytearray)):
             text = path_or_bytes.decode("utf-8", errors="ignore")
         else:
             text = extract_text_from_pdf(path_or_bytes)
@@ -25,23 +32,23 @@ def analyze_pdf(path_or_bytes) -> str:
         if not text or len(text.strip()) == 0:
             return "Brak treści w pliku PDF."
 
-        text = re.sub(r"\s+", " ", text.replace("\n", " ")).strip()
-        text = text[:15000]
+        text = clean_passage(text)
 
         # 2️⃣ Detect language
         lang = detect_language(text)
         logger.info(f"[AI] Detected language: {lang}")
 
-        # 3️⃣ Try Vertex AI summary
-        prompt_prefix = {
-            "pl": "Streść poniższy tekst w kilku zdaniach w języku polskim:",
-            "en": "Summarize the following text in English in a few sentences:",
-            "de": "Fasse den folgenden Text auf Deutsch in wenigen Sätzen zusammen:",
-        }.get(lang, "Summarize the following text briefly:")
-
-        summary = summarize_text(f"{prompt_prefix}\n\n{text}")
-        if summary and summary.strip():
-            return summary.strip()
+        # 3️⃣ Try Vertex AI summary (map-reduce dla długich dokumentów); cache po hashu tekstu
+        from app.summarizer import map_reduce_summarize
+        summaries = cache.namespace("summary")
+        key = cache.make_key(lang, hashlib.sha256(text.encode("utf-8")).hexdigest())
+        summary = summaries.get(key)
+        if summary:
+            return summary
+        summary = (map_reduce_summarize(text, lang) or "").strip()
+        if summary:
+            summaries.set(key, summary)
+            return summary
 
         # 4️⃣ Local fallback (keyword-based)
         words = re.findall(r"\b\w{5,}\b", text.lower())
@@ -79,126 +86,45 @@ def analyze_pdf(path_or_bytes) -> str:
 # =============================
 # 🌍 DETEKCJA JĘZYKA
 # =============================
+@timed_stage("language_detection")
 def detect_language(text: str) -> str:
-    """Detect dominant language of text, cleaning spacing and diacritics."""
-    try:
-        if not text or len(text.strip()) < 50:
-            return "unknown"
-
-        clean = re.sub(r"[\n\r\t]", " ", text)
-        clean = re.sub(r"[^A-Za-zĄąĆćĘęŁłŃńÓóŚśŹźŻż ]", " ", clean)
-        clean = re.sub(r"\s+", " ", clean).strip()
-
-        lang = detect(clean)
-        print(f"[LANG DEBUG RESULT] {lang}")
-        return lang
-    except Exception as e:
-        print(f"[LANG ERROR] {e}")
-
-        if re.search(r"[ĄąĆćĘęŁłŃńÓóŚśŹźŻż]", text):
-            return "pl"
-        elif re.search(r"[ßüöä]", text):
-            return "de"
-        elif re.search(r"[àâçéèêëîïôùûüÿœ]", text):
-            return "fr"
-        else:
-            return "unknown"
+    """Detect dominant language of text (sampled n-gram profile, memoised — see app.lang_id)."""
+    result = identify(text)
+    logger.debug("[LANG] detected=%s confidence=%s", result["lang"], result["confidence"])
+    return result["lang"]
 
 
 # =============================
 # 🤖 AI SMART FOLDER CLUSTERING
 # =============================
-def suggest_dynamic_folders(docs: list[dict]) -> list[dict]:
-    """Vertex AI-based semantic clustering of documents into folders."""
-    from sklearn.cluster import KMeans
-    import numpy as np
-
-    if not docs:
-        return []
-
-    print("[AI] Step 1: Preparing documents...")
-
-    # Limit for performance
-    if len(docs) > 20:
-        docs = docs[:20]
-        print("[AI] Too many docs, limited to 20 for faster clustering.")
-
-    vectors, filenames, summaries = [], [], []
-
-    print("[AI] Step 2: Generating embeddings...")
-    for d in docs:
-        text = f"{d.get('filename','')} - {d.get('summary','')}"
-        emb = generate_embedding(text)
-        if not emb:
-            emb = [random.random() for _ in range(256)]  # fallback
-        vectors.append(emb)
-        filenames.append(d.get("filename"))
-        summaries.append(d.get("summary", ""))
-
-    if not vectors:
-        print("[AI Folder Clustering] No embeddings available.")
-        return [{"folder": "📁 Uncategorized", "files": [d["filename"] for d in docs]}]
-
-    print("[AI] Step 3: Clustering embeddings...")
-    n_clusters = min(5, len(vectors))
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init="auto")
-    labels = kmeans.fit_predict(vectors)
-
-    clustered = {}
-    for label, name, summary in zip(labels, filenames, summaries):
-        clustered.setdefault(label, []).append({"name": name, "summary": summary})
-
-    print("[AI] Step 4: Naming folders...")
-    folders = []
-    for idx, docs_in_cluster in clustered.items():
-        text_block = "\n".join(f"- {d['name']}: {d['summary'][:200]}" for d in docs_in_cluster)
-        prompt = f"""
-        You are an AI assistant that assigns thematic folder names to document groups.
-        Suggest a short, clear folder name (max 3 words) describing this group of documents:
-
-        {text_block}
-
-        Return only the folder name, no extra text.
-        """
-        folder_name = summarize_text(prompt).strip().replace('"', "")
-        if not folder_name or len(folder_name) < 3:
-            folder_name = f"Category {idx+1}"
-        folders.append({
-            "folder": folder_name,
-            "files": [d["name"] for d in docs_in_cluster],
-        })
-
-    # --- 🔹 Ensure "Uncategorized" folder exists ---
-    print("[AI] Step 5: Adding Uncategorized folder if needed...")
-    all_files = {d["filename"] for d in docs}
-    clustered_files = {f for c in folders for f in c["files"]}
-    uncategorized = list(all_files - clustered_files)
-
-    if uncategorized:
-        folders.append({
-            "folder": "📁 Uncategorized",
-            "files": uncategorized
-        })
-        print(f"[AI] Added Uncategorized folder for {len(uncategorized)} unclassified documents.")
-
-    print("[AI Folder Clustering Result]", folders)
-    return folders
+def suggest_dynamic_folders(docs: list[dict] | None = None) -> list[dict]:
+    """Semantic clustering of the whole corpus into folders (see app.clustering).
+    `docs` is accepted for backwards compatibility and ignored — the engine works
+    on the stored embedding matrix instead of a truncated document list."""
+    from app.clustering import suggest_folders
+    return suggest_folders()
 
 # =============================
 # 💬 ASK AI (context-aware Q&A in English)
 # =============================
+@traced("ask_ai")
 def ask_ai(query: str) -> dict:
     """
     Understands the user's question in any language,
     retrieves relevant document summaries from Elasticsearch,
     and generates a natural language answer using Vertex AI.
     """
-    from app.elasticsearch_utils import es, ES_INDEX, check_connection
-    from app.vertex_utils import summarize_text
+    from app.elasticsearch_utils import es, ES_INDEX, check_connection, search_body
+    from app.vertex_utils import summarize_text, ACTIVE_MODEL
+
+    answers = cache.namespace("answer")
+    cached = answers.get(cache.make_key("ask_ai", query))
+    if cached:
+        return cached
 
     # 1️⃣ Detect language of the query
     lang = detect_language(query)
-    print(f"[ASK AI] Detected query language: {lang}")
+    logger.debug("[ASK AI] Detected query language: %s", lang)
 
     # 2️⃣ Check Elasticsearch connection
     if not check_connection():
@@ -206,21 +132,14 @@ def ask_ai(query: str) -> dict:
 
     # 3️⃣ Retrieve top matching documents from Elasticsearch
     try:
-        search_body = {
-            "query": {
-                "multi_match": {
-                    "query": query,
-                    "fields": ["filename^3", "summary^2", "content"],
-                    "fuzziness": "AUTO"
-                }
-            },
-            "size": 5
-        }
+        body = search_body(query, size=5, highlight=False)
+        body["query"]["multi_match"]["fuzziness"] = "AUTO"
 
-        results = es.search(index=ES_INDEX, body=search_body)
+        with timed("es_search"):
+            results = es.search(index=ES_INDEX, body=body)
         hits = results.get("hits", {}).get("hits", [])
     except Exception as e:
-        print(f"[ASK AI ERROR] {e}")
+        logger.error("[ASK AI ERROR] %s", e)
         return {"answer": f"Search error: {e}", "sources": []}
 
     # 4️⃣ Handle no search results
@@ -233,17 +152,23 @@ def ask_ai(query: str) -> dict:
         Suggest alternative keywords or explain what type of document might contain the answer.
         Respond in English or in the same language as the question.
         """
-        suggestion = summarize_text(fallback_prompt)
+        suggestion = summarize_text(compact_prompt(fallback_prompt), task="answer")
         return {
             "answer": suggestion or "No relevant documents were found.",
             "sources": []
         }
 
     # 5️⃣ Build context for the AI model
-    context_text = "\n\n".join(
-        f"📄 {h['_source'].get('filename')}\n{h['_source'].get('summary', '')[:600]}"
-        for h in hits
-    )
+    with span("build_prompt") as sp:
+        selected = select_context(
+            [
+                {"filename": h["_source"].get("filename"), "text": h["_source"].get("summary", ""), "score": h.get("_score")}
+                for h in hits
+            ],
+            budget_for(ACTIVE_MODEL),
+        )
+        context_text = "\n\n".join(f"📄 {d['filename']}\n{d['text']}" for d in selected)
+        sp.set(docs=len(selected), context_chars=len(context_text))
 
     # 6️⃣ Multilingual prompt templates
     prompts = {
@@ -295,21 +220,30 @@ def ask_ai(query: str) -> dict:
     }
 
     # 7️⃣ Choose prompt based on detected language
-    prompt_text = prompts.get(lang, prompts["en"])
+    prompt_text = compact_prompt(prompts.get(lang, prompts["en"]))
 
-    # 8️⃣ Ask Vertex AI for an answer
-    answer = summarize_text(prompt_text)
-    print("🔍 Vertex returned:", repr(answer))
-
-    if not answer or len(answer.strip()) < 5 or "I couldn`t" in answer:
-        fallback_sources = [h["_source"].get("filename", "") for h in hits]
-        answer = f"Based on your query, I found the following relevant documents: {', '.join(fallback_sources)}."
+    # 8️⃣ Ask Vertex AI for an answer (tylko gdy jakiś model zdąży w budżecie)
+    from app import model_router
+    answer = summarize_text(prompt_text, task="answer") if model_router.fits_budget("answer") else ""
+    logger.debug("[ASK AI] Vertex answer chars=%d", len(answer or ""))
 
     # 9️⃣ Prepare list of document sources
     sources = [h["_source"].get("filename", "") for h in hits]
 
+    if not answer or len(answer.strip()) < 5 or "I couldn`t" in answer:
+        # bez LLM: najlepsze zdania ze znalezionych dokumentów, z numerami stron
+        from app import extractive_qa
+        extractive = extractive_qa.answer(
+            query, [{"doc_id": h["_source"].get("doc_id"), "filename": h["_source"].get("filename", "")} for h in hits]
+        )
+        current_span().set(answer_chars=len(extractive["answer"]), extractive=True)
+        return {"answer": extractive["answer"], "sources": sources, "citations": extractive["citations"]}
+
     # 10️⃣ Return structured response
-    return {
+    current_span().set(answer_chars=len(answer))
+    result = {
         "answer": answer.strip(),
         "sources": sources
-    }
\ No newline at end of file
+    }
+    answers.set(cache.make_key("ask_ai", query), result)
+    return result
\ No newline at end of file
@@ -0,0 +1,278 @@
+# app/bulk_import.py
+"""
+Import masowy: katalog albo archiwum ZIP/TAR → równoległy pipeline ingestu.
+
+- pliki są czytane strumieniowo i kopiowane (z liczeniem SHA-256) prosto do
+  uploaded_pdfs — archiwum nie jest rozpakowywane na dysk w całości,
+- identyczna treść (hash) jest pomijana; prawie-duplikaty obsługuje ingest (MinHash),
+- plik o nazwie istniejącego dokumentu dostaje sufiks z hasha — nową wersją tamtego
+  dokumentu zostaje tylko na wyraźne żądanie (`versions=True`, --versions),
+- stan każdego pliku trafia do SQLite (import_items), więc ponowne uruchomienie dla
+  tego samego źródła pomija pliki zakończone i dokańcza te przerwane w trakcie ingestu,
+- przepustowość (dokumenty/s) jest w logach, w statusie zadania i w wyniku CLI.
+
+CLI:  python -m app.bulk_import <katalog | plik.zip | plik.tar[.gz]> [--workers 4] [--versions]
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import tarfile
+import threading
+import time
+import unicodedata
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+
+from app import db
+from app.ingest import ingest_document, store_upload
+from app.metrics import QUEUE_DEPTH
+from app.tracing import span
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+UPLOAD_FOLDER = BASE_DIR / "uploaded_pdfs"
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "4"))
+COPY_CHUNK = 1024 * 1024
+PROGRESS_EVERY = 25
+
+_live: dict = {}          # job_id → bieżące statystyki uruchomionych zadań
+_live_lock = threading.Lock()
+
+
+def job_id_for(source: Path) -> str:
+    """Stały identyfikator źródła — ten sam katalog/archiwum wznawia to samo zadanie."""
+    return hashlib.sha1(str(source.resolve()).encode("utf-8")).hexdigest()[:16]
+
+
+def _wanted(name: str) -> bool:
+    base = PurePosixPath(name).name
+    return base.lower().endswith(".pdf") and not base.startswith("._") and "__MACOSX" not in name
+
+
+def iter_members(source: Path):
+    """Kolejne (nazwa, strumień binarny); strumień jest ważny tylko do następnego kroku."""
+    if source.is_dir():
+        for path in sorted(source.rglob("*")):
+            if path.is_file() and _wanted(path.name):
+                with open(path, "rb") as f:
+                    yield path.relative_to(source).as_posix(), f
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as zf:
+            for info in zf.infolist():
+                if not info.is_dir() and _wanted(info.filename):
+                    with zf.open(info) as f:
+                        yield info.filename, f
+    elif tarfile.is_tarfile(source):
+        with tarfile.open(source, mode="r|*") as tf:  # tryb strumieniowy (także .tar.gz / .tar.bz2)
+            for member in tf:
+                if member.isfile() and _wanted(member.name):
+                    f = tf.extractfile(member)
+                    if f is not None:
+                        yield member.name, f
+    else:
+        raise ValueError(f"Unsupported import source: {source}")
+
+
+def _spool(stream, tmp: Path) -> str:
+    """Kopiuje strumień do pliku tymczasowego kawałkami, licząc SHA-256."""
+    h = hashlib.sha256()
+    with open(tmp, "wb") as out:
+        while chunk := stream.read(COPY_CHUNK):
+            h.update(chunk)
+            out.write(chunk)
+    return h.hexdigest()
+
+
+def _target_name(member: str, content_hash: str, taken: set, versions: bool = False) -> str:
+    """
+    Nazwa w uploaded_pdfs; kolizja → sufiks z hasha: w obrębie importu (inne katalogi),
+    z plikiem na dysku albo z istniejącym dokumentem (chyba że `versions` — wtedy ta sama
+    nazwa zostaje i plik staje się nową wersją dokumentu).
+    """
+    name = unicodedata.normalize("NFKD", PurePosixPath(member).name)
+    existing = db.get_document(name)
+    clash = (existing is not None and not versions) or (existing is None and (UPLOAD_FOLDER / name).exists())
+    if name in taken or clash:
+        stem, suffix = os.path.splitext(name)
+        name = f"{stem}-{content_hash[:8]}{suffix}"
+    taken.add(name)
+    return name
+
+
+def run_import(source, workers: int = IMPORT_WORKERS, job_id: str | None = None, versions: bool = False) -> dict:
+    """Importuje wszystkie PDF-y ze źródła; zwraca statystyki (łącznie z docs_per_sec).
+    `versions`: plik o nazwie istniejącego dokumentu to jego nowa wersja (domyślnie — osobny dokument)."""
+    source = Path(source)
+    job_id = job_id or job_id_for(source)
+    db.start_import_job(job_id, str(source))
+    checkpoint = db.get_import_items(job_id)
+    UPLOAD_FOLDER.mkdir(exist_ok=True)
+
+    stats = {"job_id": job_id, "source": str(source), "status": "running", "seen": 0, "resumed": 0,
+             "imported": 0, "duplicates": 0, "failed": 0, "pending": 0, "docs_per_sec": 0.0}
+    with _live_lock:
+        _live[job_id] = stats
+    lock = threading.Lock()
+    slots = threading.BoundedSemaphore(workers * 2)   # ile plików może czekać na ingest
+    taken: set = set()
+    t0 = time.perf_counter()
+
+    def _update_rate():
+        elapsed = time.perf_counter() - t0
+        stats["elapsed_s"] = round(elapsed, 2)
+        stats["docs_per_sec"] = round(stats["imported"] / elapsed, 2) if elapsed else 0.0
+
+    def _ingest(member, dest, filename, doc_id, content_hash):
+        try:
+            ingest_document(dest, filename, doc_id, content_hash)
+            db.set_import_item(job_id, member, "done", content_hash, filename)
+            outcome = "imported"
+        except Exception as e:
+            logger.warning("[IMPORT] ❌ %s: %s", member, e)
+            db.set_import_item(job_id, member, "failed", content_hash, filename, str(e))
+            outcome = "failed"
+        finally:
+            slots.release()
+        with lock:
+            stats[outcome] += 1
+            stats["pending"] -= 1
+            QUEUE_DEPTH.set(stats["pending"], queue="import")
+            _update_rate()
+            if (stats["imported"] + stats["failed"]) % PROGRESS_EVERY == 0:
+                logger.info("[IMPORT] %s: %d imported, %d duplicates, %d failed — %.2f docs/s",
+                            job_id, stats["imported"], stats["duplicates"], stats["failed"], stats["docs_per_sec"])
+
+    def _submit(member, dest, filename, doc_id, content_hash):
+        with lock:
+            stats["pending"] += 1
+            QUEUE_DEPTH.set(stats["pending"], queue="import")
+        pool.submit(_ingest, member, dest, filename, doc_id, content_hash)
+
+    status = "completed"
+    try:
+        with span("bulk_import", source=str(source)) as sp, \
+                ThreadPoolExecutor(max_workers=workers, thread_name_prefix="import") as pool:
+            for member, stream in iter_members(source):
+                stats["seen"] += 1
+                previous = checkpoint.get(member)
+                if previous and previous["status"] in ("done", "duplicate"):
+                    stats["resumed"] += 1
+                    continue
+
+                slots.acquire()
+                tmp = UPLOAD_FOLDER / f".import-{uuid.uuid4().hex}.part"
+                try:
+                    content_hash = _spool(stream, tmp)
+
+                    # przerwany w trakcie ingestu: plik i wpis już są — tylko dokończ ingest
+                    if previous and previous["status"] in ("stored", "failed") and previous["content_hash"] == content_hash:
+                        rec = db.get_document(previous["filename"])
+                        if rec and rec["content_hash"] == content_hash:
+                            tmp.unlink(missing_ok=True)
+                            _submit(member, Path(rec["filepath"]), rec["filename"], rec["doc_id"], content_hash)
+                            continue
+
+                    duplicate = db.find_by_content_hash(content_hash)
+                    if duplicate:
+                        tmp.unlink(missing_ok=True)
+                        slots.release()
+                        db.set_import_item(job_id, member, "duplicate", content_hash, duplicate["filename"])
+                        with lock:
+                            stats["duplicates"] += 1
+                        continue
+
+                    filename = _target_name(member, content_hash, taken, versions)
+                    existing = db.get_document(filename)  # tylko przy versions=True: nowa wersja
+                    dest, doc_id = store_upload(filename, UPLOAD_FOLDER / filename, existing, tmp, content_hash)
+                    db.set_import_item(job_id, member, "stored", content_hash, filename)
+                    _submit(member, dest, filename, doc_id, content_hash)
+                except Exception as e:
+                    tmp.unlink(missing_ok=True)
+                    slots.release()
+                    logger.warning("[IMPORT] ❌ %s: %s", member, e)
+                    db.set_import_item(job_id, member, "failed", error=str(e))
+                    with lock:
+                        stats["failed"] += 1
+            sp.set(seen=stats["seen"])
+        if stats["failed"]:
+            status = "completed_with_errors"
+    except Exception as e:
+        logger.error("[IMPORT] ❌ job %s aborted: %s", job_id, e)
+        status = "failed"
+        stats["error"] = str(e)
+        raise
+    finally:
+        _update_rate()
+        stats["status"] = status
+        QUEUE_DEPTH.set(0, queue="import")
+        db.finish_import_job(job_id, status, stats)
+        with _live_lock:
+            _live.pop(job_id, None)
+        logger.info("[IMPORT] %s %s: %d imported, %d duplicates, %d failed, %d resumed in %.1fs (%.2f docs/s)",
+                    job_id, status, stats["imported"], stats["duplicates"], stats["failed"],
+                    stats["resumed"], stats["elapsed_s"], stats["docs_per_sec"])
+    return stats
+
+
+def start_import(source, workers: int = IMPORT_WORKERS, cleanup: bool = False, versions: bool = False) -> str:
+    """Uruchamia import w wątku w tle; zwraca job_id (dla już działającego zadania — ten sam).
+    `cleanup` usuwa źródło po udanym imporcie (archiwa przesłane przez API)."""
+    source = Path(source)
+    job_id = job_id_for(source)
+    with _live_lock:
+        if job_id in _live:
+            return job_id
+        _live[job_id] = {"job_id": job_id, "source": str(source), "status": "starting"}
+
+    def _run():
+        try:
+            stats = run_import(source, workers, job_id, versions)
+            if cleanup and stats["status"] == "completed":
+                source.unlink(missing_ok=True)
+        except Exception:
+            pass  # zalogowane i zapisane w import_jobs przez run_import
+        finally:
+            with _live_lock:
+                _live.pop(job_id, None)
+
+    threading.Thread(target=_run, name=f"import-{job_id}", daemon=True).start()
+    return job_id
+
+
+def job_status(job_id: str):
+    """Bieżące statystyki (zadanie w toku) albo ostatni zapis z SQLite."""
+    with _live_lock:
+        live = dict(_live[job_id]) if job_id in _live else None
+    stored = db.get_import_job(job_id)
+    if stored is None and live is None:
+        return None
+    result = stored or {"job_id": job_id}
+    if live is not None:
+        result = {**result, "status": live.get("status", "running"), "stats": live}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import PDFs from a directory or a ZIP/TAR archive.")
+    parser.add_argument("source", type=Path)
+    parser.add_argument("--workers", type=int, default=IMPORT_WORKERS)
+    parser.add_argument("--job-id", help="resume a specific job (default: derived from the source path)")
+    parser.add_argument("--versions", action="store_true",
+                        help="treat files named like existing documents as their new versions")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s %(levelname)s %(name)s %(message)s",
+    )
+    stats = run_import(args.source, args.workers, args.job_id, args.versions)
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
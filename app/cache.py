@@ -0,0 +1,324 @@
+# app/cache.py
+"""
+Wspólna warstwa cache z wymiennym backendem (CACHE_BACKEND):
+
+- memory — LRU w procesie (domyślnie; jeden worker),
+- sqlite — plik współdzielony przez wszystkie workery na węźle (CACHE_PATH, WAL),
+- redis  — dowolny serwer mówiący protokołem Redis (CACHE_URL=redis://host:6379/0);
+  klient RESP jest wbudowany, bez pakietu redis.
+
+Klucze są w przestrzeniach nazw z własnym TTL (NAMESPACE_TTLS, nadpisywane przez
+CACHE_TTL_<NAZWA>), wartości serializowane do JSON. Backendy memory i sqlite usuwają
+najdawniej używane wpisy po przekroczeniu CACHE_MAX_BYTES; redis — polityką maxmemory
+serwera. Trafienia / pudła idą do liczników cache (/admin/health, /metrics).
+
+    text = cache.namespace("pdf_text").get_or_set(key, lambda: extract(...))
+"""
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from urllib.parse import urlparse
+
+from app.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")     # memory | sqlite | redis
+CACHE_PATH = Path(os.getenv("CACHE_PATH", BASE_DIR / "runtime" / "cache.db"))
+CACHE_URL = os.getenv("CACHE_URL", "redis://localhost:6379/0")
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+NAMESPACE_TTLS = {          # sekundy
+    "pdf_text": 7 * 86400,      # klucz zawiera mtime/rozmiar pliku, więc może żyć długo
+    "summary": 30 * 86400,      # po hashu tekstu
+    "llm": 7 * 86400,           # odpowiedź modelu na identyczny prompt
+    "embedding": 30 * 86400,
+    "answer": 300,              # odpowiedzi Q&A zależą od indeksu — krótko
+    "suggest": 30,              # podpowiedzi przy wpisywaniu — nowe dokumenty widać po ~30 s
+}
+DEFAULT_TTL = 3600
+
+
+def make_key(*parts) -> str:
+    """Stabilny klucz z dowolnych części (długie teksty → hash)."""
+    raw = "\x1f".join(str(p) for p in parts)
+    return raw if len(raw) <= 120 else hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class MemoryBackend:
+    """LRU w procesie z limitem bajtów i TTL per wpis."""
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.items: "OrderedDict[str, tuple]" = OrderedDict()   # klucz → (wartość, wygasa, rozmiar)
+        self.lock = threading.Lock()
+
+    def get(self, key: str):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            if item[1] < time.time():
+                self._drop(key)
+                return None
+            self.items.move_to_end(key)
+            return item[0]
+
+    def set(self, key: str, value: str, ttl: float):
+        with self.lock:
+            if key in self.items:
+                self._drop(key)
+            self.items[key] = (value, time.time() + ttl, len(value))
+            self.size += len(value)
+            while self.size > self.max_bytes and self.items:
+                self._drop(next(iter(self.items)))
+
+    def delete(self, key: str):
+        with self.lock:
+            if key in self.items:
+                self._drop(key)
+
+    def _drop(self, key: str):
+        self.size -= self.items.pop(key)[2]
+
+    def stats(self) -> dict:
+        return {"entries": len(self.items), "bytes": self.size, "max_bytes": self.max_bytes}
+
+
+class SQLiteBackend:
+    """Plik SQLite (WAL) współdzielony przez procesy; eviction po accessed_at co EVICT_EVERY zapisów."""
+
+    EVICT_EVERY = 200
+
+    def __init__(self, path: Path = CACHE_PATH, max_bytes: int = CACHE_MAX_BYTES):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+        self.writes = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache(accessed_at)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = sqlite3.connect(str(self.path), timeout=5, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def get(self, key: str):
+        now = time.time()
+        row = self._conn().execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] < now:
+            self.delete(key)
+            return None
+        self._conn().execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key: str, value: str, ttl: float):
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cache (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, value, len(value), now + ttl, now),
+        )
+        self.writes += 1
+        if self.writes % self.EVICT_EVERY == 0:
+            self.evict()
+
+    def delete(self, key: str):
+        self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def evict(self):
+        """Usuwa wygasłe wpisy, a potem najdawniej używane, aż rozmiar zmieści się w limicie."""
+        conn = self._conn()
+        conn.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # najstarszy accessed_at, do którego suma rozmiarów pokrywa nadmiar
+        cutoff = conn.execute(
+            """
+            SELECT accessed_at FROM (
+                SELECT accessed_at, SUM(size) OVER (ORDER BY accessed_at) AS running FROM cache
+            ) WHERE running >= ? LIMIT 1
+            """,
+            (total - self.max_bytes,),
+        ).fetchone()[0]
+        conn.execute("DELETE FROM cache WHERE accessed_at <= ?", (cutoff,))
+        logger.debug("[CACHE] evicted entries accessed before %s", cutoff)
+
+    def stats(self) -> dict:
+        # bez zapytań — /admin/health nie robi I/O
+        return {"path": str(self.path), "max_bytes": self.max_bytes, "writes": self.writes}
+
+
+class RedisBackend:
+    """Minimalny klient RESP (GET / SET PX / DEL) — połączenie per wątek, ponowienie po zerwaniu."""
+
+    def __init__(self, url: str = CACHE_URL, timeout: float = 0.5):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.db = int((parsed.path or "/0").lstrip("/") or 0)
+        self.password = parsed.password
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.local.sock, self.local.file = sock, sock.makefile("rb")
+        if self.password:
+            self._roundtrip("AUTH", self.password)
+        if self.db:
+            self._roundtrip("SELECT", self.db)
+
+    def _roundtrip(self, *args):
+        parts = [str(a).encode("utf-8") if not isinstance(a, bytes) else a for a in args]
+        payload = b"*%d\r\n" % len(parts) + b"".join(b"$%d\r\n%s\r\n" % (len(p), p) for p in parts)
+        self.local.sock.sendall(payload)
+        return self._read()
+
+    def _read(self):
+        line = self.local.file.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode("utf-8")
+        if kind == b"-":
+            raise RuntimeError(rest.decode("utf-8"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self.local.file.read(length + 2)[:-2]
+            return data.decode("utf-8")
+        if kind == b"*":
+            return [self._read() for _ in range(int(rest))]
+        raise RuntimeError(f"Unexpected Redis reply: {line!r}")
+
+    def _command(self, *args):
+        for attempt in (0, 1):
+            try:
+                if getattr(self.local, "sock", None) is None:
+                    self._connect()
+                return self._roundtrip(*args)
+            except (OSError, ConnectionError):
+                self.local.sock = None
+                if attempt:
+                    raise
+
+    def get(self, key: str):
+        return self._command("GET", key)
+
+    def set(self, key: str, value: str, ttl: float):
+        self._command("SET", key, value, "PX", int(ttl * 1000))
+
+    def delete(self, key: str):
+        self._command("DEL", key)
+
+    def stats(self) -> dict:
+        return {"url": f"redis://{self.host}:{self.port}/{self.db}"}
+
+
+class Namespace:
+    """Przestrzeń nazw w cache: prefiks kluczy, własny TTL i liczniki trafień."""
+
+    def __init__(self, name: str, ttl: float):
+        self.name = name
+        self.ttl = ttl
+
+    def get(self, key: str):
+        try:
+            raw = backend().get(f"{self.name}:{key}")
+        except Exception as e:
+            logger.warning("[CACHE] get %s failed: %s", self.name, e)
+            raw = None
+        record_cache(self.name, raw is not None)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value, ttl: float | None = None):
+        try:
+            backend().set(f"{self.name}:{key}", json.dumps(value, ensure_ascii=False), ttl or self.ttl)
+        except Exception as e:
+            logger.warning("[CACHE] set %s failed: %s", self.name, e)
+
+    def delete(self, key: str):
+        try:
+            backend().delete(f"{self.name}:{key}")
+        except Exception as e:
+            logger.warning("[CACHE] delete %s failed: %s", self.name, e)
+
+    def get_or_set(self, key: str, compute, ttl: float | None = None):
+        """Wartość z cache albo `compute()` (zapisywana, o ile nie jest pusta)."""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            if value:
+                self.set(key, value, ttl)
+        return value
+
+
+_backend = None
+_namespaces: dict = {}
+_lock = threading.Lock()
+
+
+def backend():
+    global _backend
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                kind = CACHE_BACKEND.lower()
+                if kind == "sqlite":
+                    _backend = SQLiteBackend()
+                elif kind == "redis":
+                    _backend = RedisBackend()
+                else:
+                    _backend = MemoryBackend()
+                logger.info("[CACHE] backend: %s", type(_backend).__name__)
+    return _backend
+
+
+def set_backend(new_backend):
+    """Podmiana backendu (testy, konfiguracja w kodzie)."""
+    global _backend
+    with _lock:
+        _backend = new_backend
+
+
+def namespace(name: str) -> Namespace:
+    ns = _namespaces.get(name)
+    if ns is None:
+        ttl = float(os.getenv(f"CACHE_TTL_{name.upper()}", NAMESPACE_TTLS.get(name, DEFAULT_TTL)))
+        ns = _namespaces.setdefault(name, Namespace(name, ttl))
+    return ns
+
+
+def stats() -> dict:
+    """Stan backendu dla /admin/health (liczniki trafień są w metrics.cache_stats)."""
+    return {"backend": CACHE_BACKEND, **backend().stats()}
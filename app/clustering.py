@@ -0,0 +1,219 @@
+# app/clustering.py
+"""
+Silnik klastrowania dokumentów dla sugestii folderów AI.
+
+- embeddingi (filename + streszczenie) są liczone przy uploadzie i zapisywane w SQLite
+  oraz w magazynie int8/mmap (vector_store), a brakujące uzupełniane paczkami przy
+  pierwszym użyciu; klastrowanie czyta wektory blokami z mmapów magazynu, więc worker
+  nie trzyma w RAM-ie całej macierzy float32,
+- model MiniBatchKMeans jest douczany (`partial_fit`) nowymi dokumentami; pełne
+  dopasowanie (wybór k i start na próbce, potem przebieg po blokach) tylko gdy korpus
+  urósł o REFIT_GROWTH,
+- przypisania są cache'owane do czasu zmiany korpusu, a nazwy klastrów po sygnaturze
+  (najbliższe centroidowi dokumenty), więc LLM nazywa tylko klastry, które się zmieniły.
+"""
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app import db, vector_store
+from app.metrics import record_cache, timed
+from app.vertex_utils import generate_embedding, generate_embeddings, summarize_text
+
+logger = logging.getLogger(__name__)
+
+MIN_K, MAX_K = 2, 12
+K_SAMPLE = 2000          # próbka do wyboru k (silhouette)
+REFIT_GROWTH = 0.5       # pełny refit, gdy korpus urósł o >50% od ostatniego
+BACKFILL_BATCH = 500     # ile brakujących embeddingów liczymy na jedno wywołanie
+NAME_SAMPLE = 8          # ilu reprezentantów klastra trafia do promptu nazwy
+LABEL_BUDGET_MS = 1500   # nazwa folderu to 3 słowa — szybki model wystarcza
+UNCATEGORIZED = "📁 Uncategorized"
+
+_lock = threading.Lock()
+_state = {"model": None, "k": 0, "fitted_n": 0, "seen": set(), "dims": None, "result": None, "version": None}
+
+
+def _embedding_text(filename: str, summary: str) -> str:
+    return f"{filename or ''} - {summary or ''}"
+
+
+def _to_unit(vec):
+    import numpy as np
+    v = np.asarray(vec, dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return v / norm if norm else v
+
+
+def index_document(doc_id: str, filename: str, summary: str):
+    """Liczy i zapisuje embedding nowego dokumentu oraz dotrenowuje nim model (jeśli już istnieje)."""
+    vec = generate_embedding(_embedding_text(filename, summary))
+    if not vec:
+        return
+    unit = _to_unit(vec)
+    db.save_embedding(doc_id, unit.tobytes(), len(unit))
+    vector_store.add(doc_id, unit)
+    with _lock:
+        model = _state["model"]
+        if model is not None and _state["dims"] == len(unit):
+            model.partial_fit(unit[None, :])
+            _state["seen"].add(doc_id)
+        _state["result"] = None
+
+
+def _backfill_missing():
+    missing = db.documents_without_embedding(limit=BACKFILL_BATCH)
+    if not missing:
+        return
+    with timed("embedding_backfill") as sp:
+        vectors = generate_embeddings([_embedding_text(d["filename"], d["summary"]) for d in missing])
+        stored = 0
+        for d, vec in zip(missing, vectors):
+            if vec:
+                unit = _to_unit(vec)
+                db.save_embedding(d["doc_id"], unit.tobytes(), len(unit))
+                vector_store.add(d["doc_id"], unit)
+                stored += 1
+        sp.set(missing=len(missing), stored=stored)
+
+
+def _blocks(filename_by_id: dict):
+    """Bloki (doc_ids, X) z vector_store — tylko dokumenty, które są w bazie."""
+    for ids, X in vector_store.iter_vectors():
+        keep = [i for i, d in enumerate(ids) if d in filename_by_id]
+        if keep:
+            yield [ids[i] for i in keep], X[keep]
+
+
+def _sample(filename_by_id: dict, n: int):
+    """Losowe ≤K_SAMPLE wierszy korpusu (jeden przebieg po blokach)."""
+    import numpy as np
+    chosen = np.sort(np.random.default_rng(42).choice(n, size=min(n, K_SAMPLE), replace=False))
+    parts, offset = [], 0
+    for ids, X in _blocks(filename_by_id):
+        lo, hi = np.searchsorted(chosen, [offset, offset + len(ids)])
+        if hi > lo:
+            parts.append(X[chosen[lo:hi] - offset])
+        offset += len(ids)
+    return np.concatenate(parts)
+
+
+def _choose_k(sample, n: int) -> int:
+    from sklearn.cluster import MiniBatchKMeans
+    from sklearn.metrics import silhouette_score
+
+    upper = min(MAX_K, n - 1, max(MIN_K, int((n / 2) ** 0.5)))
+    if upper <= MIN_K:
+        return max(1, min(MIN_K, n))
+    best_k, best_score = MIN_K, -1.0
+    for k in range(MIN_K, upper + 1):
+        labels = MiniBatchKMeans(n_clusters=k, random_state=42, n_init=3, batch_size=1024).fit_predict(sample)
+        if len(set(labels)) < 2:
+            continue
+        score = silhouette_score(sample, labels, sample_size=min(1000, len(sample)), random_state=42)
+        if score > best_score:
+            best_k, best_score = k, score
+    return best_k
+
+
+def _fit(filename_by_id: dict, n: int):
+    """Pełne dopasowanie: wybór k i start na próbce, potem jeden przebieg `partial_fit` po blokach."""
+    from sklearn.cluster import MiniBatchKMeans
+    sample = _sample(filename_by_id, n)
+    k = _choose_k(sample, n)
+    model = MiniBatchKMeans(n_clusters=k, random_state=42, n_init=3, batch_size=1024).fit(sample)
+    if n > len(sample):
+        for _, X in _blocks(filename_by_id):
+            model.partial_fit(X)
+    logger.info("[CLUSTER] full fit n=%d k=%d", n, k)
+    return model, k
+
+
+def _cluster_name(signature: str, filenames: list, summaries: list, idx: int) -> str:
+    cached = db.get_cluster_name(signature)
+    record_cache("cluster_name", cached is not None)
+    if cached:
+        return cached
+    text_block = "\n".join(f"- {f}: {(s or '')[:200]}" for f, s in zip(filenames, summaries))
+    prompt = (
+        "You are an AI assistant that assigns thematic folder names to document groups.\n"
+        "Suggest a short, clear folder name (max 3 words) describing this group of documents:\n\n"
+        f"{text_block}\n\nReturn only the folder name, no extra text."
+    )
+    name = (summarize_text(prompt, task="label", latency_budget_ms=LABEL_BUDGET_MS) or "").strip().replace('"', "")
+    if not name or len(name) < 3:
+        return f"Category {idx + 1}"
+    db.save_cluster_name(signature, name)
+    return name
+
+
+def suggest_folders() -> list[dict]:
+    """Sugestie folderów dla całego korpusu: [{"folder": nazwa, "files": [...]}]."""
+    import numpy as np
+
+    _backfill_missing()
+    filename_by_id = {d["doc_id"]: d["filename"] for d in db.list_documents()}
+    all_files = set(filename_by_id.values())
+    doc_ids = [d for d in vector_store.live_ids() if d in filename_by_id]
+    if len(doc_ids) < 2:
+        return [{"folder": UNCATEGORIZED, "files": sorted(all_files)}] if all_files else []
+
+    version = (len(doc_ids), doc_ids[-1], len(all_files))
+    with _lock:
+        if _state["result"] is not None and _state["version"] == version:
+            record_cache("clusters", True)
+            return _state["result"]
+    record_cache("clusters", False)
+
+    with timed("clustering") as sp, _lock:
+        model = _state["model"]
+        n = len(doc_ids)
+        dims = vector_store.stats()["dims"]
+        if model is None or _state["dims"] != dims or n > _state["fitted_n"] * (1 + REFIT_GROWTH):
+            model, k = _fit(filename_by_id, n)
+            _state.update(model=model, k=k, fitted_n=n, dims=dims, seen=set(doc_ids))
+        else:
+            new = set(doc_ids) - _state["seen"]
+            if new:
+                for ids, X in _blocks(filename_by_id):
+                    rows = [i for i, d in enumerate(ids) if d in new]
+                    if rows:
+                        model.partial_fit(X[rows])
+                _state["seen"].update(new)
+        # przypisania blokami — w pamięci zostają tylko etykiety i odległości
+        doc_ids, labels, distances = [], [], []
+        for ids, X in _blocks(filename_by_id):
+            block_labels = model.predict(X)
+            labels.append(block_labels)
+            distances.append(np.linalg.norm(X - model.cluster_centers_[block_labels], axis=1))
+            doc_ids.extend(ids)
+        labels, distances = np.concatenate(labels), np.concatenate(distances)
+        sp.set(docs=n, k=_state["k"])
+    filenames = [filename_by_id[d] for d in doc_ids]
+
+    summaries = db.get_summaries(doc_ids)
+    clusters = []
+    for idx in range(model.n_clusters):
+        members = np.flatnonzero(labels == idx)
+        if len(members) == 0:
+            continue
+        reps = members[np.argsort(distances[members])[:NAME_SAMPLE]]
+        rep_names = [filenames[i] for i in reps]
+        signature = hashlib.sha1("\n".join(sorted(rep_names)).encode("utf-8")).hexdigest()
+        clusters.append((idx, members, signature, rep_names, [summaries.get(doc_ids[i], "") for i in reps]))
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        names = list(pool.map(lambda c: _cluster_name(c[2], c[3], c[4], c[0]), clusters))
+
+    folders = [
+        {"folder": name, "files": [filenames[i] for i in members]}
+        for name, (_, members, _, _, _) in zip(names, clusters)
+    ]
+    uncategorized = sorted(all_files - set(filenames))
+    if uncategorized:
+        folders.append({"folder": UNCATEGORIZED, "files": uncategorized})
+
+    with _lock:
+        _state.update(result=folders, version=version)
+    return folders
@@ -1,10 +1,15 @@
 import sqlite3
+import json
+import logging
+import uuid
 from pathlib import Path
 from datetime import datetime
 
 BASE_DIR = Path(__file__).resolve().parents[1]
 DB_PATH = BASE_DIR / "documents.db"   # persistent file in project
 
+logger = logging.getLogger(__name__)
+
 def _get_conn():
     conn = sqlite3.connect(str(DB_PATH))
     conn.row_factory = sqlite3.Row
@@ -21,45 +26,728 @@ def init_db():
             uploaded_at TEXT
         )
     """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS folders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            created_at TEXT
+        )
+    """)
+    # 📁 przynależność do folderu (starsze bazy nie mają tej kolumny)
+    columns = {r["name"] for r in cur.execute("PRAGMA table_info(documents)")}
+    if "folder_id" not in columns:
+        cur.execute("ALTER TABLE documents ADD COLUMN folder_id INTEGER REFERENCES folders(id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_documents_folder ON documents(folder_id)")
+    # 🆔 stabilny identyfikator dokumentu (== _id w Elasticsearch)
+    if "doc_id" not in columns:
+        cur.execute("ALTER TABLE documents ADD COLUMN doc_id TEXT")
+    if "content_hash" not in columns:
+        cur.execute("ALTER TABLE documents ADD COLUMN content_hash TEXT")
+    # starsze wpisy są w ES zaindeksowane z _id = filename, więc to jest ich doc_id
+    cur.execute("UPDATE documents SET doc_id = filename WHERE doc_id IS NULL")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_documents_doc_id ON documents(doc_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_documents_content_hash ON documents(content_hash)")
+    # 🧠 wynik analizy (żeby klastrowanie / dedup nie musiały pytać ES)
+    if "summary" not in columns:
+        cur.execute("ALTER TABLE documents ADD COLUMN summary TEXT")
+    if "language" not in columns:
+        cur.execute("ALTER TABLE documents ADD COLUMN language TEXT")
+    # 🔗 prawie-duplikat (doc_id oryginału, którego analizę wykorzystaliśmy)
+    if "duplicate_of" not in columns:
+        cur.execute("ALTER TABLE documents ADD COLUMN duplicate_of TEXT")
+    # 🕓 numer bieżącej wersji (kolejne wersje = ponowny upload zmienionego pliku)
+    if "version" not in columns:
+        cur.execute("ALTER TABLE documents ADD COLUMN version INTEGER DEFAULT 1")
+    _backfill_folders(cur)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS chunk_summaries (
+            chunk_hash TEXT PRIMARY KEY,
+            summary TEXT,
+            created_at TEXT
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS embeddings (
+            doc_id TEXT PRIMARY KEY,
+            dims INTEGER,
+            vector BLOB,
+            updated_at TEXT
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS minhash_signatures (
+            doc_id TEXT PRIMARY KEY,
+            signature BLOB
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS minhash_bands (
+            band INTEGER,
+            bucket TEXT,
+            doc_id TEXT
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_minhash_bands ON minhash_bands(band, bucket)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS document_versions (
+            doc_id TEXT,
+            version INTEGER,
+            content_hash TEXT,
+            page_count INTEGER,
+            changed_pages TEXT,
+            created_at TEXT,
+            PRIMARY KEY (doc_id, version)
+        )
+    """)
+    # strony bieżącej wersji: odcisk surowej treści strony → tekst (także po OCR)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS document_pages (
+            doc_id TEXT,
+            page_no INTEGER,
+            fingerprint TEXT,
+            text_hash TEXT,
+            text TEXT,
+            PRIMARY KEY (doc_id, page_no)
+        )
+    """)
+    # 📦 import masowy (checkpoint: import przerwany w połowie wznawia się od miejsca przerwania)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            job_id TEXT PRIMARY KEY,
+            source TEXT,
+            status TEXT,
+            started_at TEXT,
+            finished_at TEXT,
+            stats TEXT
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS import_items (
+            job_id TEXT,
+            member TEXT,
+            content_hash TEXT,
+            filename TEXT,
+            status TEXT,
+            error TEXT,
+            PRIMARY KEY (job_id, member)
+        )
+    """)
+    # 📡 zdarzenia postępu zadań uploadu (SSE) — wspólne dla wszystkich workerów
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS progress_jobs (
+            job_id TEXT PRIMARY KEY,
+            created_at REAL,
+            finished_at REAL
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS progress_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT,
+            data TEXT
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_progress_events_job ON progress_events(job_id, id)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS cluster_names (
+            signature TEXT PRIMARY KEY,
+            name TEXT,
+            created_at TEXT
+        )
+    """)
     conn.commit()
     conn.close()
 
+def new_doc_id() -> str:
+    return uuid.uuid4().hex
+
+def _backfill_folders(cur):
+    """Przypisz folder_id wpisom, których plik leży w uploaded_pdfs/folders/<nazwa>/."""
+    cur.execute("SELECT id, filepath FROM documents WHERE folder_id IS NULL AND filepath LIKE ?", ("%folders%",))
+    for row in cur.fetchall():
+        path = Path(row["filepath"])
+        if path.parent.parent.name != "folders":
+            continue
+        folder_id = _ensure_folder(cur, path.parent.name)
+        cur.execute("UPDATE documents SET folder_id = ? WHERE id = ?", (folder_id, row["id"]))
+
+def _ensure_folder(cur, name: str) -> int:
+    cur.execute(
+        "INSERT OR IGNORE INTO folders (name, created_at) VALUES (?, ?)",
+        (name, datetime.utcnow().isoformat())
+    )
+    cur.execute("SELECT id FROM folders WHERE name = ?", (name,))
+    return cur.fetchone()["id"]
+
 # Initialize on import
 init_db()
 
-def add_document(filename: str, filepath: Path):
+_DOC_COLUMNS = (
+    "d.doc_id, d.filename, d.filepath, d.uploaded_at, d.content_hash, "
+    "d.summary, d.language, d.duplicate_of, d.version, f.name AS folder"
+)
+_DOC_FROM = "documents d LEFT JOIN folders f ON f.id = d.folder_id"
+
+def add_document(filename: str, filepath: Path, folder: str | None = None, content_hash: str | None = None) -> str:
+    """Dodaje / aktualizuje wpis; doc_id i folder (gdy nie podano nowego) istniejącego dokumentu są zachowywane. Zwraca doc_id."""
     conn = _get_conn()
     cur = conn.cursor()
+    folder_id = _ensure_folder(cur, folder) if folder else None
     cur.execute(
-        "INSERT OR REPLACE INTO documents (filename, filepath, uploaded_at) VALUES (?, ?, ?)",
-        (filename, str(filepath), datetime.utcnow().isoformat())
+        """
+        INSERT INTO documents (doc_id, filename, filepath, uploaded_at, folder_id, content_hash)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(filename) DO UPDATE SET
+            filepath = excluded.filepath,
+            uploaded_at = excluded.uploaded_at,
+            folder_id = COALESCE(excluded.folder_id, documents.folder_id),
+            content_hash = COALESCE(excluded.content_hash, documents.content_hash)
+        """,
+        (new_doc_id(), filename, str(filepath), datetime.utcnow().isoformat(), folder_id, content_hash)
     )
+    cur.execute("SELECT doc_id FROM documents WHERE filename = ?", (filename,))
+    doc_id = cur.fetchone()["doc_id"]
     conn.commit()
     conn.close()
+    return doc_id
+
+# przeniesienie: istniejący wpis — tylko ścieżka i folder (bez zmiany uploaded_at / id);
+# plik bez wpisu (np. wgrany przed bazą) — rejestrujemy go, żeby /view, /download, /delete go widziały;
+# doc_id = filename jak przy starszych wpisach (tak trasy adresują go w ES)
+_MOVE_SQL = """
+    INSERT INTO documents (doc_id, filename, filepath, uploaded_at, folder_id)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(filename) DO UPDATE SET
+        filepath = excluded.filepath,
+        folder_id = excluded.folder_id
+"""
 
-def list_documents():
+def move_document(filename: str, filepath: Path, folder: str | None):
+    """Aktualizuje ścieżkę i folder (bez zmiany uploaded_at / id); brakujący wpis jest dodawany."""
     conn = _get_conn()
     cur = conn.cursor()
-    cur.execute("SELECT filename, filepath, uploaded_at FROM documents ORDER BY uploaded_at DESC")
+    folder_id = _ensure_folder(cur, folder) if folder else None
+    cur.execute(_MOVE_SQL, (filename, filename, str(filepath), datetime.utcnow().isoformat(), folder_id))
+    conn.commit()
+    conn.close()
+
+def list_documents(root_only: bool = False):
+    """Wszystkie dokumenty, albo (root_only) tylko te spoza folderów."""
+    conn = _get_conn()
+    cur = conn.cursor()
+    where = "WHERE d.folder_id IS NULL" if root_only else ""
+    cur.execute(f"SELECT {_DOC_COLUMNS} FROM {_DOC_FROM} {where} ORDER BY d.uploaded_at DESC")
     rows = cur.fetchall()
     conn.close()
     return [dict(r) for r in rows]
 
+def set_document_analysis(filename: str, summary: str, language: str | None = None):
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        "UPDATE documents SET summary = ?, language = COALESCE(?, language) WHERE filename = ?",
+        (summary, language, filename)
+    )
+    conn.commit()
+    conn.close()
+
+def set_content_hash(filename: str, content_hash: str):
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("UPDATE documents SET content_hash = ? WHERE filename = ?", (content_hash, filename))
+    conn.commit()
+    conn.close()
+
+def count_documents() -> int:
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) AS n FROM documents")
+    n = cur.fetchone()["n"]
+    conn.close()
+    return n
+
+def corpus_stamp() -> tuple:
+    """Tani „odcisk” stanu dokumentów (liczba, ostatni upload, długość streszczeń) — do unieważniania indeksów w pamięci."""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT COUNT(*) AS n, MAX(uploaded_at) AS last, COALESCE(SUM(LENGTH(summary)), 0) AS chars FROM documents"
+    )
+    row = cur.fetchone()
+    conn.close()
+    return (row["n"], row["last"], row["chars"])
+
 def get_document(filename: str):
     conn = _get_conn()
     cur = conn.cursor()
-    cur.execute("SELECT filename, filepath, uploaded_at FROM documents WHERE filename = ?", (filename,))
+    cur.execute(f"SELECT {_DOC_COLUMNS} FROM {_DOC_FROM} WHERE d.filename = ?", (filename,))
     row = cur.fetchone()
     conn.close()
     return dict(row) if row else None
 
+def get_document_by_id(doc_id: str):
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(f"SELECT {_DOC_COLUMNS} FROM {_DOC_FROM} WHERE d.doc_id = ?", (doc_id,))
+    row = cur.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def find_by_content_hash(content_hash: str, exclude_doc_id: str | None = None):
+    """Najstarszy dokument o identycznej treści (inny niż exclude_doc_id)."""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        f"SELECT {_DOC_COLUMNS} FROM {_DOC_FROM} WHERE d.content_hash = ? AND d.doc_id != ? ORDER BY d.id LIMIT 1",
+        (content_hash, exclude_doc_id or "")
+    )
+    row = cur.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def set_duplicate_of(filename: str, original_doc_id: str | None):
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("UPDATE documents SET duplicate_of = ? WHERE filename = ?", (original_doc_id, filename))
+    conn.commit()
+    conn.close()
+
+def get_documents(filenames: list[str]) -> dict:
+    """Wiele rekordów naraz: {filename: rekord} (zapytania IN w paczkach)."""
+    out = {}
+    conn = _get_conn()
+    cur = conn.cursor()
+    for i in range(0, len(filenames), 500):
+        batch = filenames[i:i + 500]
+        placeholders = ",".join("?" * len(batch))
+        cur.execute(f"SELECT {_DOC_COLUMNS} FROM {_DOC_FROM} WHERE d.filename IN ({placeholders})", batch)
+        out.update({r["filename"]: dict(r) for r in cur.fetchall()})
+    conn.close()
+    return out
+
+def move_documents(moves: list[tuple]):
+    """Przenosi wiele dokumentów w jednej transakcji. moves: [(filename, filepath, folder)]."""
+    conn = _get_conn()
+    try:
+        cur = conn.cursor()
+        folder_ids = {name: _ensure_folder(cur, name) for name in {m[2] for m in moves if m[2]}}
+        now = datetime.utcnow().isoformat()
+        cur.executemany(
+            _MOVE_SQL,
+            [(filename, filename, str(path), now, folder_ids.get(folder)) for filename, path, folder in moves]
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+# =============================
+# 📁 FOLDERY
+# =============================
+def list_folders():
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT name FROM folders ORDER BY name")
+    rows = cur.fetchall()
+    conn.close()
+    return [r["name"] for r in rows]
+
+def get_folder(name: str):
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT id, name, created_at FROM folders WHERE name = ?", (name,))
+    row = cur.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def create_folder(name: str):
+    conn = _get_conn()
+    cur = conn.cursor()
+    _ensure_folder(cur, name)
+    conn.commit()
+    conn.close()
+
+def delete_folder(name: str):
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM folders WHERE name = ?", (name,))
+    conn.commit()
+    conn.close()
+
+def list_folder_documents(name: str):
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        f"SELECT {_DOC_COLUMNS} FROM {_DOC_FROM} WHERE f.name = ? ORDER BY d.filename",
+        (name,)
+    )
+    rows = cur.fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def count_folder_documents(name: str) -> int:
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT COUNT(*) AS n FROM documents d JOIN folders f ON f.id = d.folder_id WHERE f.name = ?",
+        (name,)
+    )
+    n = cur.fetchone()["n"]
+    conn.close()
+    return n
+
+def sync_folders_from_disk(folders_root: Path):
+    """Jednorazowo (przy starcie) rejestruje katalogi folderów, których nie ma w bazie."""
+    if not folders_root.exists():
+        return
+    conn = _get_conn()
+    cur = conn.cursor()
+    for entry in folders_root.iterdir():
+        if entry.is_dir():
+            _ensure_folder(cur, entry.name)
+    conn.commit()
+    conn.close()
+
 def delete_document(filename: str):
     conn = _get_conn()
     cur = conn.cursor()
+    cur.execute("SELECT doc_id FROM documents WHERE filename = ?", (filename,))
+    row = cur.fetchone()
+    if row:
+        for table in ("embeddings", "minhash_signatures", "minhash_bands", "document_versions", "document_pages"):
+            cur.execute(f"DELETE FROM {table} WHERE doc_id = ?", (row["doc_id"],))
     cur.execute("DELETE FROM documents WHERE filename = ?", (filename,))
     conn.commit()
     conn.close()
 
+def get_pages(doc_id: str, with_text: bool = True) -> list[dict]:
+    """Strony bieżącej wersji: [{page, fingerprint, text_hash, text}] w kolejności (bez `text`,
+    gdy not with_text — tekst pojedynczej strony daje get_page_text)."""
+    conn = _get_conn()
+    cur = conn.cursor()
+    columns = "page_no AS page, fingerprint, text_hash" + (", text" if with_text else "")
+    cur.execute(f"SELECT {columns} FROM document_pages WHERE doc_id = ? ORDER BY page_no", (doc_id,))
+    rows = cur.fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def get_page_text(doc_id: str, page_no: int) -> str | None:
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT text FROM document_pages WHERE doc_id = ? AND page_no = ?", (doc_id, page_no))
+    row = cur.fetchone()
+    conn.close()
+    return row["text"] if row else None
+
+def save_version(doc_id: str, content_hash: str | None, pages, changed_pages: list[int],
+                 page_count: int | None = None) -> int:
+    """Zapisuje nową wersję dokumentu razem z jej stronami (jedna transakcja). Zwraca numer wersji.
+    `pages` może być generatorem (strony czytane z pliku tymczasowego) — wtedy z `page_count`."""
+    page_count = len(pages) if page_count is None else page_count
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT COALESCE(MAX(version), 0) + 1 AS v FROM document_versions WHERE doc_id = ?", (doc_id,))
+    version = cur.fetchone()["v"]
+    now = datetime.utcnow().isoformat()
+    cur.execute(
+        """
+        INSERT INTO document_versions (doc_id, version, content_hash, page_count, changed_pages, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        (doc_id, version, content_hash, page_count, json.dumps(changed_pages), now)
+    )
+    cur.execute("DELETE FROM document_pages WHERE doc_id = ?", (doc_id,))
+    cur.executemany(
+        "INSERT INTO document_pages (doc_id, page_no, fingerprint, text_hash, text) VALUES (?, ?, ?, ?, ?)",
+        ((doc_id, p["page"], p["fingerprint"], p["text_hash"], p["text"]) for p in pages)
+    )
+    cur.execute(
+        "UPDATE documents SET version = ?, content_hash = COALESCE(?, content_hash), uploaded_at = ? WHERE doc_id = ?",
+        (version, content_hash, now, doc_id)
+    )
+    conn.commit()
+    conn.close()
+    return version
+
+def list_versions(doc_id: str) -> list[dict]:
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT version, content_hash, page_count, changed_pages, created_at
+        FROM document_versions WHERE doc_id = ? ORDER BY version DESC
+        """,
+        (doc_id,)
+    )
+    rows = cur.fetchall()
+    conn.close()
+    return [{**dict(r), "changed_pages": json.loads(r["changed_pages"] or "[]")} for r in rows]
+
+def start_import_job(job_id: str, source: str):
+    """Tworzy zadanie importu albo oznacza istniejące jako wznowione."""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        INSERT INTO import_jobs (job_id, source, status, started_at) VALUES (?, ?, 'running', ?)
+        ON CONFLICT(job_id) DO UPDATE SET status = 'running', started_at = excluded.started_at, finished_at = NULL
+        """,
+        (job_id, source, datetime.utcnow().isoformat())
+    )
+    conn.commit()
+    conn.close()
+
+def finish_import_job(job_id: str, status: str, stats: dict):
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        "UPDATE import_jobs SET status = ?, finished_at = ?, stats = ? WHERE job_id = ?",
+        (status, datetime.utcnow().isoformat(), json.dumps(stats), job_id)
+    )
+    conn.commit()
+    conn.close()
+
+def get_import_job(job_id: str):
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM import_jobs WHERE job_id = ?", (job_id,))
+    row = cur.fetchone()
+    if not row:
+        conn.close()
+        return None
+    cur.execute("SELECT status, COUNT(*) AS n FROM import_items WHERE job_id = ? GROUP BY status", (job_id,))
+    items = {r["status"]: r["n"] for r in cur.fetchall()}
+    conn.close()
+    return {**dict(row), "stats": json.loads(row["stats"] or "null"), "items": items}
+
+def get_import_items(job_id: str) -> dict:
+    """Checkpoint zadania: {member: {"status", "filename", "content_hash"}}."""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT member, status, filename, content_hash FROM import_items WHERE job_id = ?", (job_id,))
+    items = {r["member"]: dict(r) for r in cur.fetchall()}
+    conn.close()
+    return items
+
+def set_import_item(job_id: str, member: str, status: str, content_hash: str | None = None,
+                    filename: str | None = None, error: str | None = None):
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        INSERT OR REPLACE INTO import_items (job_id, member, content_hash, filename, status, error)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        (job_id, member, content_hash, filename, status, error)
+    )
+    conn.commit()
+    conn.close()
+
+def create_progress_job(job_id: str, created_at: float):
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("INSERT INTO progress_jobs (job_id, created_at) VALUES (?, ?)", (job_id, created_at))
+    conn.commit()
+    conn.close()
+
+def finish_progress_job(job_id: str, finished_at: float):
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("UPDATE progress_jobs SET finished_at = ? WHERE job_id = ?", (finished_at, job_id))
+    conn.commit()
+    conn.close()
+
+def get_progress_job(job_id: str):
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM progress_jobs WHERE job_id = ?", (job_id,))
+    row = cur.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def add_progress_event(job_id: str, event: dict, limit: int, force: bool = False) -> int | None:
+    """Dopisuje zdarzenie (najwyżej `limit` na zadanie, chyba że `force`); zwraca id albo None
+    (nieznane zadanie / limit)."""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        INSERT INTO progress_events (job_id, data)
+        SELECT ?, ? WHERE EXISTS (SELECT 1 FROM progress_jobs WHERE job_id = ?)
+            AND (? OR (SELECT COUNT(*) FROM progress_events WHERE job_id = ?) < ?)
+        """,
+        (job_id, json.dumps(event, default=str), job_id, force, job_id, limit)
+    )
+    event_id = cur.lastrowid if cur.rowcount else None
+    conn.commit()
+    conn.close()
+    return event_id
+
+def get_progress_events(job_id: str, after: int = 0) -> list[dict]:
+    """Zdarzenia zadania o id > `after`, rosnąco (id jest w zdarzeniu)."""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT id, data FROM progress_events WHERE job_id = ? AND id > ? ORDER BY id", (job_id, after))
+    rows = cur.fetchall()
+    conn.close()
+    return [{"id": r["id"], **json.loads(r["data"])} for r in rows]
+
+def expire_progress_jobs(finished_before: float, created_before: float):
+    """Usuwa zadania zakończone przed `finished_before` i niedokończone (np. po restarcie) sprzed `created_before`."""
+    conn = _get_conn()
+    cur = conn.cursor()
+    expired = "SELECT job_id FROM progress_jobs WHERE finished_at < ? OR created_at < ?"
+    cur.execute(f"DELETE FROM progress_events WHERE job_id IN ({expired})", (finished_before, created_before))
+    cur.execute(f"DELETE FROM progress_jobs WHERE job_id IN ({expired})", (finished_before, created_before))
+    conn.commit()
+    conn.close()
+
+def get_chunk_summary(chunk_hash: str):
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT summary FROM chunk_summaries WHERE chunk_hash = ?", (chunk_hash,))
+    row = cur.fetchone()
+    conn.close()
+    return row["summary"] if row else None
+
+def save_chunk_summary(chunk_hash: str, summary: str):
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT OR REPLACE INTO chunk_summaries (chunk_hash, summary, created_at) VALUES (?, ?, ?)",
+        (chunk_hash, summary, datetime.utcnow().isoformat())
+    )
+    conn.commit()
+    conn.close()
+
+# =============================
+# 🧠 EMBEDDINGI + NAZWY KLASTRÓW
+# =============================
+def save_embedding(doc_id: str, vector: bytes, dims: int):
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT OR REPLACE INTO embeddings (doc_id, dims, vector, updated_at) VALUES (?, ?, ?, ?)",
+        (doc_id, dims, vector, datetime.utcnow().isoformat())
+    )
+    conn.commit()
+    conn.close()
+
+def load_embeddings():
+    """Wszystkie embeddingi istniejących dokumentów: [(doc_id, filename, dims, vector_bytes)]."""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT e.doc_id, d.filename, e.dims, e.vector
+        FROM embeddings e JOIN documents d ON d.doc_id = e.doc_id
+        ORDER BY d.id
+    """)
+    rows = [tuple(r) for r in cur.fetchall()]
+    conn.close()
+    return rows
+
+def embedding_doc_ids() -> list[str]:
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT e.doc_id FROM embeddings e JOIN documents d ON d.doc_id = e.doc_id")
+    rows = [r["doc_id"] for r in cur.fetchall()]
+    conn.close()
+    return rows
+
+def documents_without_embedding(limit: int = 1000):
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT d.doc_id, d.filename, d.summary FROM documents d
+        LEFT JOIN embeddings e ON e.doc_id = d.doc_id
+        WHERE e.doc_id IS NULL
+        LIMIT ?
+    """, (limit,))
+    rows = [dict(r) for r in cur.fetchall()]
+    conn.close()
+    return rows
+
+def get_summaries(doc_ids: list[str]) -> dict:
+    conn = _get_conn()
+    cur = conn.cursor()
+    out = {}
+    for i in range(0, len(doc_ids), 500):
+        batch = doc_ids[i:i + 500]
+        cur.execute(
+            f"SELECT doc_id, summary FROM documents WHERE doc_id IN ({','.join('?' * len(batch))})", batch
+        )
+        out.update({r["doc_id"]: r["summary"] or "" for r in cur.fetchall()})
+    conn.close()
+    return out
+
+def copy_embedding(src_doc_id: str, dst_doc_id: str) -> bool:
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        INSERT OR REPLACE INTO embeddings (doc_id, dims, vector, updated_at)
+        SELECT ?, dims, vector, ? FROM embeddings WHERE doc_id = ?
+        """,
+        (dst_doc_id, datetime.utcnow().isoformat(), src_doc_id)
+    )
+    copied = cur.rowcount > 0
+    conn.commit()
+    conn.close()
+    return copied
+
+# =============================
+# 🧬 MINHASH / LSH
+# =============================
+def save_minhash(doc_id: str, signature: bytes, bands: list[tuple]):
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("INSERT OR REPLACE INTO minhash_signatures (doc_id, signature) VALUES (?, ?)", (doc_id, signature))
+    cur.execute("DELETE FROM minhash_bands WHERE doc_id = ?", (doc_id,))
+    cur.executemany(
+        "INSERT INTO minhash_bands (band, bucket, doc_id) VALUES (?, ?, ?)",
+        [(band, bucket, doc_id) for band, bucket in bands]
+    )
+    conn.commit()
+    conn.close()
+
+def lsh_candidates(bands: list[tuple], exclude_doc_id: str | None = None):
+    """Dokumenty dzielące ≥1 kubełek LSH: [(doc_id, signature_bytes)]."""
+    conn = _get_conn()
+    cur = conn.cursor()
+    where = " OR ".join("(b.band = ? AND b.bucket = ?)" for _ in bands)
+    params = [v for pair in bands for v in pair]
+    cur.execute(
+        f"""
+        SELECT DISTINCT s.doc_id, s.signature
+        FROM minhash_bands b JOIN minhash_signatures s ON s.doc_id = b.doc_id
+        WHERE ({where}) AND b.doc_id != ?
+        """,
+        params + [exclude_doc_id or ""]
+    )
+    rows = [(r["doc_id"], r["signature"]) for r in cur.fetchall()]
+    conn.close()
+    return rows
+
+def get_cluster_name(signature: str):
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT name FROM cluster_names WHERE signature = ?", (signature,))
+    row = cur.fetchone()
+    conn.close()
+    return row["name"] if row else None
+
+def save_cluster_name(signature: str, name: str):
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT OR REPLACE INTO cluster_names (signature, name, created_at) VALUES (?, ?, ?)",
+        (signature, name, datetime.utcnow().isoformat())
+    )
+    conn.commit()
+    conn.close()
+
 def cleanup_missing_files():
     """
     Usuwa z bazy wpisy dla plików, które nie istnieją fizycznie
@@ -80,4 +768,4 @@ def cleanup_missing_files():
 
     conn.commit()
     conn.close()
-    print(f"🧹 Cleanup complete — removed {removed} missing files from database.")
\ No newline at end of file
+    logger.info("🧹 Cleanup complete — removed %d missing files from database.", removed)
\ No newline at end of file
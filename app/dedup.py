@@ -0,0 +1,88 @@
+# app/dedup.py
+"""
+Wykrywanie prawie-duplikatów przy ingeście: MinHash na 5-gramach słów + LSH (pasma)
+trzymane w SQLite. Kandydaci z LSH są weryfikowani estymatą Jaccarda z sygnatur.
+"""
+import logging
+import os
+import re
+import zlib
+
+from app import db
+from app.metrics import record_cache, timed
+
+logger = logging.getLogger(__name__)
+
+NUM_PERM = 128
+BANDS = 16                      # 16 pasm × 8 wierszy → próg LSH ≈ 0.7
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+SIMILARITY_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
+MAX_SHINGLES = 200_000          # ograniczenie pamięci dla bardzo długich dokumentów
+_MERSENNE = (1 << 61) - 1
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+_perms = None
+
+
+def _permutations():
+    global _perms
+    if _perms is None:
+        import numpy as np
+        rng = np.random.default_rng(1)
+        a = rng.integers(1, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+        b = rng.integers(0, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+        _perms = (a, b)
+    return _perms
+
+
+def _shingle_hashes(text: str):
+    import numpy as np
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        words = words + [""] * (SHINGLE_SIZE - len(words))
+    count = min(len(words) - SHINGLE_SIZE + 1, MAX_SHINGLES)
+    hashes = {zlib.crc32(" ".join(words[i:i + SHINGLE_SIZE]).encode("utf-8")) for i in range(count)}
+    return np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+
+
+def compute_signature(text: str):
+    """Sygnatura MinHash (NUM_PERM × uint64) dla tekstu dokumentu."""
+    import numpy as np
+    a, b = _permutations()
+    hashes = _shingle_hashes(text)
+    signature = np.full(NUM_PERM, np.iinfo(np.uint64).max, dtype=np.uint64)
+    with timed("minhash"):
+        for start in range(0, len(hashes), 4096):  # blokami, żeby macierz była mała
+            block = hashes[start:start + 4096]
+            values = (np.outer(a, block) + b[:, None]) % _MERSENNE
+            np.minimum(signature, values.min(axis=1), out=signature)
+    return signature
+
+
+def _band_keys(signature) -> list[str]:
+    return [
+        f"{zlib.crc32(signature[i * ROWS:(i + 1) * ROWS].tobytes()):08x}"
+        for i in range(BANDS)
+    ]
+
+
+def similarity(sig_a, sig_b) -> float:
+    return float((sig_a == sig_b).mean())
+
+
+def find_near_duplicate(signature, exclude_doc_id: str | None = None):
+    """Zwraca (doc_id, podobieństwo) najlepszego kandydata ≥ progu albo None."""
+    import numpy as np
+    candidates = db.lsh_candidates(list(enumerate(_band_keys(signature))), exclude_doc_id)
+    best = None
+    for doc_id, blob in candidates:
+        sim = similarity(signature, np.frombuffer(blob, dtype=np.uint64))
+        if sim >= SIMILARITY_THRESHOLD and (best is None or sim > best[1]):
+            best = (doc_id, sim)
+    record_cache("dedup", best is not None)
+    return best
+
+
+def register(doc_id: str, signature):
+    db.save_minhash(doc_id, signature.tobytes(), list(enumerate(_band_keys(signature))))
@@ -1,8 +1,13 @@
 import os
+import logging
+import re
+from collections import Counter
 from datetime import datetime
 from elasticsearch import Elasticsearch, exceptions, helpers
-from app.pdf_utils import extract_text_from_pdf
-from PyPDF2 import PdfReader
+from app.pdf_utils import extract_text_from_pdf, extract_metadata
+from app.metrics import timed
+
+logger = logging.getLogger(__name__)
 
 # --- Konfiguracja środowiska ---
 ELASTIC_URL = os.getenv("ELASTIC_URL")
@@ -21,12 +26,11 @@ if ELASTIC_URL and ELASTIC_API_KEY:
             request_timeout=60,
             retry_on_timeout=True,
         )
-        print(f"[ES] ✅ Connecting to Elastic Cloud: {ELASTIC_URL}")
-        print("[ES] 🔄 Ping:", es.ping())
+        logger.info("[ES] ✅ Connecting to Elastic Cloud: %s", ELASTIC_URL)
     except Exception as e:
-        print(f"[ES] ❌ Failed to connect: {e}")
+        logger.error("[ES] ❌ Failed to connect: %s", e)
 else:
-    print("[ES] ⚠️ Missing ELASTIC_URL or ELASTIC_API_KEY. Running in local/offline mode.")
+    logger.warning("[ES] ⚠️ Missing ELASTIC_URL or ELASTIC_API_KEY. Running in local/offline mode.")
 
 
 # --- Pomocnicze funkcje ---
@@ -35,144 +39,439 @@ def check_connection():
     if not es:
         return False
     try:
-        ping = es.ping()
-        print(f"[ES] 🔄 Ping status: {ping}")
+        with timed("es_ping"):
+            ping = es.ping()
+        logger.debug("[ES] ping status=%s", ping)
         return ping
     except Exception as e:
-        print(f"[ES] ⚠️ Ping error: {e}")
+        logger.warning("[ES] ⚠️ Ping error: %s", e)
         return False
 
 
+# --- Szablon indeksu (wersjonowany) ---
+INDEX_TEMPLATE_VERSION = 4
+INDEX_TEMPLATE_NAME = f"{ES_INDEX}-template"
+ES_REPLICAS = int(os.getenv("ES_REPLICAS", "1"))
+# stempel (analysis-stempel) nie jest zawsze zainstalowany — polski stemmer opcjonalnie
+POLISH_STEMMER = os.getenv("ES_POLISH_STEMMER", "0") == "1"
+
+# język dokumentu → analizator pola content_<lang>; pozostałe języki trafiają do "content"
+LANG_ANALYZERS = {"pl": "pl_text", "en": "en_text", "de": "de_text", "fr": "fr_text"}
+CONTENT_FIELDS = ["content", *(f"content_{lang}" for lang in LANG_ANALYZERS)]
+SEARCH_FIELDS = [
+    "filename.text^3", "filename.ngram", "author^2",
+    "summary^2", *(f"summary.{lang}^2" for lang in LANG_ANALYZERS), *CONTENT_FIELDS,
+]
+SOURCE_EXCLUDES = ["content", "content_*"]
+
+
+def content_field(language: str) -> str:
+    return f"content_{language}" if language in LANG_ANALYZERS else "content"
+
+
+def _content_mapping(analyzer: str) -> dict:
+    # offsets w postingach → szybki highlighter bez ponownej analizy. Treść zostaje
+    # w zapisanym _source (częściowe _update przebudowuje dokument z _source) —
+    # wycinamy ją dopiero w zapytaniu (SOURCE_EXCLUDES w search_body).
+    return {"type": "text", "analyzer": analyzer, "index_options": "offsets"}
+
+
+def index_template_body() -> dict:
+    """Ustawienia i mapowania indeksu dokumentów (wspólne dla szablonu i create_index)."""
+    polish_filters = ["lowercase", "folding"] + (["polish_stem"] if POLISH_STEMMER else [])
+    return {
+        "settings": {
+            "index": {"number_of_shards": 1, "number_of_replicas": ES_REPLICAS},
+            "analysis": {
+                "filter": {
+                    "folding": {"type": "asciifolding", "preserve_original": True},
+                    "en_stop": {"type": "stop", "stopwords": "_english_"},
+                    "en_possessive": {"type": "stemmer", "language": "possessive_english"},
+                    "en_stemmer": {"type": "stemmer", "language": "light_english"},
+                    "de_stop": {"type": "stop", "stopwords": "_german_"},
+                    "de_stemmer": {"type": "stemmer", "language": "light_german"},
+                    "fr_elision": {"type": "elision", "articles_case": True,
+                                   "articles": ["l", "m", "t", "qu", "n", "s", "j", "d", "c"]},
+                    "fr_stop": {"type": "stop", "stopwords": "_french_"},
+                    "fr_stemmer": {"type": "stemmer", "language": "light_french"},
+                    "filename_ngram": {"type": "ngram", "min_gram": 3, "max_gram": 4},
+                },
+                "tokenizer": {
+                    "filename_tokenizer": {"type": "pattern", "pattern": "[^\\p{L}\\p{N}]+"},
+                },
+                "analyzer": {
+                    "default": {"type": "custom", "tokenizer": "standard", "filter": ["lowercase", "folding"]},
+                    "pl_text": {"type": "custom", "tokenizer": "standard", "filter": polish_filters},
+                    "en_text": {"type": "custom", "tokenizer": "standard",
+                                "filter": ["en_possessive", "lowercase", "en_stop", "en_stemmer", "folding"]},
+                    "de_text": {"type": "custom", "tokenizer": "standard",
+                                "filter": ["lowercase", "de_stop", "german_normalization", "de_stemmer", "folding"]},
+                    "fr_text": {"type": "custom", "tokenizer": "standard",
+                                "filter": ["fr_elision", "lowercase", "fr_stop", "fr_stemmer", "folding"]},
+                    "filename_text": {"type": "custom", "tokenizer": "filename_tokenizer",
+                                      "filter": ["lowercase", "folding"]},
+                    "filename_ngram": {"type": "custom", "tokenizer": "filename_tokenizer",
+                                       "filter": ["lowercase", "folding", "filename_ngram"]},
+                },
+            },
+        },
+        "mappings": {
+            "_meta": {"template_version": INDEX_TEMPLATE_VERSION},
+            "properties": {
+                "doc_id": {"type": "keyword"},
+                "filename": {
+                    "type": "keyword",
+                    "fields": {
+                        "text": {"type": "text", "analyzer": "filename_text"},
+                        "ngram": {"type": "text", "analyzer": "filename_ngram"},
+                    },
+                },
+                "path": {"type": "keyword", "index": False},
+                "author": {"type": "text"},
+                "number_of_pages": {"type": "integer"},
+                "created_date": {"type": "date"},
+                "summary": {
+                    "type": "text",
+                    "fields": {lang: {"type": "text", "analyzer": analyzer} for lang, analyzer in LANG_ANALYZERS.items()},
+                },
+                "content": _content_mapping("default"),
+                **{f"content_{lang}": _content_mapping(analyzer) for lang, analyzer in LANG_ANALYZERS.items()},
+                "language": {"type": "keyword"},
+                "upload_date": {"type": "date"},
+                # tytuł (nazwa pliku) + frazy kluczowe — podpowiedzi przy wpisywaniu (/suggest)
+                "suggest": {"type": "search_as_you_type", "analyzer": "default", "max_shingle_size": 3},
+            },
+        },
+    }
+
+
+_template_installed = False
+
+
+def ensure_template():
+    """Instaluje / podbija szablon indeksu, jeśli w klastrze jest starsza wersja (raz na proces)."""
+    global _template_installed
+    if _template_installed:
+        return
+    try:
+        current = None
+        if es.indices.exists_index_template(name=INDEX_TEMPLATE_NAME):
+            found = es.indices.get_index_template(name=INDEX_TEMPLATE_NAME)["index_templates"]
+            current = found[0]["index_template"].get("version") if found else None
+        if current == INDEX_TEMPLATE_VERSION:
+            _template_installed = True
+            return
+        es.indices.put_index_template(
+            name=INDEX_TEMPLATE_NAME,
+            index_patterns=[ES_INDEX, f"{ES_INDEX}-*"],
+            template=index_template_body(),
+            version=INDEX_TEMPLATE_VERSION,
+            priority=100,
+        )
+        _template_installed = True
+        logger.info("[ES] ✅ Index template %s v%d installed", INDEX_TEMPLATE_NAME, INDEX_TEMPLATE_VERSION)
+    except Exception as e:
+        logger.warning("[ES] ⚠️ Failed to install index template: %s", e)
+
+
+# --- Alias ES_INDEX → wersjonowany indeks fizyczny ---
+_index_ready = False
+# indeks budowany w tle przez reindex — zapisy trafiają też tam. Alias w ES (a nie zmienna
+# modułu), żeby dopisywały do niego wszystkie workery, nie tylko ten, który przebudowuje.
+SHADOW_ALIAS = f"{ES_INDEX}-reindex"
+
+
+def physical_index_name() -> str:
+    return f"{ES_INDEX}-v{INDEX_TEMPLATE_VERSION}-{datetime.utcnow():%Y%m%d%H%M%S%f}"
+
+
+def alias_targets(alias: str = ES_INDEX) -> list:
+    """Indeksy fizyczne za aliasem (pusta lista, gdy aliasu nie ma)."""
+    try:
+        return sorted(es.indices.get_alias(name=alias).keys())
+    except exceptions.NotFoundError:
+        return []
+
+
+def create_physical_index(bulk_load: bool = False) -> str:
+    """Nowy indeks z aktualnego szablonu; `bulk_load` — bez replik i refreshu (na czas ładowania)."""
+    ensure_template()
+    name = physical_index_name()
+    settings = {"index": {"number_of_replicas": 0, "refresh_interval": "-1"}} if bulk_load else None
+    es.indices.create(index=name, settings=settings)
+    logger.info("[ES] ✅ Created index: %s", name)
+    return name
+
+
+def swap_alias(new_index: str) -> list:
+    """Atomowo przepina alias ES_INDEX na new_index. Stary indeks o nazwie ES_INDEX (sprzed
+    aliasów) jest usuwany w tej samej operacji. Zwraca poprzednie indeksy za aliasem."""
+    old = alias_targets()
+    actions = [{"add": {"index": new_index, "alias": ES_INDEX, "is_write_index": True}}]
+    actions += [{"remove": {"index": idx, "alias": ES_INDEX}} for idx in old if idx != new_index]
+    if not old and es.indices.exists(index=ES_INDEX):
+        actions.append({"remove_index": {"index": ES_INDEX}})
+    es.indices.update_aliases(actions=actions)
+    logger.info("[ES] 🔀 Alias %s → %s (was: %s)", ES_INDEX, new_index, ", ".join(old) or "—")
+    return [idx for idx in old if idx != new_index]
+
+
+def drop_indices(indices: list):
+    if indices:
+        es.indices.delete(index=",".join(indices), ignore_unavailable=True)
+        logger.info("[ES] 🗑️ Dropped %s", ", ".join(indices))
+
+
+def set_shadow_index(name: str | None):
+    """Przepina (albo zdejmuje, gdy None) alias SHADOW_ALIAS — widoczny dla wszystkich workerów."""
+    actions = [{"remove": {"index": idx, "alias": SHADOW_ALIAS}} for idx in alias_targets(SHADOW_ALIAS)]
+    if name:
+        actions.append({"add": {"index": name, "alias": SHADOW_ALIAS}})
+    if actions:
+        es.indices.update_aliases(actions=actions)
+
+
+def shadow_indices() -> list:
+    """Indeks(y) w przebudowie; błąd ES → pusta lista (zapis idzie wtedy tylko do ES_INDEX)."""
+    try:
+        return alias_targets(SHADOW_ALIAS)
+    except Exception as e:
+        logger.warning("[ES] ⚠️ Cannot read %s alias: %s", SHADOW_ALIAS, e)
+        return []
+
+
+def _write_indices() -> list:
+    return [ES_INDEX] + shadow_indices()
+
+
 def create_index():
-    """Utwórz index jeśli nie istnieje."""
+    """Utwórz indeks (za aliasem ES_INDEX) jeśli nie istnieje."""
+    global _index_ready
+    if _index_ready:
+        return
     if not es or not check_connection():
-        print("[ES] ⚠️ Elasticsearch not available – skipping index creation.")
+        logger.warning("[ES] ⚠️ Elasticsearch not available – skipping index creation.")
         return
 
     try:
+        ensure_template()
         if not es.indices.exists(index=ES_INDEX):
-            es.indices.create(index=ES_INDEX, body={
-                "settings": {
-                    "index": {"number_of_shards": 1},
-                    "analysis": {"analyzer": {"default": {"type": "standard"}}}
-                },
-                "mappings": {
-                    "properties": {
-                        "filename": {"type": "keyword"},
-                        "path": {"type": "keyword"},
-                        "author": {"type": "text"},
-                        "number_of_pages": {"type": "integer"},
-                        "created_date": {"type": "date"},
-                        "summary": {"type": "text"},
-                        "content": {"type": "text"},
-                        "language": {"type": "keyword"},
-                        "upload_date": {"type": "date"}
-                    }
-                }
-            })
-            print(f"[ES] ✅ Created index: {ES_INDEX}")
+            swap_alias(create_physical_index())
         else:
-            print(f"[ES] ℹ️ Index already exists: {ES_INDEX}")
+            logger.debug("[ES] Index already exists: %s", ES_INDEX)
+        _index_ready = True
     except Exception as e:
-        print(f"[ES] ⚠️ Failed to create index: {e}")
+        logger.warning("[ES] ⚠️ Failed to create index: %s", e)
 
 
-def extract_metadata(path: str):
-    """Pobierz dane z pliku PDF."""
-    try:
-        reader = PdfReader(path)
-        info = reader.metadata or {}
-        author = info.get("/Author", "Unknown")
-        created = info.get("/CreationDate", "")
-        if created.startswith("D:"):
-            created = datetime.strptime(created[2:16], "%Y%m%d%H%M%S")
-        else:
-            created = None
-        return {
-            "author": author,
-            "number_of_pages": len(reader.pages),
-            "created_date": created
-        }
-    except Exception as e:
-        print(f"[ES] ⚠️ Metadata extraction failed for {path}: {e}")
-        return {"author": "Unknown", "number_of_pages": 0, "created_date": None}
+_PHRASE_WORD_RE = re.compile(r"\b[^\W\d_]{5,}\b", re.UNICODE)
+SUGGEST_PHRASES = 5
+
+
+def title_from_filename(filename: str) -> str:
+    """"umowa_najmu-2024.pdf" → "umowa najmu 2024"."""
+    stem = os.path.splitext(filename or "")[0]
+    return " ".join(re.split(r"[\s_\-.]+", stem)).strip()
+
+
+def suggest_inputs(filename: str, summary: str = "") -> list[str]:
+    """Wejścia pola `suggest`: tytuł z nazwy pliku + najczęstsze słowa kluczowe streszczenia."""
+    words = Counter(w.lower() for w in _PHRASE_WORD_RE.findall(summary or ""))
+    phrases = [w for w, _ in words.most_common(SUGGEST_PHRASES)]
+    return [title_from_filename(filename), *phrases]
 
 
-def index_pdf(path, filename, summary="", language="unknown"):
-    """Indeksuj dokument PDF."""
+def build_document(path, filename, summary="", language="unknown", doc_id=None, text="", metadata=None) -> dict:
+    """Treść dokumentu ES (wspólna dla index_pdf i przebudowy indeksu)."""
+    metadata = metadata or {"author": "Unknown", "number_of_pages": 0, "created_date": None}
+    return {
+        "doc_id": doc_id or filename,
+        "filename": filename,
+        "path": str(path),
+        content_field(language): text if text.strip() else "(empty document)",
+        "summary": summary or "",
+        "author": metadata["author"],
+        "number_of_pages": metadata["number_of_pages"],
+        "created_date": metadata["created_date"],
+        "language": language,
+        "suggest": suggest_inputs(filename, summary),
+        "upload_date": datetime.utcnow().isoformat()
+    }
+
+
+def index_pdf(path, filename, summary="", language="unknown", doc_id=None, text=None, metadata=None):
+    """Indeksuj dokument PDF (_id = doc_id z SQLite; starsze wpisy: filename).
+    `text` / `metadata` — już wyekstrahowane (bez ponownego czytania PDF)."""
     if not es or not check_connection():
-        print("[ES] ⚠️ Elasticsearch not available – skipping indexing.")
+        logger.warning("[ES] ⚠️ Elasticsearch not available – skipping indexing.")
         return
 
     create_index()
 
     try:
-        text = extract_text_from_pdf(path)
-        if not text.strip():
-            text = "(empty document)"
-
-        metadata = extract_metadata(path)
-        doc = {
-            "filename": filename,
-            "path": str(path),
-            "content": text,
-            "summary": summary or "",
-            "author": metadata["author"],
-            "number_of_pages": metadata["number_of_pages"],
-            "created_date": metadata["created_date"],
-            "language": language,
-            "upload_date": datetime.utcnow().isoformat()
-        }
+        if text is None:
+            text = extract_text_from_pdf(path)
+        if metadata is None:
+            metadata = extract_metadata(path)
+        doc = build_document(path, filename, summary, language, doc_id, text, metadata)
 
-        es.index(index=ES_INDEX, document=doc, id=filename)
-        print(f"[ES] ✅ Indexed {filename}")
+        with timed("es_index") as sp:
+            sp.set(content_chars=len(text))
+            for index in _write_indices():
+                es.index(index=index, document=doc, id=doc_id or filename)
+        logger.info("[ES] ✅ Indexed %s", filename)
     except Exception as e:
-        print(f"[ES] ❌ Failed to index {filename}: {e}")
+        logger.error("[ES] ❌ Failed to index %s: %s", filename, e)
 
 
-def search(query: str):
-    """Wyszukiwanie pełnotekstowe."""
+def search_body(query: str, size: int = 10, highlight: bool = True) -> dict:
+    """Zapytanie pełnotekstowe: pola językowe + n-gramy nazw plików, bez `content` w _source."""
+    body = {
+        "query": {
+            "multi_match": {
+                "query": query,
+                "fields": SEARCH_FIELDS,
+            }
+        },
+        "_source": {"excludes": SOURCE_EXCLUDES},
+        "size": size,
+    }
+    if highlight:
+        body["highlight"] = {
+            "encoder": "html",
+            "fields": {field: {"fragment_size": 150, "number_of_fragments": 2} for field in CONTENT_FIELDS},
+        }
+    return body
+
+
+def suggest_body(prefix: str, size: int = 8) -> dict:
+    """Zapytanie search-as-you-type (bool_prefix) po tytułach i frazach kluczowych."""
+    return {
+        "query": {
+            "multi_match": {
+                "query": prefix,
+                "type": "bool_prefix",
+                "fields": ["suggest", "suggest._2gram", "suggest._3gram"],
+            }
+        },
+        "_source": ["filename", "suggest"],
+        "size": size,
+        "timeout": "15ms",
+        "track_total_hits": False,
+    }
+
+
+def search(query: str, size: int = 10):
+    """Wyszukiwanie pełnotekstowe; zamiast treści zwraca fragmenty z podświetleniem (`highlight`)."""
     if not es or not check_connection():
-        print("[ES] ⚠️ Elasticsearch unavailable – returning empty result.")
+        logger.warning("[ES] ⚠️ Elasticsearch unavailable – returning empty result.")
         return []
 
     try:
-        res = es.search(index=ES_INDEX, body={
-            "query": {
-                "multi_match": {
-                    "query": query,
-                    "fields": ["filename^3", "author^2", "summary", "content"]
+        with timed("es_search") as sp:
+            res = es.search(index=ES_INDEX, body=search_body(query, size))
+            hits = res.get("hits", {}).get("hits", [])
+            results = [
+                {
+                    **h["_source"],
+                    "_score": h.get("_score"),
+                    "highlight": [frag for frags in h.get("highlight", {}).values() for frag in frags],
                 }
-            }
-        })
-        hits = res.get("hits", {}).get("hits", [])
-        print(f"[ES] 🔍 Found {len(hits)} results for query: {query}")
-        return [h["_source"] for h in hits]
+                for h in hits
+            ]
+            sp.set(query_chars=len(query), hits=len(hits),
+                   payload_chars=sum(len(str(h["_source"])) for h in hits))
+        logger.debug("[ES] 🔍 hits=%d query=%r", len(hits), query)
+        return results
     except Exception as e:
-        print(f"[ES] ❌ Search error: {e}")
+        logger.error("[ES] ❌ Search error: %s", e)
         return []
 
 
-def delete_from_index(filename: str):
-    """Usuń plik z indeksu."""
+def bulk_update_fields(updates: dict) -> int:
+    """
+    Częściowa aktualizacja wielu dokumentów po _id jednym żądaniem bulk
+    i jednym refreshem na końcu. updates: {doc_id: {pole: wartość}}.
+    Zwraca liczbę zaktualizowanych dokumentów.
+    """
+    if not updates or not es or not check_connection():
+        return 0
+    actions = (
+        {"_op_type": "update", "_index": index, "_id": doc_id, "doc": fields}
+        for index in _write_indices()
+        for doc_id, fields in updates.items()
+    )
+    try:
+        with timed("es_bulk_update") as sp:
+            ok, errors = helpers.bulk(es, actions, chunk_size=1000, raise_on_error=False, refresh=False)
+            es.indices.refresh(index=ES_INDEX)
+            sp.set(docs=len(updates), errors=len(errors))
+        for err in errors[:5]:
+            logger.warning("[ES] bulk update error: %s", err)
+        return ok
+    except Exception as e:
+        logger.error("[ES] ❌ Bulk update failed: %s", e)
+        return 0
+
+
+def update_fields(doc_id: str, fields: dict):
+    """Częściowa aktualizacja jednego dokumentu po _id."""
     if not es or not check_connection():
         return
     try:
-        es.delete_by_query(index=ES_INDEX, body={
-            "query": {"term": {"filename": {"value": filename}}}
-        })
-        print(f"[ES] 🗑️ Deleted {filename}")
+        with timed("es_update"):
+            es.update(index=ES_INDEX, id=doc_id, doc=fields)
+        for shadow in shadow_indices():
+            # brak w indeksie w budowie → dokument dojdzie bulkiem albo przy uzgadnianiu (es_reindex)
+            es.options(ignore_status=404).update(index=shadow, id=doc_id, doc=fields)
+    except Exception as e:
+        logger.warning("[ES] ⚠️ Failed to update %s: %s", doc_id, e)
+
+
+def delete_from_index(doc_id: str):
+    """Usuń dokument z indeksu po _id."""
+    if not es or not check_connection():
+        return
+    try:
+        with timed("es_delete"):
+            for shadow in shadow_indices():
+                es.options(ignore_status=404).delete(index=shadow, id=doc_id)
+            es.delete(index=ES_INDEX, id=doc_id)
+        logger.info("[ES] 🗑️ Deleted %s", doc_id)
+    except exceptions.NotFoundError:
+        logger.debug("[ES] %s not in index", doc_id)
+    except Exception as e:
+        logger.warning("[ES] ⚠️ Failed to delete %s: %s", doc_id, e)
+
+
+def bulk_delete(doc_ids: list) -> int:
+    """Usuwa wiele dokumentów po _id jednym żądaniem bulk."""
+    if not doc_ids or not es or not check_connection():
+        return 0
+    actions = (
+        {"_op_type": "delete", "_index": index, "_id": doc_id}
+        for index in _write_indices()
+        for doc_id in doc_ids
+    )
+    try:
+        with timed("es_bulk_delete"):
+            ok, _ = helpers.bulk(es, actions, raise_on_error=False, refresh=False)
+        return ok
     except Exception as e:
-        print(f"[ES] ⚠️ Failed to delete {filename}: {e}")
+        logger.error("[ES] ❌ Bulk delete failed: %s", e)
+        return 0
 
 
 def clear_index():
-    """Wyczyść cały indeks."""
+    """Wyczyść cały indeks: nowy pusty indeks za aliasem, stary usuwany w całości
+    (zamiast delete_by_query dokument po dokumencie)."""
+    global _index_ready
     if not es or not check_connection():
-        print("[ES] ⚠️ Elasticsearch not connected – cannot clear index.")
+        logger.warning("[ES] ⚠️ Elasticsearch not connected – cannot clear index.")
         return
     try:
-        es.delete_by_query(index=ES_INDEX, body={"query": {"match_all": {}}})
-        print("[ES] 🧹 Index cleared.")
+        drop_indices(swap_alias(create_physical_index()))
+        _index_ready = True
+        logger.info("[ES] 🧹 Index cleared.")
     except Exception as e:
-        print(f"[ES] ❌ Failed to clear index: {e}")
\ No newline at end of file
+        logger.error("[ES] ❌ Failed to clear index: %s", e)
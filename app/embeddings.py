@@ -1,21 +1,27 @@
+import logging
 import vertexai
 from vertexai.language_models import TextEmbeddingModel
+from app import vertex_governor
+from app.metrics import timed
+
+logger = logging.getLogger(__name__)
 
 # === Vertex AI initialization ===
 PROJECT_ID = "smartdocfinder-ai"
 REGION = "us-central1"
 
 vertexai.init(project=PROJECT_ID, location=REGION)
-print(f"[VertexAI] Initialized for project '{PROJECT_ID}' in region '{REGION}'")
+logger.info("[VertexAI] Initialized for project '%s' in region '%s'", PROJECT_ID, REGION)
 
 def generate_text_embeddings(text: str):
     """Generate text embeddings using Vertex AI (text-embedding-004)."""
     try:
         model = TextEmbeddingModel.from_pretrained("text-embedding-004")
-        embeddings = model.get_embeddings([text])
+        with timed("embedding"):
+            embeddings = vertex_governor.call("embed", lambda: model.get_embeddings([text]))
         vector = embeddings[0].values
-        print(f"[INFO] Generated embedding of length {len(vector)}")
+        logger.debug("[VertexAI] Generated embedding dims=%d", len(vector))
         return vector
     except Exception as e:
-        print(f"[ERROR] Vertex AI embedding failed: {e}")
+        logger.error("[VertexAI] embedding failed: %s", e)
         return []
\ No newline at end of file
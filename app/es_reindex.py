@@ -0,0 +1,188 @@
+# app/es_reindex.py
+"""
+Przebudowa indeksu ES bez przestoju.
+
+ES_INDEX jest aliasem. Przebudowa tworzy nowy wersjonowany indeks fizyczny
+(aktualny szablon, bez replik i refreshu na czas ładowania), ładuje go bulkiem
+z SQLite (teksty stron z document_pages — bez ponownego czytania PDF-ów),
+przywraca ustawienia, sprawdza liczbę dokumentów i dopiero wtedy atomowo
+przepina alias oraz usuwa stary indeks. Wyszukiwanie przez cały czas działa
+na starym indeksie; zapisy w trakcie przebudowy trafiają do obu — nowy indeks
+wskazuje alias esu.SHADOW_ALIAS, więc widzą go wszystkie workery.
+
+Bulk ładuje migawkę z SQLite, a zmiany z innych workerów (update/delete na dokumencie,
+którego bulk jeszcze nie załadował) trafiają w 404. Przed przepięciem aliasu nowy indeks
+jest więc uzgadniany ze świeżym stanem SQLite: usunięte dokumenty są z niego kasowane,
+nowe i zmienione — indeksowane ponownie, a liczba dokumentów porównywana ze świeżą liczbą.
+"""
+import logging
+import threading
+import time
+from pathlib import Path
+
+from app import db
+from app import elasticsearch_utils as esu
+from app.pdf_utils import extract_metadata, extract_text_from_pdf
+from app.tracing import span
+
+logger = logging.getLogger(__name__)
+
+BULK_CHUNK = 500
+STALE_SHADOW_S = 6 * 3600   # starszy indeks za SHADOW_ALIAS to pozostałość po przerwanej przebudowie
+
+_lock = threading.Lock()
+_state: dict = {"status": "idle"}
+
+
+def _document_text(doc: dict, path: Path) -> str:
+    pages = db.get_pages(doc["doc_id"])
+    if pages:
+        return " ".join(p["text"] for p in pages if p["text"])
+    return extract_text_from_pdf(path)
+
+
+def _actions(index: str, docs: list, stats: dict):
+    for d in docs:
+        path = Path(d["filepath"])
+        if not path.exists():
+            stats["skipped"] += 1
+            continue
+        try:
+            body = esu.build_document(
+                path, d["filename"], d.get("summary") or "", d.get("language") or "unknown",
+                doc_id=d["doc_id"], text=_document_text(d, path), metadata=extract_metadata(path),
+            )
+        except Exception as e:
+            logger.warning("[REINDEX] ❌ %s: %s", d["filename"], e)
+            stats["failed"] += 1
+            continue
+        yield {"_op_type": "index", "_index": index, "_id": d["doc_id"], "_source": body}
+
+
+def _fingerprint(doc: dict) -> tuple:
+    return (doc["filename"], doc["filepath"], doc.get("summary"), doc.get("language"),
+            doc.get("content_hash"), doc.get("version"), doc.get("folder"))
+
+
+def _reconcile(index: str, snapshot: list, stats: dict) -> tuple:
+    """Dopasowuje nowy indeks do bieżącego SQLite (zmiany z czasu bulka); zwraca (świeża lista, błędy)."""
+    before = {d["doc_id"]: _fingerprint(d) for d in snapshot}
+    fresh = db.list_documents()
+    current = {d["doc_id"] for d in fresh}
+    deleted = [doc_id for doc_id in before if doc_id not in current]
+    changed = [d for d in fresh if before.get(d["doc_id"]) != _fingerprint(d)]
+    errors = []
+    if deleted:
+        _, errors = esu.helpers.bulk(
+            esu.es, ({"_op_type": "delete", "_index": index, "_id": doc_id} for doc_id in deleted),
+            chunk_size=BULK_CHUNK, raise_on_error=False, refresh=False,
+        )
+        errors = [e for e in errors if e.get("delete", {}).get("status") != 404]
+    if changed:
+        _, index_errors = esu.helpers.bulk(
+            esu.es, _actions(index, changed, stats),
+            chunk_size=BULK_CHUNK, raise_on_error=False, refresh=False,
+        )
+        errors += index_errors
+    stats.update(reconciled_deleted=len(deleted), reconciled_changed=len(changed))
+    if deleted or changed:
+        logger.info("[REINDEX] 🔁 %s: %d deleted, %d new/changed during the bulk load", index, len(deleted), len(changed))
+    return fresh, errors
+
+
+def _claim_shadow():
+    """Przebudowa w toku (także na innym workerze) → błąd; pozostałość po przerwanej — usuwana."""
+    for idx in esu.shadow_indices():
+        created = int(esu.es.indices.get_settings(index=idx)[idx]["settings"]["index"]["creation_date"]) / 1000
+        if time.time() - created < STALE_SHADOW_S:
+            raise RuntimeError(f"reindex already in progress ({idx})")
+        logger.warning("[REINDEX] ⚠️ Dropping stale shadow index %s", idx)
+        esu.drop_indices([idx])
+
+
+def run_reindex() -> dict:
+    """Buduje nowy indeks, waliduje go i przepina alias. Zwraca statystyki."""
+    if not esu.es or not esu.check_connection():
+        raise RuntimeError("Elasticsearch not available")
+
+    stats = {"status": "running", "index": None, "expected": 0, "indexed": 0,
+             "skipped": 0, "failed": 0, "started_at": time.time()}
+    _state.clear()
+    _state.update(stats)
+    stats = _state
+
+    _claim_shadow()
+    new_index = esu.create_physical_index(bulk_load=True)
+    stats["index"] = new_index
+    esu.set_shadow_index(new_index)
+    try:
+        with span("es_reindex", index=new_index) as sp:
+            docs = db.list_documents()
+            ok, errors = esu.helpers.bulk(
+                esu.es, _actions(new_index, docs, stats),
+                chunk_size=BULK_CHUNK, raise_on_error=False, refresh=False,
+            )
+            stats["indexed"] = ok
+            stats["failed"] += len(errors)
+
+            # shadow nadal aktywny — to, co zmieni się od tej chwili, dopiszą workery
+            docs, late_errors = _reconcile(new_index, docs, stats)
+            errors += late_errors
+            stats["failed"] += len(late_errors)
+            build_failed = stats["failed"] - len(errors)
+            stats["expected"] = sum(1 for d in docs if Path(d["filepath"]).exists()) - build_failed
+
+            esu.es.indices.put_settings(
+                index=new_index,
+                settings={"index": {"refresh_interval": None, "number_of_replicas": esu.ES_REPLICAS}},
+            )
+            esu.es.indices.refresh(index=new_index)
+            count = esu.es.count(index=new_index)["count"]
+            stats["count"] = count
+            sp.set(expected=stats["expected"], count=count)
+
+            if errors or count < stats["expected"]:
+                raise RuntimeError(
+                    f"validation failed: {count} docs in {new_index}, expected {stats['expected']}, "
+                    f"{len(errors)} bulk errors"
+                )
+
+            old = esu.swap_alias(new_index)
+            esu.set_shadow_index(None)
+            esu.drop_indices(old)
+    except Exception as e:
+        esu.set_shadow_index(None)
+        logger.error("[REINDEX] ❌ %s – keeping the current index", e)
+        esu.drop_indices([new_index])
+        stats.update(status="failed", error=str(e))
+        raise
+    finally:
+        stats["elapsed_s"] = round(time.time() - stats["started_at"], 2)
+
+    stats["status"] = "completed"
+    logger.info("[REINDEX] ✅ %s: %d docs (%d skipped) in %.1fs",
+                new_index, stats["count"], stats["skipped"], stats["elapsed_s"])
+    return stats
+
+
+def start() -> dict:
+    """Uruchamia przebudowę w wątku w tle (jedna naraz); zwraca bieżący stan."""
+    with _lock:
+        if _state.get("status") in ("starting", "running"):
+            return dict(_state)
+        _state.clear()
+        _state["status"] = "starting"
+
+    def _run():
+        try:
+            run_reindex()
+        except Exception as e:
+            if _state.get("status") != "failed":
+                _state.update(status="failed", error=str(e))
+
+    threading.Thread(target=_run, name="es-reindex", daemon=True).start()
+    return dict(_state)
+
+
+def status() -> dict:
+    return dict(_state)
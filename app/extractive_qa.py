@@ -0,0 +1,160 @@
+# app/extractive_qa.py
+"""
+Odpowiedzi ekstrakcyjne — bez LLM, w dziesiątkach milisekund.
+
+Zdania ze stron znalezionych dokumentów (document_pages w SQLite) są oceniane
+względem pytania: BM25 na rdzeniach słów (prefiks — wystarcza dla odmiany PL/DE)
+plus opcjonalnie podobieństwo lokalnego „embeddingu” (haszowane trigramy znaków,
+EXTRACTIVE_EMBED_WEIGHT=0 wyłącza). Odpowiedź to najlepsze zdania z cytowaniem
+pliku i strony.
+"""
+import logging
+import math
+import os
+import re
+import zlib
+from collections import Counter
+
+from app import db
+from app.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+EMBED_WEIGHT = float(os.getenv("EXTRACTIVE_EMBED_WEIGHT", "0.3"))
+TOP_SENTENCES = 3
+MAX_SENTENCES = 4000        # górny limit zdań oceniających jedno pytanie
+MIN_SENTENCE_CHARS = 25
+MAX_SENTENCE_CHARS = 600
+STEM_CHARS = 6
+EMBED_DIM = 1024
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+_STOPWORDS = frozenset(
+    "the a an and or of to in on for is are was were be by with what which who how why when where does do "
+    "i w z na do o że się jest są czy jak jaki jaka jakie co kto gdzie kiedy dlaczego od po dla nie to ten ta "
+    "der die das und oder ist sind ein eine zu im mit von was wie wer wo warum wann le la les et est un une de"
+    .split()
+)
+
+
+def _terms(text: str) -> list[str]:
+    return [
+        w[:STEM_CHARS]
+        for w in _WORD_RE.findall(text.lower())
+        if len(w) > 1 and w not in _STOPWORDS and not w.isdigit()
+    ]
+
+
+def _embed(text: str) -> dict:
+    """Lokalny wektor: haszowane trigramy znaków (rzadki, znormalizowany)."""
+    s = f" {' '.join(_WORD_RE.findall(text.lower()))} "
+    counts = Counter(zlib.crc32(s[i:i + 3].encode("utf-8")) % EMBED_DIM for i in range(len(s) - 2))
+    norm = math.sqrt(sum(c * c for c in counts.values())) or 1.0
+    return {k: c / norm for k, c in counts.items()}
+
+
+def _cosine(a: dict, b: dict) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+
+def _doc_pages(doc: dict) -> list[dict]:
+    """Strony dokumentu; starsze wpisy ES mają doc_id = filename → szukamy po nazwie."""
+    pages = db.get_pages(doc["doc_id"]) if doc.get("doc_id") else []
+    if not pages and doc.get("filename"):
+        rec = db.get_document(doc["filename"])
+        if rec and rec["doc_id"] != doc.get("doc_id"):
+            pages = db.get_pages(rec["doc_id"])
+    return pages
+
+
+def _sentences(docs: list[dict], query_terms: set) -> list[dict]:
+    """Zdania ze stron zawierających choć jeden termin pytania (reszta nie dostałaby punktów BM25)."""
+    out = []
+    for d in docs:
+        for page in _doc_pages(d):
+            text = page["text"] or ""
+            if not query_terms.intersection(_terms(text)):
+                continue
+            for sentence in _SENTENCE_SPLIT.split(text):
+                sentence = " ".join(sentence.split())
+                if len(sentence) < MIN_SENTENCE_CHARS:
+                    continue
+                out.append({
+                    "filename": d["filename"],
+                    "page": page["page"],
+                    "text": sentence[:MAX_SENTENCE_CHARS],
+                    "terms": _terms(sentence),
+                })
+                if len(out) >= MAX_SENTENCES:
+                    return out
+    return out
+
+
+def _bm25(query_terms: list[str], sentences: list[dict]) -> list[float]:
+    n = len(sentences)
+    avg_len = sum(len(s["terms"]) for s in sentences) / n or 1.0
+    df = Counter(t for s in sentences for t in set(s["terms"]))
+    idf = {t: math.log(1 + (n - df[t] + 0.5) / (df[t] + 0.5)) for t in set(query_terms)}
+    scores = []
+    for s in sentences:
+        tf = Counter(s["terms"])
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * len(s["terms"]) / avg_len)
+        scores.append(sum(
+            idf[t] * tf[t] * (BM25_K1 + 1) / (tf[t] + norm)
+            for t in idf if tf[t]
+        ))
+    return scores
+
+
+def rank_sentences(question: str, docs: list[dict], top_n: int = TOP_SENTENCES) -> list[dict]:
+    """Najlepsze zdania dla pytania: [{filename, page, text, score}]. `docs`: [{doc_id, filename}]."""
+    query_terms = _terms(question)
+    if not query_terms or not docs:
+        return []
+    sentences = _sentences(docs, set(query_terms))
+    if not sentences:
+        return []
+
+    scores = _bm25(query_terms, sentences)
+    top_bm25 = max(scores) or 1.0
+    if EMBED_WEIGHT > 0:
+        q_vec = _embed(question)
+        scores = [
+            (1 - EMBED_WEIGHT) * score / top_bm25 + EMBED_WEIGHT * _cosine(q_vec, _embed(s["text"]))
+            if score else 0.0
+            for s, score in zip(sentences, scores)
+        ]
+    else:
+        scores = [score / top_bm25 for score in scores]
+
+    ranked, seen = [], set()
+    for i in sorted(range(len(sentences)), key=scores.__getitem__, reverse=True):
+        s = sentences[i]
+        if scores[i] <= 0 or len(ranked) >= top_n:
+            break
+        if s["text"] in seen:
+            continue
+        seen.add(s["text"])
+        ranked.append({"filename": s["filename"], "page": s["page"], "text": s["text"], "score": round(scores[i], 3)})
+    return ranked
+
+
+def answer(question: str, docs: list[dict], top_n: int = TOP_SENTENCES) -> dict:
+    """Odpowiedź ekstrakcyjna: {answer, sources, citations, mode}."""
+    with timed("extractive_qa"):
+        citations = rank_sentences(question, docs, top_n)
+    if not citations:
+        text = "No passage in the matching documents answers this question."
+    else:
+        text = " ".join(f"{c['text']} [{c['filename']}, p. {c['page']}]" for c in citations)
+    return {
+        "answer": text,
+        "sources": list(dict.fromkeys(c["filename"] for c in citations)) or [d["filename"] for d in docs],
+        "citations": citations,
+        "mode": "extractive",
+    }
@@ -0,0 +1,136 @@
+# app/health.py
+"""
+Podsystem health: sondy zależności (Elasticsearch, Vertex AI, SQLite) działają
+w tle co HEALTH_INTERVAL sekund, każda z własnym timeoutem, a wyniki są
+cache'owane. Endpoint /admin/health tylko czyta ostatni snapshot.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import datetime
+
+from app import admission, cache, model_router, vertex_governor
+from app.metrics import QUEUE_DEPTH, cache_stats
+
+logger = logging.getLogger(__name__)
+
+HEALTH_INTERVAL = float(os.getenv("HEALTH_INTERVAL", "30"))
+PROBE_TIMEOUTS = {
+    "elasticsearch": float(os.getenv("HEALTH_ES_TIMEOUT", "2")),
+    "vertex_ai": 1.0,
+    "database": 1.0,
+}
+
+_results: dict = {}
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=len(PROBE_TIMEOUTS), thread_name_prefix="health")
+_started = False
+
+
+def _probe_elasticsearch() -> dict:
+    from app.elasticsearch_utils import es, ES_INDEX
+    if not es:
+        return {"connected": False, "index": None, "docs": None}
+    client = es.options(request_timeout=PROBE_TIMEOUTS["elasticsearch"])
+    if not client.ping():
+        return {"connected": False, "index": ES_INDEX, "docs": None}
+    exists = bool(client.indices.exists(index=ES_INDEX))
+    docs = client.count(index=ES_INDEX)["count"] if exists else 0
+    return {"connected": True, "index": ES_INDEX, "index_exists": exists, "docs": docs}
+
+
+def _probe_vertex() -> dict:
+    # bez ponownego vertexai.init / from_pretrained — stan z inicjalizacji modułu
+    from app.vertex_utils import get_vertex_status
+    return get_vertex_status()
+
+
+def _probe_database() -> dict:
+    from app import db
+    return {"documents": db.count_documents(), "folders": len(db.list_folders())}
+
+
+_PROBES = {
+    "elasticsearch": _probe_elasticsearch,
+    "vertex_ai": _probe_vertex,
+    "database": _probe_database,
+}
+
+
+def run_probes():
+    """Uruchamia wszystkie sondy równolegle; sonda po timeoucie = błąd (poprzedni wynik zostaje w `last_ok`)."""
+    started = {name: (_executor.submit(fn), time.perf_counter()) for name, fn in _PROBES.items()}
+    for name, (future, t0) in started.items():
+        entry = {"checked_at": datetime.utcnow().isoformat()}
+        try:
+            entry["data"] = future.result(timeout=PROBE_TIMEOUTS[name])
+            entry["ok"] = True
+        except FutureTimeout:
+            entry.update(ok=False, error=f"timeout after {PROBE_TIMEOUTS[name]}s")
+        except Exception as e:
+            entry.update(ok=False, error=str(e))
+        entry["latency_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        with _lock:
+            previous = _results.get(name, {})
+            if not entry["ok"]:
+                entry["last_ok"] = previous["data"] if previous.get("ok") else previous.get("last_ok")
+            _results[name] = entry
+        if not entry["ok"]:
+            logger.warning("[HEALTH] %s probe failed: %s", name, entry["error"])
+
+
+def _loop():
+    while True:
+        try:
+            run_probes()
+        except Exception as e:
+            logger.error("[HEALTH] probe loop error: %s", e)
+        time.sleep(HEALTH_INTERVAL)
+
+
+def start():
+    """Startuje pętlę sond w wątku w tle (idempotentnie)."""
+    global _started
+    if _started:
+        return
+    _started = True
+    threading.Thread(target=_loop, name="health-probes", daemon=True).start()
+
+
+def snapshot() -> dict:
+    """Ostatni stan z cache + bieżące liczniki in-process (bez I/O)."""
+    with _lock:
+        results = {k: dict(v) for k, v in _results.items()}
+
+    es_entry = results.get("elasticsearch", {})
+    es_data = es_entry.get("data", {}) if es_entry.get("ok") else {}
+    vertex_data = results.get("vertex_ai", {}).get("data", {})
+    db_data = results.get("database", {}).get("data", {})
+
+    return {
+        "app": "running",
+        "elasticsearch": {
+            "connected": bool(es_data.get("connected")),
+            "index": es_data.get("index"),
+            "index_exists": es_data.get("index_exists", False),
+            "docs": es_data.get("docs") if es_data.get("connected") else "unavailable",
+        },
+        "vertex_ai": {
+            "enabled": vertex_data.get("enabled", False),
+            "model": vertex_data.get("model", "—"),
+            "governor": vertex_governor.stats(),
+            "router": model_router.stats(),
+        },
+        "database": db_data,
+        "queues": {key[0]: value for key, value in QUEUE_DEPTH.values().items()},
+        "admission": admission.stats(),
+        "caches": cache_stats(),
+        "cache_backend": cache.stats(),
+        "probes": {
+            name: {k: v for k, v in entry.items() if k != "data"}
+            for name, entry in results.items()
+        },
+        "status": "pending" if not results else ("ok" if all(e.get("ok") for e in results.values()) else "degraded"),
+    }
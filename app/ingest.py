@@ -0,0 +1,216 @@
+# app/ingest.py
+"""
+Pipeline przetwarzania zapisanego PDF-a: ekstrakcja → język → dedup → streszczenie
+→ indeks ES → embedding. Wspólny dla upload-pdf i upload-multiple.
+
+Wersjonowanie: ponowny upload zmienionego pliku tworzy nową wersję. Strony są
+porównywane odciskami z poprzednią wersją — niezmienione strony nie są ponownie
+czytane ani OCR-owane, a streszczenie korzysta z cache fragmentów (summarizer),
+więc do LLM trafiają tylko zmienione fragmenty.
+
+Dedup: identyczna treść (sha256) albo prawie-duplikat (MinHash/LSH) — w trybie
+DEDUP_MODE=reuse (domyślnie) streszczenie, język i embedding są brane z oryginału,
+bez wywołań LLM; w trybie "flag" dokument jest tylko oznaczany.
+
+Pamięć: w trakcie ekstrakcji w RAM-ie zostają tylko numery, odciski i hashe stron.
+Teksty stron idą do pliku tymczasowego (stamtąd do document_pages), a do analizy,
+dedupu i indeksu trafia najwyżej MAX_TEXT_CHARS znaków. Teksty stron poprzedniej
+wersji są czytane z SQLite dopiero przy trafieniu odcisku.
+"""
+import difflib
+import json
+import logging
+import os
+import tempfile
+from collections.abc import Mapping
+from pathlib import Path
+
+from app import db, clustering, dedup, progress, vector_store
+from app.ai_utils import analyze_pdf
+from app.elasticsearch_utils import index_pdf
+from app.lang_id import identify_pages
+from app.metrics import timed
+from app.pdf_utils import iter_pages
+from app.tracing import span
+
+logger = logging.getLogger(__name__)
+
+DEDUP_MODE = os.getenv("DEDUP_MODE", "reuse")   # reuse | flag | off
+LANG_SAMPLE_PAGES = 16                          # ile stron (równomiernie) trafia do detekcji języka
+MAX_TEXT_CHARS = int(os.getenv("INGEST_MAX_TEXT_CHARS", "2000000"))  # tekst dokumentu trzymany w pamięci
+
+
+def _find_original(doc_id: str, content_hash: str | None, signature):
+    """(rekord oryginału, podobieństwo) albo (None, 0.0)."""
+    if content_hash:
+        exact = db.find_by_content_hash(content_hash, exclude_doc_id=doc_id)
+        if exact:
+            return exact, 1.0
+    if signature is not None:
+        match = dedup.find_near_duplicate(signature, exclude_doc_id=doc_id)
+        if match:
+            return db.get_document_by_id(match[0]), match[1]
+    return None, 0.0
+
+
+def is_new_version(existing, content_hash: str) -> bool:
+    """Ponowny upload znanego dokumentu ze zmienioną treścią."""
+    return existing is not None and existing.get("content_hash") != content_hash
+
+
+def store_upload(filename: str, dest: Path, existing, data, content_hash: str):
+    """Zapisuje plik (`data`: bytes albo ścieżka pliku tymczasowego na tym samym dysku);
+    nowa wersja trafia w miejsce poprzedniej (także w folderze). Zwraca (ścieżka, doc_id)."""
+    if existing:
+        dest = Path(existing["filepath"])
+        dest.parent.mkdir(parents=True, exist_ok=True)
+    if isinstance(data, Path):
+        os.replace(data, dest)
+    else:
+        tmp = dest.with_suffix(dest.suffix + ".part")
+        tmp.write_bytes(data)
+        os.replace(tmp, dest)  # atomowo — /view nie zobaczy połowy pliku
+    if existing:
+        return dest, existing["doc_id"]
+    return dest, db.add_document(filename, dest, content_hash=content_hash)
+
+
+def changed_pages(previous: list[dict], pages: list[dict]) -> list[int]:
+    """Numery stron nowej wersji, których tekst różni się od poprzedniej (diff z wyrównaniem,
+    więc wstawienie strony nie oznacza wszystkich kolejnych jako zmienionych)."""
+    matcher = difflib.SequenceMatcher(
+        a=[p["text_hash"] for p in previous], b=[p["text_hash"] for p in pages], autojunk=False
+    )
+    changed = []
+    for tag, _, _, j1, j2 in matcher.get_opcodes():
+        if tag != "equal":
+            changed.extend(pages[j]["page"] for j in range(j1, j2))
+    return changed
+
+
+class _KnownPages(Mapping):
+    """Odcisk → tekst strony poprzedniej wersji; tekst z SQLite dopiero przy trafieniu."""
+
+    def __init__(self, doc_id: str, previous: list[dict]):
+        self._doc_id = doc_id
+        self._pages = {p["fingerprint"]: p["page"] for p in previous if p["fingerprint"]}
+
+    def __getitem__(self, fingerprint):
+        return db.get_page_text(self._doc_id, self._pages[fingerprint]) or ""
+
+    def __iter__(self):
+        return iter(self._pages)
+
+    def __len__(self):
+        return len(self._pages)
+
+
+def _spooled_pages(pages: list[dict], spool):
+    """Rekordy stron z tekstami z pliku tymczasowego (jedna strona naraz)."""
+    spool.seek(0)
+    for page, line in zip(pages, spool):
+        yield {**page, "text": json.loads(line)}
+
+
+def _document_language(page_texts: list[str]) -> dict:
+    """Język dokumentu z próbki stron (identify_pages): {"lang", "languages"}."""
+    texts = [t for t in page_texts if t]
+    step = max(1, len(texts) // LANG_SAMPLE_PAGES)
+    with timed("language_detection"):
+        result = identify_pages(texts[::step][:LANG_SAMPLE_PAGES])
+    return {"lang": result["lang"], "languages": result["languages"]}
+
+
+def _extract(dest: Path, doc_id: str, previous: list[dict], metadata: dict, spool):
+    """Strony strumieniowo z jednego readera (metadane z tego samego przebiegu). Teksty stron
+    idą do `spool`; zwraca (rekordy stron bez tekstu, teksty do MAX_TEXT_CHARS, liczba znaków)."""
+    pages, texts, kept, chars = [], [], 0, 0
+    for page in iter_pages(dest, _KnownPages(doc_id, previous), meta=metadata):
+        page_text = page.pop("text")
+        spool.write(json.dumps(page_text) + "\n")
+        pages.append(page)
+        chars += len(page_text)
+        if page_text and kept < MAX_TEXT_CHARS:
+            texts.append(page_text[:MAX_TEXT_CHARS - kept])
+            kept += len(texts[-1]) + 1
+        progress.emit("extracting", page=page["page"], pages=metadata.get("number_of_pages"))
+    spool.flush()
+    return pages, texts, chars
+
+
+def ingest_document(dest: Path, filename: str, doc_id: str, content_hash: str | None = None) -> dict:
+    """Przetwarza zapisany plik (nowy dokument albo nową wersję istniejącego);
+    zwraca {text, summary, language, duplicate_of, similarity, version, changed_pages}
+    (`text` — najwyżej MAX_TEXT_CHARS znaków)."""
+    with span("ingest", filename=filename) as sp, tempfile.TemporaryFile("w+", encoding="utf-8") as spool:
+        previous = db.get_pages(doc_id, with_text=False)
+        metadata = {}
+        with timed("extraction"):
+            pages, texts, chars = _extract(dest, doc_id, previous, metadata, spool)
+        text = " ".join(texts)
+        if chars > MAX_TEXT_CHARS:
+            logger.info("[INGEST] %s: %d chars — analysing and indexing the first %d", filename, chars, MAX_TEXT_CHARS)
+        changed = changed_pages(previous, pages)
+        progress.emit("extracted", pages=len(pages), changed_pages=len(changed), chars=chars)
+
+        def save_version():
+            return db.save_version(doc_id, content_hash, _spooled_pages(pages, spool), changed, page_count=len(pages))
+
+        current = db.get_document_by_id(doc_id) if previous else None
+        if current and not changed and len(previous) == len(pages) and current.get("summary"):
+            # zmieniły się tylko bajty pliku (np. metadane) — treść, analiza i indeks bez zmian
+            version = save_version()
+            sp.set(text_chars=chars, version=version, changed_pages=0)
+            return {
+                "text": text,
+                "summary": current["summary"],
+                "language": current.get("language") or "unknown",
+                "duplicate_of": None,
+                "similarity": None,
+                "version": version,
+                "changed_pages": [],
+            }
+
+        detected = _document_language(texts)
+        language = detected["lang"]
+
+        original, sim, signature = None, 0.0, None
+        if DEDUP_MODE != "off" and text.strip():
+            signature = dedup.compute_signature(text)
+            original, sim = _find_original(doc_id, content_hash, signature)
+
+        reuse = original is not None and DEDUP_MODE == "reuse" and bool(original.get("summary"))
+        if reuse:
+            summary = original["summary"]
+            language = original.get("language") or language
+            logger.info("[INGEST] %s ≈ %s (%.2f) — reusing analysis", filename, original["filename"], sim)
+        else:
+            summary = analyze_pdf(dest, text=text)
+        progress.emit("summarised", reused=reuse, duplicate_of=original["filename"] if original else None)
+
+        index_pdf(dest, filename, summary, language, doc_id=doc_id, text=text, metadata=metadata or None)
+        progress.emit("indexed", language=language)
+        db.set_document_analysis(filename, summary, language)
+        db.set_duplicate_of(filename, original["doc_id"] if original else None)
+        if reuse and db.copy_embedding(original["doc_id"], doc_id):
+            vector = vector_store.get(original["doc_id"])
+            if vector is not None:
+                vector_store.add(doc_id, vector)
+        else:
+            clustering.index_document(doc_id, filename, summary)
+        if signature is not None:
+            dedup.register(doc_id, signature)
+        version = save_version()
+
+        sp.set(text_chars=chars, duplicate=original is not None, reused=reuse,
+               version=version, changed_pages=len(changed))
+        return {
+            "text": text,
+            "summary": summary,
+            "language": language,
+            "duplicate_of": original["filename"] if original else None,
+            "similarity": round(sim, 3) if original else None,
+            "languages": detected["languages"],
+            "version": version,
+            "changed_pages": changed,
+        }
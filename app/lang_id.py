@@ -0,0 +1,153 @@
+# app/lang_id.py
+"""
+Szybka, lokalna identyfikacja języka.
+
+- próbkuje ograniczoną liczbę znaków z kilku miejsc dokumentu (początek, środek, koniec),
+- ocenia próbkę profilem n-gramów (słowa funkcyjne + charakterystyczne trigramy znaków
+  + znaki diakrytyczne), zwracając język i pewność,
+- memoizuje wynik po hashu próbki,
+- wspiera detekcję per strona dla PDF-ów mieszanych językowo.
+
+Profile są tylko dla pl/en/de/fr, więc wynik profilu przyjmujemy tylko przy silnym
+dopasowaniu: wysoka pewność ORAZ krótkie słowa próbki (≤3 litery, w praktyce słowa
+funkcyjne) w większości pochodzą ze słownika zwycięskiego języka. Hiszpański czy
+niderlandzki dają sporo trafień trigramów „francuskich”, ale ich el/los/van/het
+nie ma na liście fr. W przeciwnym razie decyduje langdetect (jeśli zainstalowany),
+a bez niego — "unknown" (pole content z analizatorem domyślnym zamiast obcego stemmera).
+"""
+import hashlib
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List
+
+from app.metrics import record_cache
+
+SAMPLE_CHARS = 2000
+SAMPLE_WINDOWS = 4
+MIN_CHARS = 50
+LOW_CONFIDENCE = 0.45
+MIN_FUNCTION_COVERAGE = 0.6   # część krótkich słów próbki obecna na liście zwycięzcy
+MIN_SHORT_WORDS = 5           # poniżej — za mało danych, oceniamy tylko pewność
+CACHE_SIZE = 4096
+
+_PROFILES = {
+    "pl": {
+        "words": "i w na z się nie do to że jest o jak po co ale od dla przez przy za lub oraz są być jego jej który która które także tym tego może już będzie tak",
+        "trigrams": "prz rze nie ani cze dzi wie sta ych owa ego nia ści ość ący ając ać ów ię ąc",
+        "chars": "ąćęłńóśźż",
+    },
+    "en": {
+        "words": "the and of to in is that for it with as on are be this by was or from at an which not have has can will their they been also these more than",
+        "trigrams": "the and ing ion tio ent her for hat tha ere ate his con ver all ter thi",
+        "chars": "",
+    },
+    "de": {
+        "words": "der die und in den von zu das mit sich des auf für ist im dem nicht ein eine als auch es an werden aus er hat dass sie nach wird bei oder",
+        "trigrams": "ein ich sch der die und den che cht ung gen end ter ine nde ben eit",
+        "chars": "äöüß",
+    },
+    "fr": {
+        "words": "le la les de des et en un une du est que pour qui dans par pas sur au avec ce il sont plus ou se ne être sa son ses aux cette",
+        "trigrams": "les ent que ion tio ait our des ons men eur ant est qui par",
+        "chars": "àâçéèêëîïôùûÿœ",
+    },
+}
+_WORDS = {lang: set(p["words"].split()) for lang, p in _PROFILES.items()}
+_TRIGRAMS = {lang: set(p["trigrams"].split()) for lang, p in _PROFILES.items()}
+_CHARS = {lang: set(p["chars"]) for lang, p in _PROFILES.items()}
+
+_WORD_RE = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+_cache: "OrderedDict[str, Dict]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+try:
+    from langdetect import detect as _langdetect, DetectorFactory
+    DetectorFactory.seed = 0
+except ImportError:  # langdetect jest opcjonalny
+    _langdetect = None
+
+
+def sample_text(text: str, budget: int = SAMPLE_CHARS, windows: int = SAMPLE_WINDOWS) -> str:
+    """Zwraca ≤budget znaków: równe okna z początku, środka i końca tekstu."""
+    if len(text) <= budget:
+        return text
+    size = budget // windows
+    step = (len(text) - size) // (windows - 1)
+    return " ".join(text[i * step:i * step + size] for i in range(windows))
+
+
+def _score(sample: str) -> Dict[str, float]:
+    lowered = sample.lower()
+    words = Counter(_WORD_RE.findall(lowered))
+    letters = Counter(lowered)
+    scores = {}
+    for lang in _PROFILES:
+        word_hits = sum(c for w, c in words.items() if w in _WORDS[lang])
+        tri_hits = sum(lowered.count(t) for t in _TRIGRAMS[lang])
+        char_hits = sum(letters[c] for c in _CHARS[lang])
+        scores[lang] = 3.0 * word_hits + tri_hits + 4.0 * char_hits
+    return scores
+
+
+def _function_coverage(sample: str, lang: str) -> float | None:
+    """Jaka część krótkich słów próbki jest na liście słów funkcyjnych `lang` (None — za mało słów)."""
+    short = [w for w in _WORD_RE.findall(sample.lower()) if len(w) <= 3]
+    if len(short) < MIN_SHORT_WORDS:
+        return None
+    return sum(w in _WORDS[lang] for w in short) / len(short)
+
+
+def _classify(sample: str) -> Dict:
+    scores = _score(sample)
+    total = sum(scores.values())
+    if total <= 0:
+        return {"lang": "unknown", "confidence": 0.0}
+    lang, best = max(scores.items(), key=lambda kv: kv[1])
+    result = {"lang": lang, "confidence": round(best / total, 3)}
+
+    coverage = _function_coverage(sample, lang)
+    strong = result["confidence"] >= LOW_CONFIDENCE and (coverage is None or coverage >= MIN_FUNCTION_COVERAGE)
+    if strong:
+        return result
+    if _langdetect is not None:
+        try:
+            return {"lang": _langdetect(sample), "confidence": result["confidence"], "fallback": "langdetect"}
+        except Exception:
+            pass
+    return {"lang": "unknown", "confidence": result["confidence"], "guess": lang}
+
+
+def identify(text: str) -> Dict:
+    """Zwraca {"lang": kod ISO 639-1 | "unknown", "confidence": 0..1}."""
+    if not text or len(text.strip()) < MIN_CHARS:
+        return {"lang": "unknown", "confidence": 0.0}
+
+    sample = sample_text(text)
+    key = hashlib.blake2b(sample.encode("utf-8", errors="ignore"), digest_size=16).hexdigest()
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+    record_cache("language", cached is not None)
+    if cached is not None:
+        return cached
+
+    result = _classify(sample)
+    with _cache_lock:
+        _cache[key] = result
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
+
+def identify_pages(pages: List[str]) -> Dict:
+    """
+    Detekcja per strona dla dokumentów mieszanych językowo.
+    Zwraca {"lang": dominujący, "languages": {lang: liczba stron}, "pages": [..]}.
+    """
+    per_page = [identify(p) for p in pages]
+    counts = Counter(p["lang"] for p in per_page if p["lang"] != "unknown")
+    dominant = counts.most_common(1)[0][0] if counts else "unknown"
+    return {"lang": dominant, "languages": dict(counts), "pages": per_page}
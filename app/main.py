@@ -1,9 +1,19 @@
 import os
-from fastapi import FastAPI
+import logging
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 
+# ==========================
+# 📝 Logging (poziom z LOG_LEVEL, domyślnie INFO)
+# ==========================
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s %(message)s",
+)
+
 # Import routera dokumentów
 from app.routes.documents import router as documents_router
 
@@ -13,6 +23,42 @@ db.cleanup_missing_files()
 
 app = FastAPI(title="SmartDocFinder API")
 
+# ==========================
+# ⏱️ Tracing żądań (Server-Timing + log wolnych żądań)
+# ==========================
+from app.tracing import span, server_timing_header, maybe_log_slow, SERVER_TIMING_ENABLED
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    with span(f"{request.method} {request.url.path}") as root:
+        response = await call_next(request)
+        root.set(status=response.status_code)
+    if SERVER_TIMING_ENABLED or request.headers.get("x-trace") == "1":
+        response.headers["Server-Timing"] = server_timing_header(root)
+    maybe_log_slow(root)
+    return response
+
+# ==========================
+# 🚦 Admission control (limity równoległości drogich tras, 429 + Retry-After)
+# ==========================
+from fastapi.responses import JSONResponse
+from app import admission
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    route_class = admission.classify(request.method, request.url.path)
+    if route_class is None:
+        return await call_next(request)
+    try:
+        async with admission.admitted(route_class):
+            return await call_next(request)
+    except admission.Rejected as e:
+        return JSONResponse(
+            status_code=429,
+            content={"detail": f"Server busy ({e.route_class.name}: {e.reason}), retry later."},
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
 # ==========================
 # 🔒 CORS - dostęp z frontendu
 # ==========================
@@ -45,6 +91,17 @@ if BANNERS_DIR.exists():
 # ==========================
 app.include_router(documents_router, prefix="/documents")
 
+@app.on_event("startup")
+async def start_background_probes():
+    from app import health
+    health.start()
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Metryki w formacie tekstowym Prometheusa."""
+    from app.metrics import render_prometheus
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 async def root():
     frontend_url = os.getenv("FRONTEND_URL", "https://storage.googleapis.com/smartdocfinder-frontend/index.html")
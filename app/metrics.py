@@ -0,0 +1,204 @@
+# app/metrics.py
+"""
+Lekki rejestr metryk (bez zależności) renderowany w formacie tekstowym Prometheusa.
+
+Użycie:
+    from app.metrics import timed, STAGE_LATENCY
+    with timed("extraction"):
+        ...
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from app.tracing import span
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+
+_REGISTRY = []
+_lock = threading.Lock()
+
+
+def _label_key(labelnames, labels: dict) -> tuple:
+    return tuple(str(labels.get(n, "")) for n in labelnames)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", " ").replace('"', '\\"')
+
+
+def _fmt_labels(labelnames, key, extra: dict | None = None) -> str:
+    pairs = [(n, v) for n, v in zip(labelnames, key)]
+    if extra:
+        pairs += list(extra.items())
+    if not pairs:
+        return ""
+    body = ",".join(f'{n}="{_escape(v)}"' for n, v in pairs)
+    return "{" + body + "}"
+
+
+def _fmt_value(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _REGISTRY.append(self)
+
+    def values(self) -> dict:
+        """Kopia bieżących wartości: {krotka etykiet: wartość}."""
+        with _lock:
+            return dict(self._values)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with _lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels) -> float:
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        if self.buckets[-1] != math.inf:
+            self.buckets += (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with _lock:
+            items = [(k, {"counts": list(s["counts"]), "sum": s["sum"], "count": s["count"]})
+                     for k, s in self._values.items()]
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                labels = _fmt_labels(self.labelnames, key, {"le": _fmt_value(bound)})
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _fmt_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_fmt_value(state['sum'])}")
+            lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+# =============================
+# 📊 Metryki aplikacji
+# =============================
+STAGE_LATENCY = Histogram(
+    "smartdoc_stage_duration_seconds",
+    "Latency of pipeline stages (extraction, ocr_page, summarization, language_detection, "
+    "es_ping, es_index, es_search, embedding, llm_generation).",
+    ["stage"],
+)
+STAGE_ERRORS = Counter("smartdoc_stage_errors_total", "Failed pipeline stage executions.", ["stage"])
+CACHE_REQUESTS = Counter("smartdoc_cache_requests_total", "Cache lookups by result (hit/miss).", ["cache", "result"])
+QUEUE_DEPTH = Gauge("smartdoc_queue_depth", "Number of items waiting in a processing queue.", ["queue"])
+VERTEX_TOKENS = Counter("smartdoc_vertex_tokens_total", "Vertex AI tokens consumed.", ["model", "kind"])
+MODEL_LATENCY = Histogram("smartdoc_model_latency_seconds", "LLM call latency by model and task class.", ["model", "task"])
+
+
+@contextmanager
+def timed(stage: str):
+    """Mierzy czas bloku i zapisuje go w histogramie etapów (błędy liczone osobno).
+    Blok jest też spanem w bieżącym śladzie żądania (zwracanym przez `with`)."""
+    start = time.perf_counter()
+    with span(stage) as sp:
+        try:
+            yield sp
+        except Exception:
+            STAGE_ERRORS.inc(stage=stage)
+            raise
+        finally:
+            STAGE_LATENCY.observe(time.perf_counter() - start, stage=stage)
+
+
+def timed_stage(stage: str):
+    """Dekorator: jak `timed`, ale dla całej funkcji."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def cache_stats() -> dict:
+    """Zwraca {cache: {"hits", "misses", "hit_ratio"}} na podstawie liczników."""
+    stats = {}
+    for (cache, result), value in CACHE_REQUESTS.values().items():
+        entry = stats.setdefault(cache, {"hits": 0, "misses": 0})
+        entry["hits" if result == "hit" else "misses"] += value
+    for entry in stats.values():
+        total = entry["hits"] + entry["misses"]
+        entry["hit_ratio"] = round(entry["hits"] / total, 4) if total else 0.0
+    return stats
+
+
+def render_prometheus() -> str:
+    lines = []
+    for metric in list(_REGISTRY):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,252 @@
+# app/model_router.py
+"""
+Routing wywołań LLM między szybkim a dużym modelem.
+
+Każde miejsce wywołania deklaruje klasę zadania (TASKS) i budżet opóźnienia.
+Router próbuje modele w kolejności preferencji zadania — najpierw te, których
+obserwowane opóźnienie (EWMA) mieści się w budżecie i które nie są chwilowo
+wyłączone po serii błędów; błąd albo pusta odpowiedź → następny model.
+
+EWMA mierzy samo wywołanie modelu — czas w kolejce governora (token bucket, backoff)
+jest odejmowany, bo podczas bulk ingestu to on dominuje. Model poza budżetem dostaje
+co PROBE_INTERVAL_S jedno próbne żądanie (`fits_budget`), żeby EWMA mogła wrócić
+do normy — inaczej tryb auto w Q&A przestałby go wołać na zawsze. Odpowiedzi z cache
+(`note_cache_hit`) nie trafiają do EWMA — liczone są osobno (cache_hits).
+
+Modele są podmienialne (`register_model`, `use_local_models`, MODEL_ROUTER_LOCAL=1),
+więc testy i tryb offline mogą użyć lokalnego zastępcy bez Vertex AI.
+"""
+import logging
+import os
+import re
+import threading
+import time
+
+from app import vertex_governor
+from app.metrics import MODEL_LATENCY
+from app.tracing import current_span
+
+logger = logging.getLogger(__name__)
+
+FAST_MODEL = os.getenv("VERTEX_FAST_MODEL", "gemini-1.5-flash")
+EWMA_ALPHA = 0.2
+FAILURE_THRESHOLD = 3        # tyle błędów z rzędu → model wyłączony na COOLDOWN_S
+COOLDOWN_S = 60.0
+PROBE_INTERVAL_S = float(os.getenv("MODEL_ROUTER_PROBE_S", "30"))   # próba modelu poza budżetem
+
+# klasa zadania → kolejność ról modeli i domyślny budżet opóźnienia
+TASKS = {
+    "label": {"prefer": ("fast", "large"), "budget_ms": 2000},           # nazwy folderów, etykiety
+    "chunk_summary": {"prefer": ("fast", "large"), "budget_ms": 8000},   # fragmenty map-reduce
+    "summary": {"prefer": ("large", "fast"), "budget_ms": 15000},        # streszczenie dokumentu
+    "answer": {"prefer": ("large", "fast"), "budget_ms": 10000},         # odpowiedzi Q&A / chat
+}
+
+
+class VertexModel:
+    """Model Gemini wywoływany przez vertex_utils (governor, liczenie tokenów)."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def generate(self, prompt: str) -> str:
+        from app.vertex_utils import generate_with_model
+        return generate_with_model(self.name, prompt)
+
+
+class LocalModel:
+    """Lokalny zastępca (testy / offline): zwraca pierwsze zdania treści z promptu."""
+
+    def __init__(self, name: str = "local", max_chars: int = 300, delay_s: float = 0.0):
+        self.name = name
+        self.max_chars = max_chars
+        self.delay_s = delay_s
+
+    def generate(self, prompt: str) -> str:
+        if self.delay_s:
+            time.sleep(self.delay_s)
+        body = prompt.strip().split("\n\n")[-1]
+        out = ""
+        for sentence in re.split(r"(?<=[.!?])\s+", body):
+            if len(out) + len(sentence) > self.max_chars:
+                break
+            out = f"{out} {sentence}".strip()
+        return out or body[: self.max_chars]
+
+
+class _Stats:
+    __slots__ = ("ewma_ms", "calls", "cache_hits", "failures", "consecutive_failures", "down_until", "sampled_at")
+
+    def __init__(self):
+        self.ewma_ms = None
+        self.calls = 0
+        self.cache_hits = 0      # odpowiedzi z cache — bez pomiaru (≈0 ms zaniżałoby EWMA)
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+        self.sampled_at = 0.0    # ostatni pomiar albo przyznana próba (monotonic)
+
+
+_lock = threading.Lock()
+_models: dict = {}       # rola ("fast" / "large") → model
+_stats: dict = {}        # nazwa modelu → _Stats
+_attempt = threading.local()   # bieżące wywołanie modelu w tym wątku (flaga cache hit)
+_defaults_loaded = False
+
+
+def register_model(role: str, model):
+    """Podmienia model dla roli ("fast" / "large")."""
+    global _defaults_loaded
+    with _lock:
+        _models[role] = model
+        _stats.setdefault(model.name, _Stats())
+        _defaults_loaded = True
+
+
+def use_local_models(**kwargs):
+    """Oba modele → LocalModel (testy, praca offline)."""
+    register_model("fast", LocalModel("local-fast", **kwargs))
+    register_model("large", LocalModel("local-large", **kwargs))
+
+
+def reset():
+    global _defaults_loaded
+    with _lock:
+        _models.clear()
+        _stats.clear()
+        _defaults_loaded = False
+
+
+def _ensure_defaults():
+    global _defaults_loaded
+    if _defaults_loaded:
+        return
+    if os.getenv("MODEL_ROUTER_LOCAL") == "1":
+        use_local_models()
+        return
+    from app.vertex_utils import VERTEX_AVAILABLE, ACTIVE_MODEL
+    with _lock:
+        if not _defaults_loaded:
+            if VERTEX_AVAILABLE:
+                for role, name in (("large", ACTIVE_MODEL), ("fast", FAST_MODEL)):
+                    _models[role] = VertexModel(name)
+                    _stats.setdefault(name, _Stats())
+            _defaults_loaded = True
+
+
+def candidates(task: str, latency_budget_ms: float | None = None) -> list:
+    """Modele do spróbowania, w kolejności: w budżecie → poza budżetem (najszybsze najpierw) → wyłączone."""
+    _ensure_defaults()
+    spec = TASKS.get(task, TASKS["summary"])
+    budget = latency_budget_ms or spec["budget_ms"]
+    now = time.monotonic()
+    with _lock:
+        ordered, seen = [], set()
+        for role in spec["prefer"]:
+            model = _models.get(role)
+            if model is not None and model.name not in seen:
+                seen.add(model.name)
+                ordered.append(model)
+        stats = {m.name: _stats[m.name] for m in ordered}
+    up = [m for m in ordered if stats[m.name].down_until <= now]
+    down = [m for m in ordered if stats[m.name].down_until > now]
+    within = [m for m in up if stats[m.name].ewma_ms is None or stats[m.name].ewma_ms <= budget]
+    slow = sorted((m for m in up if m not in within), key=lambda m: stats[m.name].ewma_ms)
+    return within + slow + down
+
+
+def fits_budget(task: str, latency_budget_ms: float | None = None) -> bool:
+    """
+    Czy któryś model (niewyłączony) ma szansę odpowiedzieć w budżecie — nieznane opóźnienie
+    liczy się jako tak. Model poza budżetem bez pomiaru od PROBE_INTERVAL_S też — jedno żądanie
+    na model i interwał jest próbą, której wynik odświeży EWMA.
+    """
+    _ensure_defaults()
+    spec = TASKS.get(task, TASKS["summary"])
+    budget = latency_budget_ms or spec["budget_ms"]
+    now = time.monotonic()
+    with _lock:
+        up = [_stats[_models[role].name] for role in spec["prefer"] if role in _models]
+        up = [st for st in up if st.down_until <= now]
+        if any(st.ewma_ms is None or st.ewma_ms <= budget for st in up):
+            return True
+        for st in up:
+            if now - st.sampled_at >= PROBE_INTERVAL_S:
+                st.sampled_at = now    # próbę dostaje jedno żądanie, kolejne czekają na jej wynik
+                return True
+        return False
+
+
+def note_cache_hit():
+    """Wołane przez implementację modelu, gdy odpowiedź pochodzi z cache — `generate` nie
+    wlicza wtedy czasu do EWMA (i nie traktuje wywołania jako próby zdrowia modelu)."""
+    _attempt.cached = True
+
+
+def _record_cache_hit(model):
+    with _lock:
+        _stats.setdefault(model.name, _Stats()).cache_hits += 1
+
+
+def _record(model, task: str, elapsed_ms: float, ok: bool):
+    MODEL_LATENCY.observe(elapsed_ms / 1000, model=model.name, task=task)
+    with _lock:
+        st = _stats.setdefault(model.name, _Stats())
+        st.calls += 1
+        if ok:
+            st.ewma_ms = elapsed_ms if st.ewma_ms is None else (1 - EWMA_ALPHA) * st.ewma_ms + EWMA_ALPHA * elapsed_ms
+            st.sampled_at = time.monotonic()
+            st.consecutive_failures = 0
+        else:
+            st.failures += 1
+            st.consecutive_failures += 1
+            if st.consecutive_failures >= FAILURE_THRESHOLD:
+                st.down_until = time.monotonic() + COOLDOWN_S
+                logger.warning("[ROUTER] %s marked down for %.0fs", model.name, COOLDOWN_S)
+
+
+def generate(prompt: str, task: str = "summary", latency_budget_ms: float | None = None) -> str:
+    """Generuje odpowiedź wybranym modelem (z fallbackiem). "" gdy żaden model nie odpowiedział."""
+    for model in candidates(task, latency_budget_ms):
+        t0, waited0 = time.perf_counter(), vertex_governor.queue_wait_s()
+
+        def call_ms() -> float:
+            # bez czekania w governorze (token bucket / backoff) — to nie jest opóźnienie modelu
+            return max(0.0, (time.perf_counter() - t0 - (vertex_governor.queue_wait_s() - waited0)) * 1000)
+
+        _attempt.cached = False
+        try:
+            text = (model.generate(prompt) or "").strip()
+        except Exception as e:
+            _record(model, task, call_ms(), ok=False)
+            logger.warning("[ROUTER] %s failed for %s: %s – trying next model", model.name, task, e)
+            continue
+        if _attempt.cached and text:
+            _record_cache_hit(model)
+        else:
+            _record(model, task, call_ms(), ok=bool(text))
+        if text:
+            sp = current_span()
+            if sp is not None:
+                sp.set(model=model.name, task=task)
+            return text
+    return ""
+
+
+def stats() -> dict:
+    """Stan routera dla /admin/health: role i obserwowane opóźnienia modeli."""
+    now = time.monotonic()
+    with _lock:
+        return {
+            "roles": {role: m.name for role, m in _models.items()},
+            "models": {
+                name: {
+                    "ewma_ms": round(st.ewma_ms, 1) if st.ewma_ms is not None else None,
+                    "calls": st.calls,
+                    "cache_hits": st.cache_hits,
+                    "failures": st.failures,
+                    "down": st.down_until > now,
+                }
+                for name, st in _stats.items()
+            },
+        }
@@ -0,0 +1,111 @@
+# app/pdf_delivery.py
+"""
+Serwowanie plików PDF z obsługą cache'owania HTTP:
+- silny ETag z hasha treści (SHA-256 z bazy), Last-Modified, Cache-Control,
+- warunkowe GET (If-None-Match / If-Modified-Since) → 304,
+- żądania zakresów (Range / If-Range) → 206 Partial Content dla PDF.js.
+"""
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+CACHE_CONTROL = os.getenv("PDF_CACHE_CONTROL", "private, max-age=60, must-revalidate")
+CHUNK_SIZE = 256 * 1024
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _iter_file(path: Path, start: int, length: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+def _parse_range(header: str, size: int):
+    """Zwraca (start, end) włącznie, None gdy nagłówek nieobsługiwany (np. wiele zakresów)
+    albo "invalid" gdy zakres jest poza plikiem."""
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:  # sufiks: ostatnie N bajtów
+        length = int(last)
+        if length == 0:
+            return "invalid"
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return "invalid"
+    return start, end
+
+
+def file_response(request: Request, path: Path, etag_hash: str | None, media_type: str,
+                  headers: dict | None = None) -> Response:
+    stat = path.stat()
+    etag = f'"{etag_hash}"' if etag_hash else f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    base_headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+        **(headers or {}),
+    }
+
+    # 🔹 warunkowe GET
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=base_headers)
+    elif "if-modified-since" in request.headers:
+        try:
+            since = parsedate_to_datetime(request.headers["if-modified-since"]).timestamp()
+            if int(stat.st_mtime) <= since:
+                return Response(status_code=304, headers=base_headers)
+        except (TypeError, ValueError):
+            pass
+
+    # 🔹 zakresy (If-Range z innym ETagiem → cały plik)
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range.strip() == etag):
+        parsed = _parse_range(range_header, stat.st_size)
+        if parsed == "invalid":
+            return Response(status_code=416, headers={**base_headers, "Content-Range": f"bytes */{stat.st_size}"})
+        if parsed is not None:
+            start, end = parsed
+            length = end - start + 1
+            return StreamingResponse(
+                _iter_file(path, start, length),
+                status_code=206,
+                media_type=media_type,
+                headers={
+                    **base_headers,
+                    "Content-Range": f"bytes {start}-{end}/{stat.st_size}",
+                    "Content-Length": str(length),
+                },
+            )
+
+    return StreamingResponse(
+        _iter_file(path, 0, stat.st_size),
+        media_type=media_type,
+        headers={**base_headers, "Content-Length": str(stat.st_size)},
+    )
@@ -1,101 +1,293 @@
 from PyPDF2 import PdfReader
 from io import BytesIO
-from pdf2image import convert_from_path, convert_from_bytes
+from pdf2image import convert_from_path, convert_from_bytes, pdfinfo_from_path, pdfinfo_from_bytes
 import pytesseract
 import chardet
+import hashlib
 import os
 import re
+import logging
+from datetime import datetime
 from tempfile import NamedTemporaryFile
+from app import cache, progress
+from app.prompt_builder import strip_boilerplate_lines
+from app.metrics import timed, timed_stage
 
+logger = logging.getLogger(__name__)
+
+class PdfStream:
+    """
+    Jeden PdfReader na dokument — wspólny dla metadanych i tekstu.
+    Ścieżka jest otwierana jako uchwyt pliku (PyPDF2 czyta obiekty leniwie; przy
+    podaniu ścieżki wczytałby cały plik do pamięci), a strony są zwracane generatorem.
+    """
+
+    def __init__(self, file_path_or_bytes):
+        self.source = file_path_or_bytes
+        if isinstance(file_path_or_bytes, (bytes, bytearray)):
+            self._fh = BytesIO(file_path_or_bytes)
+        else:
+            self._fh = open(file_path_or_bytes, "rb")
+        try:
+            self.reader = PdfReader(self._fh)
+        except Exception:
+            self._fh.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._fh.close()
+
+    @property
+    def page_count(self) -> int:
+        return len(self.reader.pages)
+
+    def metadata(self) -> dict:
+        """Autor, liczba stron i data utworzenia (z tego samego readera co tekst)."""
+        try:
+            info = self.reader.metadata or {}
+            author = info.get("/Author", "Unknown")
+            created = info.get("/CreationDate", "")
+            if created.startswith("D:"):
+                created = datetime.strptime(created[2:16], "%Y%m%d%H%M%S")
+            else:
+                created = None
+            return {"author": author, "number_of_pages": self.page_count, "created_date": created}
+        except Exception as e:
+            logger.warning("[PDF] ⚠️ Metadata extraction failed: %s", e)
+            return {"author": "Unknown", "number_of_pages": 0, "created_date": None}
+
+    def iter_pages(self, known: dict | None = None, ocr: bool = True):
+        """
+        Generator oczyszczonych stron: {page, fingerprint, text_hash, text, reused}.
+        Strony, których odcisk jest w `known` (odcisk → tekst z poprzedniej wersji),
+        nie są ponownie czytane ani OCR-owane; OCR (gdy `ocr`) tylko dla stron bez warstwy tekstu.
+        """
+        known = known or {}
+        for no, page in enumerate(self.reader.pages, start=1):
+            with timed("extraction_page"):
+                fingerprint = page_fingerprint(page)
+                reused = fingerprint in known
+                if reused:
+                    text = known[fingerprint]
+                else:
+                    raw = page.extract_text() or ""
+                    if raw.strip():
+                        text = _clean_text(_fix_encoding(raw))
+                    elif ocr:
+                        progress.emit("ocr", page=no, pages=self.page_count)
+                        text = _ocr_page(self.source, no)
+                    else:
+                        text = ""
+            yield _page_record(no, fingerprint, text, reused)
+
+
+def _page_record(no: int, fingerprint, text: str, reused: bool) -> dict:
+    return {
+        "page": no,
+        "fingerprint": fingerprint,
+        "text_hash": hashlib.sha1(text.encode("utf-8")).hexdigest(),
+        "text": text,
+        "reused": reused,
+    }
+
+
+def iter_pages(file_path_or_bytes, known: dict | None = None, meta: dict | None = None):
+    """
+    Strumieniowa ekstrakcja stron (pamięć ~ jedna strona). Metadane z tego samego
+    readera trafiają do `meta` (jeśli podano). Gdy PDF nie da się otworzyć — OCR
+    całego dokumentu jako jedna strona.
+    """
+    try:
+        stream = PdfStream(file_path_or_bytes)
+    except Exception as e:
+        logger.warning("[PDF] ❌ Cannot open PDF (%s) – falling back to whole-document OCR", e)
+        yield _page_record(1, None, _clean_text(extract_text_with_ocr(file_path_or_bytes)), False)
+        return
+    with stream:
+        if meta is not None:
+            meta.update(stream.metadata())
+        yield from stream.iter_pages(known)
+
+
+def extract_metadata(file_path_or_bytes) -> dict:
+    """Pobierz dane z pliku PDF."""
+    try:
+        with PdfStream(file_path_or_bytes) as stream:
+            return stream.metadata()
+    except Exception as e:
+        logger.warning("[PDF] ⚠️ Metadata extraction failed: %s", e)
+        return {"author": "Unknown", "number_of_pages": 0, "created_date": None}
+
+
+def _text_cache_key(file_path_or_bytes) -> str | None:
+    """Klucz cache tekstu: hash treści (bytes) albo ścieżka + mtime + rozmiar pliku."""
+    if isinstance(file_path_or_bytes, (bytes, bytearray)):
+        return hashlib.sha256(file_path_or_bytes).hexdigest()
+    try:
+        st = os.stat(file_path_or_bytes)
+    except OSError:
+        return None
+    return cache.make_key(os.path.abspath(file_path_or_bytes), st.st_mtime_ns, st.st_size)
+
+
+@timed_stage("extraction")
 def extract_text_from_pdf(file_path_or_bytes):
     """
     Ekstrakcja tekstu z PDF z automatycznym rozpoznawaniem kodowania i fallbackiem OCR.
-    Obsługuje pliki binarne (bytes) i ścieżki do plików.
+    Obsługuje pliki binarne (bytes) i ścieżki do plików. Wynik jest w cache
+    (przestrzeń "pdf_text"), wspólnym dla workerów przy backendzie sqlite / redis.
     """
-    text_parts = []
+    key = _text_cache_key(file_path_or_bytes)
+    if key is None:
+        return _extract_text(file_path_or_bytes)
+    return cache.namespace("pdf_text").get_or_set(key, lambda: _extract_text(file_path_or_bytes))
+
 
+def _extract_text(file_path_or_bytes):
     try:
-        # --- 1️⃣ Najpierw spróbuj klasyczną ekstrakcję (PyPDF2)
-        if isinstance(file_path_or_bytes, (bytes, bytearray)):
-            reader = PdfReader(BytesIO(file_path_or_bytes))
-        else:
-            reader = PdfReader(str(file_path_or_bytes))
-
-        for page in reader.pages:
-            page_text = page.extract_text() or ""
-            if page_text.strip():
-                try:
-                    detected = chardet.detect(page_text.encode("latin1", errors="ignore"))
-                    encoding = detected.get("encoding", "utf-8") or "utf-8"
-                    fixed = (
-                        page_text
-                        .encode("latin1", errors="ignore")
-                        .decode(encoding, errors="ignore")
-                        .replace("ﬁ", "fi")
-                        .replace("ﬂ", "fl")
-                    )
-                except Exception:
-                    fixed = page_text
-                text_parts.append(fixed)
-
-        text = " ".join(text_parts).strip()
+        # --- 1️⃣ Najpierw spróbuj klasyczną ekstrakcję (PyPDF2), strona po stronie
+        with PdfStream(file_path_or_bytes) as stream:
+            text = " ".join(p["text"] for p in stream.iter_pages(ocr=False) if p["text"])
 
         # --- 2️⃣ Jeśli PyPDF2 nic nie znalazł, zrób OCR
         if len(text) < 50:
-            print("[OCR] PyPDF2 zwrócił zbyt mało tekstu – uruchamiam OCR...")
-            text = extract_text_with_ocr(file_path_or_bytes)
+            logger.info("[OCR] PyPDF2 zwrócił zbyt mało tekstu – uruchamiam OCR...")
+            text = _clean_text(extract_text_with_ocr(file_path_or_bytes))
 
-        # --- 3️⃣ Finalne czyszczenie
-        text = _clean_text(text)
-        print(f"[PDF] Extracted {len(text)} characters total.")
+        logger.debug("[PDF] Extracted chars=%d", len(text))
         return text
 
     except Exception as e:
-        print(f"[PDF] ❌ Error extracting text: {e}")
+        logger.warning("[PDF] ❌ Error extracting text: %s", e)
         try:
             # Fallback OCR jako ostateczne rozwiązanie
             text = extract_text_with_ocr(file_path_or_bytes)
             return _clean_text(text)
         except Exception as ocr_err:
-            print(f"[PDF] ❌ OCR fallback failed: {ocr_err}")
+            logger.error("[PDF] ❌ OCR fallback failed: %s", ocr_err)
             return ""
 
 
+_LIGATURES = str.maketrans({"ﬁ": "fi", "ﬂ": "fl"})
+# ślady mojibake: znaki sterujące C1 (np. ś/ź z CP1250) albo ą/ł/ż z CP1250 widziane jako ¹/³/¿ w środku słowa
+_MOJIBAKE_RE = re.compile(r"[\x80-\x9f]|(?<=[^\W\d_])[¹³¥¿ª£¼¾]")
+
+
+def _fix_encoding(page_text: str) -> str:
+    """
+    Naprawa mojibake (UTF-8/CP1250 odczytane jako latin1). Tekst czysto ASCII albo
+    zawierający znaki spoza latin1 jest już poprawnym Unicode — bez chardet. Tekst
+    z zakresu latin1 (np. niemieckie umlauty) też, chyba że ma ślady CP1250 (_MOJIBAKE_RE).
+    """
+    page_text = page_text.translate(_LIGATURES)
+    if page_text.isascii() or max(page_text) > "\xff":
+        return page_text
+    raw = page_text.encode("latin1")
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        pass
+    if not _MOJIBAKE_RE.search(page_text):
+        return page_text
+    try:
+        detected = chardet.detect(raw)
+        encoding = detected.get("encoding", "utf-8") or "utf-8"
+        return raw.decode(encoding, errors="ignore")
+    except Exception:
+        return page_text
+
+
+def page_fingerprint(page) -> str:
+    """Odcisk surowej treści strony: strumień zawartości + dane obrazów (XObject).
+    Zmienia się tylko gdy zmieniła się sama strona — także dla skanów bez warstwy tekstu."""
+    h = hashlib.sha256()
+    contents = page.get_contents()
+    if contents is not None:
+        h.update(contents.get_data())
+    try:
+        xobjects = page["/Resources"].get_object().get("/XObject") or {}
+        for name in sorted(xobjects.get_object()):
+            h.update(name.encode("utf-8"))
+            h.update(xobjects[name].get_object().get_data())
+    except Exception:
+        pass
+    return h.hexdigest()
+
+
+def _render_page(file_path_or_bytes, page_no: int, dpi: int = 200):
+    if isinstance(file_path_or_bytes, (bytes, bytearray)):
+        images = convert_from_bytes(file_path_or_bytes, dpi=dpi, first_page=page_no, last_page=page_no)
+    else:
+        images = convert_from_path(str(file_path_or_bytes), dpi=dpi, first_page=page_no, last_page=page_no)
+    return images[0] if images else None
+
+
+def _ocr_page(file_path_or_bytes, page_no: int) -> str:
+    image = _render_page(file_path_or_bytes, page_no)
+    if image is None:
+        return ""
+    with timed("ocr_page"):
+        return _clean_text(pytesseract.image_to_string(image, lang="pol+eng"))
+
+
 def extract_text_with_ocr(file_path_or_bytes):
     """
     OCR fallback: renderuje strony PDF do obrazów i rozpoznaje tekst (polski + angielski).
     """
     try:
-        # Obsługa zarówno plików bytes, jak i ścieżek
+        # Obsługa zarówno plików bytes, jak i ścieżek; renderujemy po jednej stronie,
+        # żeby w pamięci był naraz tylko jeden obraz
         if isinstance(file_path_or_bytes, (bytes, bytearray)):
-            images = convert_from_bytes(file_path_or_bytes, dpi=200)
+            pages = pdfinfo_from_bytes(file_path_or_bytes)["Pages"]
         else:
-            images = convert_from_path(str(file_path_or_bytes), dpi=200)
+            pages = pdfinfo_from_path(str(file_path_or_bytes))["Pages"]
 
         ocr_texts = []
-        for i, img in enumerate(images):
-            page_text = pytesseract.image_to_string(img, lang="pol+eng")
-            page_text = _clean_text(page_text)
+        for i in range(1, pages + 1):
+            page_text = _ocr_page(file_path_or_bytes, i)
             ocr_texts.append(page_text)
-            print(f"[OCR] ✅ Page {i+1}: {len(page_text)} chars")
+            logger.debug("[OCR] ✅ page=%d chars=%d", i, len(page_text))
 
         full_text = "\n".join(ocr_texts).strip()
-        print(f"[OCR] Zidentyfikowano {len(full_text)} znaków po OCR.")
+        logger.info("[OCR] Zidentyfikowano %d znaków po OCR.", len(full_text))
         return full_text
 
     except Exception as e:
-        print(f"[OCR] ❌ OCR extraction failed: {e}")
+        logger.error("[OCR] ❌ OCR extraction failed: %s", e)
         return ""
 
 
+def render_thumbnail(pdf_path, dest, page: int = 1, width: int = 240) -> bool:
+    """Renderuje jedną stronę PDF do miniatury PNG (dest). Zwraca True przy sukcesie."""
+    try:
+        images = convert_from_path(str(pdf_path), dpi=72, first_page=page, last_page=page, size=(width, None))
+        if not images:
+            return False
+        images[0].save(str(dest), format="PNG", optimize=True)
+        return True
+    except Exception as e:
+        logger.warning("[PDF] Thumbnail failed for %s p%d: %s", pdf_path, page, e)
+        return False
+
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_ODD_CHARS_RE = re.compile(r"[^\x00-\x7FĄąĆćĘęŁłŃńÓóŚśŹźŻż ]+")
+
+
 def _clean_text(t: str) -> str:
     """
     Czyści tekst z nadmiarowych spacji, znaków specjalnych i łączy słowa.
+    Linie nagłówków / stopek (numery stron) znikają przed spłaszczeniem — potem nie ma już linii.
     """
     try:
-        t = t.replace("\r", " ").replace("\n", " ")
-        t = re.sub(r"\s+", " ", t).strip()
-        t = re.sub(r"[^\x00-\x7FĄąĆćĘęŁłŃńÓóŚśŹźŻż ]+", "", t)  # usuń nietypowe znaki
-        return t
+        t = strip_boilerplate_lines(t)
+        t = _ODD_CHARS_RE.sub("", t)  # usuń nietypowe znaki
+        return _WHITESPACE_RE.sub(" ", t).strip()
     except Exception:
         return t.strip()
\ No newline at end of file
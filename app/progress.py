@@ -0,0 +1,117 @@
+# app/progress.py
+"""
+Zdarzenia postępu pipeline'u ingestu (per plik, per etap) dla strumienia SSE.
+
+Zadanie (job) ma listę zdarzeń z rosnącymi id — subskrybent dostaje najpierw
+historię (od Last-Event-ID), a potem nowe zdarzenia na żywo, więc ponowne
+połączenie niczego nie gubi. Kod pipeline'u woła `emit(stage, ...)` — bieżące
+zadanie i plik są w contextvars (`bind`), a poza zadaniem emit nic nie robi.
+
+Zdarzenia są w SQLite (progress_jobs / progress_events), więc GET strumienia może
+trafić do innego workera niż ten, który przyjął upload i go przetwarza. Subskrybent
+w tym samym procesie jest budzony od razu, w innym — sprawdza SQLite co POLL_S.
+"""
+import asyncio
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from app import db
+
+JOB_TTL = 3600              # po tylu sekundach od końca zadanie znika z bazy
+STALE_JOB_TTL = 86400       # niedokończone (np. worker zrestartowany w trakcie) — po dobie
+MAX_EVENTS = 5000           # górny limit historii zdarzeń jednego zadania
+FINAL_STAGES = ("done", "failed", "completed")   # zapisywane także ponad limit
+POLL_S = 1.0                # co ile subskrybent sprawdza SQLite (zdarzenia z innych workerów)
+
+_current_job: ContextVar = ContextVar("progress_job", default=None)
+_current_file: ContextVar = ContextVar("progress_file", default=None)
+
+_lock = threading.Lock()
+_waiters: dict = {}         # job_id → {(loop, asyncio.Event)} subskrybentów w tym procesie
+
+
+def create_job(**info) -> str:
+    job_id = uuid.uuid4().hex[:16]
+    now = time.time()
+    db.expire_progress_jobs(now - JOB_TTL, now - STALE_JOB_TTL)
+    db.create_progress_job(job_id, now)
+    publish(job_id, None, "queued", **info)
+    return job_id
+
+
+def publish(job_id: str, file: str | None, stage: str, **data):
+    """Zapisuje zdarzenie zadania i budzi subskrybentów (wołane z dowolnego wątku)."""
+    now = time.time()
+    event = {"file": file, "stage": stage, "ts": round(now, 3), **data}
+    if db.add_progress_event(job_id, event, MAX_EVENTS, force=stage in FINAL_STAGES) is None:
+        return
+    if stage == "completed":
+        db.finish_progress_job(job_id, now)
+    with _lock:
+        waiters = list(_waiters.get(job_id, ()))
+    for loop, wake in waiters:
+        loop.call_soon_threadsafe(wake.set)
+
+
+@contextmanager
+def bind(job_id: str, file: str | None = None):
+    """Kolejne `emit` w tym kontekście trafiają do zadania `job_id` (i pliku `file`)."""
+    job_token = _current_job.set(job_id)
+    file_token = _current_file.set(file)
+    try:
+        yield
+    finally:
+        _current_file.reset(file_token)
+        _current_job.reset(job_token)
+
+
+def emit(stage: str, **data):
+    job_id = _current_job.get()
+    if job_id is not None:
+        publish(job_id, _current_file.get(), stage, **data)
+
+
+def exists(job_id: str) -> bool:
+    return db.get_progress_job(job_id) is not None
+
+
+async def subscribe(job_id: str, after: int = 0, heartbeat: float = 15.0):
+    """Asynchroniczny generator zdarzeń od id > `after`; kończy się po zdarzeniu "completed".
+    Gdy przez `heartbeat` sekund nic się nie dzieje (np. długi OCR strony), zwraca None."""
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+    waiter = (loop, wake)
+    with _lock:
+        _waiters.setdefault(job_id, set()).add(waiter)
+    try:
+        idle = 0.0
+        while True:
+            wake.clear()
+            job = await asyncio.to_thread(db.get_progress_job, job_id)
+            if job is None:
+                return
+            events = await asyncio.to_thread(db.get_progress_events, job_id, after)
+            for event in events:
+                yield event
+                after = event["id"]
+                if event["stage"] == "completed":
+                    return
+            if events:
+                idle = 0.0
+            elif job["finished_at"]:
+                return
+            try:
+                await asyncio.wait_for(wake.wait(), timeout=POLL_S)
+            except asyncio.TimeoutError:
+                idle += POLL_S
+                if idle >= heartbeat:
+                    idle = 0.0
+                    yield None
+    finally:
+        with _lock:
+            _waiters[job_id].discard(waiter)
+            if not _waiters[job_id]:
+                del _waiters[job_id]
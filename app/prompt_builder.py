@@ -0,0 +1,155 @@
+# app/prompt_builder.py
+"""
+Składanie promptów w budżecie tokenów.
+
+Kontekst (streszczenia / fragmenty z ES) jest czyszczony z boilerplate'u,
+deduplikowany (nakładające się fragmenty) i wybierany wg score'u z wyszukiwania,
+dopóki mieści się w budżecie danego modelu.
+"""
+import os
+import re
+from typing import Dict, List
+
+# Przybliżenie: ~4 znaki na token dla tekstów PL/EN/DE (bez zdalnego count_tokens).
+CHARS_PER_TOKEN = 4
+
+# Budżet tokenów na KONTEKST (nie całe okno modelu) — trzymamy prompty krótkie.
+MODEL_CONTEXT_BUDGETS = {
+    "gemini-1.5-pro": 6000,
+    "gemini-1.5-flash": 4000,
+    "text-bison@002": 2000,
+}
+DEFAULT_CONTEXT_BUDGET = int(os.getenv("PROMPT_CONTEXT_TOKENS", "3000"))
+
+# Powyżej tego podobieństwa (Jaccard na 5-gramach słów) fragment uznajemy za duplikat.
+DUPLICATE_THRESHOLD = 0.6
+
+# całe linie nagłówków / stopek (numer strony "- 3 -", samotne "Poufne") — tylko przed
+# spłaszczeniem białych znaków, bo po nim nie ma już granic linii; dlatego pdf_utils
+# woła strip_boilerplate_lines na surowym tekście strony
+_BOILERPLATE_LINES = [
+    re.compile(p, re.IGNORECASE | re.MULTILINE)
+    for p in (
+        r"^[ \t]*-?[ \t]*\d+[ \t]*-?[ \t]*$",
+        r"^[ \t]*(confidential|poufne|vertraulich)[ \t]*$",
+    )
+]
+_BOILERPLATE_PATTERNS = [
+    re.compile(p, re.IGNORECASE)
+    for p in (
+        r"\b(page|strona|seite)\s+\d+\s*(of|z|von)\s*\d+\b",
+        # właściciel praw tylko do końca zdania / linii w zasięgu 80 znaków — spłaszczony tekst
+        # nie ma końców linii, więc bez limitu znikałby cały akapit (wtedy zostaje sam "© 2023")
+        r"(©|\(c\)|copyright)\s*\d{4}(?:[^.\n]{0,80}?(?=[.\n]|$))?",
+        r"\ball rights reserved\.?",
+        r"\bwszelkie prawa zastrzeżone\.?",
+        r"\balle rechte vorbehalten\.?",
+    )
+]
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def budget_for(model: str | None) -> int:
+    if not model:
+        return DEFAULT_CONTEXT_BUDGET
+    name = model.rsplit("/", 1)[-1]
+    return MODEL_CONTEXT_BUDGETS.get(name, DEFAULT_CONTEXT_BUDGET)
+
+
+def strip_boilerplate_lines(text: str) -> str:
+    """Usuwa całe linie nagłówków / stopek (tekst musi mieć jeszcze podziały linii)."""
+    for pattern in _BOILERPLATE_LINES:
+        text = pattern.sub("", text)
+    return text
+
+
+def clean_passage(text: str) -> str:
+    """Usuwa boilerplate (numery stron, copyright) i nadmiarowe białe znaki."""
+    if not text:
+        return ""
+    text = strip_boilerplate_lines(text)
+    for pattern in _BOILERPLATE_PATTERNS:
+        text = pattern.sub(" ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def compact_prompt(prompt: str) -> str:
+    """Usuwa wcięcia z szablonów f-string i puste linie (czyste tokeny za darmo)."""
+    lines = [line.strip() for line in prompt.strip().splitlines()]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Przycina tekst do budżetu, preferując granicę zdania."""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    boundary = max(cut.rfind(". "), cut.rfind("! "), cut.rfind("? "))
+    if boundary > max_chars // 2:
+        return cut[:boundary + 1]
+    return cut.rsplit(" ", 1)[0]
+
+
+def _shingles(text: str, n: int = 5) -> set:
+    words = text.lower().split()
+    if len(words) <= n:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+
+def _dedupe_sentences(text: str, seen: set) -> str:
+    kept = []
+    for sentence in _SENTENCE_SPLIT.split(text):
+        key = sentence.strip().lower()
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        kept.append(sentence.strip())
+    return " ".join(kept)
+
+
+def select_context(pieces: List[Dict], budget_tokens: int, text_key: str = "text") -> List[Dict]:
+    """
+    Wybiera fragmenty kontekstu w budżecie tokenów.
+    pieces: [{"text": ..., "score": float, ...}] — pozostałe pola są przenoszone.
+    Kolejność wyniku: malejący score.
+    """
+    ranked = sorted(
+        (p for p in pieces if p.get(text_key)),
+        key=lambda p: p.get("score") or 0.0,
+        reverse=True,
+    )
+    selected, selected_shingles, seen_sentences = [], [], set()
+    remaining = budget_tokens
+
+    for piece in ranked:
+        if remaining <= 0:
+            break
+        text = clean_passage(piece[text_key])
+        shingles = _shingles(text)
+        if any(
+            len(shingles & other) / max(1, len(shingles | other)) >= DUPLICATE_THRESHOLD
+            for other in selected_shingles
+        ):
+            continue
+        text = _dedupe_sentences(text, seen_sentences)
+        if not text:
+            continue
+        tokens = estimate_tokens(text)
+        if tokens > remaining:
+            text = truncate_to_tokens(text, remaining)
+            tokens = estimate_tokens(text)
+            if not text:
+                break
+        selected.append({**piece, text_key: text, "tokens": tokens})
+        selected_shingles.append(shingles)
+        remaining -= tokens
+
+    return selected
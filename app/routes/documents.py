@@ -1,16 +1,25 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request, Body
+from fastapi.concurrency import run_in_threadpool
 from pathlib import Path
+import os
 import uuid
+import hashlib
+import json
 import unicodedata
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from app.pdf_utils import extract_text_from_pdf
 from app.ai_utils import analyze_pdf, detect_language
-from app import db
-from app.elasticsearch_utils import index_pdf, search as es_search, delete_from_index, clear_index, create_index
+from app import db, bulk_import, es_reindex, progress, suggest, vector_store
+from app.ingest import ingest_document, is_new_version, store_upload
+from app.elasticsearch_utils import (
+    search as es_search, delete_from_index, clear_index, update_fields,
+)
 import logging
 
-from app.vertex_utils import get_vertex_status
+from app.metrics import QUEUE_DEPTH
+from app.tracing import span, traced
+from app.pdf_delivery import file_response
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +28,8 @@ router = APIRouter(tags=["Documents"])
 BASE_DIR = Path(__file__).resolve().parents[2]
 UPLOAD_FOLDER = BASE_DIR / "uploaded_pdfs"
 UPLOAD_FOLDER.mkdir(exist_ok=True)
+THUMBNAILS_DIR = UPLOAD_FOLDER / ".thumbnails"
+THUMBNAILS_ON_UPLOAD = os.getenv("THUMBNAILS_ON_UPLOAD", "0") == "1"
 
 def _safe_filename(name: str) -> str:
     # Normalize and strip path
@@ -41,10 +52,12 @@ def _content_disposition_filename_header(filename: str, disposition: str = "inli
         header = f"{disposition}; filename*=UTF-8''{quoted}"
         return {"Content-Disposition": header}
 
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+
 
 # Upload single
 @router.post("/upload-pdf")
+@traced("upload_pdf")
 async def upload_pdf(file: UploadFile = File(...)):
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
@@ -52,9 +65,12 @@ async def upload_pdf(file: UploadFile = File(...)):
     filename = _safe_filename(file.filename)
     dest = UPLOAD_FOLDER / filename
 
-    # 🔍 Check if file already exists
+    data = await file.read()
+    content_hash = hashlib.sha256(data).hexdigest()
+
+    # 🔍 Check if file already exists (ta sama treść → 409, zmieniona → nowa wersja)
     existing = db.get_document(filename)
-    if existing or dest.exists():
+    if (existing or dest.exists()) and not is_new_version(existing, content_hash):
         existing_path = dest if dest.exists() else Path(existing["filepath"])
         folder_rel = existing_path.parent.relative_to(Path.cwd())
         return JSONResponse(
@@ -66,26 +82,63 @@ async def upload_pdf(file: UploadFile = File(...)):
             },
         )
 
-    # 📥 Save file if new
-    data = await file.read()
-    dest.write_bytes(data)
-    db.add_document(filename, dest)
+    # 📥 Save file (nowy dokument albo nowa wersja w dotychczasowym miejscu)
+    with span("store") as sp:
+        dest, doc_id = store_upload(filename, dest, existing, data, content_hash)
+        sp.set(bytes=len(data), new_version=existing is not None)
+
+    # ekstrakcja → język → dedup (MinHash/LSH) → streszczenie → ES → embedding
+    # (w puli wątków — pętla zdarzeń obsługuje w tym czasie tanie żądania)
+    result = await run_in_threadpool(ingest_document, dest, filename, doc_id, content_hash)
+    if THUMBNAILS_ON_UPLOAD:
+        _ensure_thumbnail(dest, content_hash)
+
+    return {
+        "filename": filename,
+        "preview": result["text"][:1000],
+        "summary": result["summary"],
+        "language": result["language"],
+        "duplicate_of": result["duplicate_of"],
+        "similarity": result["similarity"],
+        "version": result["version"],
+        "changed_pages": result["changed_pages"],
+    }
+
+
+def _ingest_upload(filename: str, data, content_hash: str) -> dict:
+    """Jeden plik z uploadu wielu plików (`data`: bytes albo plik tymczasowy w UPLOAD_FOLDER):
+    duplikat → status "duplicate", zmieniona treść → nowa wersja. Zwraca wpis wyniku."""
+    dest = UPLOAD_FOLDER / filename
 
-    preview = extract_text_from_pdf(dest)[:1000]
-    summary = analyze_pdf(dest)
+    # 🔍 Duplicate check
+    existing = db.get_document(filename)
+    if (existing or dest.exists()) and not is_new_version(existing, content_hash):
+        if isinstance(data, Path):
+            data.unlink(missing_ok=True)
+        existing_path = dest if dest.exists() else Path(existing["filepath"])
+        folder_rel = existing_path.parent.relative_to(Path.cwd())
+        return {
+            "filename": filename,
+            "status": "duplicate",
+            "folder": str(folder_rel),
+        }
 
-    # Language detection
-    from app.ai_utils import detect_language
-    lang_sample = extract_text_from_pdf(dest)[:2000]
-    language = detect_language(lang_sample)
+    # 📥 Save new file / new version
+    with span("store") as sp:
+        dest, doc_id = store_upload(filename, dest, existing, data, content_hash)
+        sp.set(new_version=existing is not None)
+    progress.emit("stored", version_of=existing["filename"] if existing else None)
 
-    index_pdf(dest, filename, summary, language)
+    result = ingest_document(dest, filename, doc_id, content_hash)
 
     return {
         "filename": filename,
-        "preview": preview,
-        "summary": summary,
-        "language": language,
+        "status": "uploaded" if result["version"] == 1 else "updated",
+        "preview": result["text"][:500],
+        "summary": result["summary"],
+        "duplicate_of": result["duplicate_of"],
+        "version": result["version"],
+        "changed_pages": result["changed_pages"],
     }
 
 
@@ -93,64 +146,157 @@ async def upload_pdf(file: UploadFile = File(...)):
 @router.post("/upload-multiple")
 async def upload_multiple(files: list[UploadFile] = File(...)):
     results = []
-    for file in files:
+    for i, file in enumerate(files):
+        QUEUE_DEPTH.set(len(files) - i, queue="upload")
         if not file.filename.lower().endswith(".pdf"):
             results.append({"filename": file.filename, "status": "skipped - not pdf"})
             continue
 
-        filename = _safe_filename(file.filename)
-        dest = UPLOAD_FOLDER / filename
+        data = await file.read()
+        content_hash = hashlib.sha256(data).hexdigest()
+        results.append(await run_in_threadpool(_ingest_upload, _safe_filename(file.filename), data, content_hash))
+
+    QUEUE_DEPTH.set(0, queue="upload")
+    return {"uploaded": results}
 
-        # 🔍 Duplicate check
-        existing = db.get_document(filename)
-        if existing or dest.exists():
-            existing_path = dest if dest.exists() else Path(existing["filepath"])
-            folder_rel = existing_path.parent.relative_to(Path.cwd())
-            results.append({
-                "filename": filename,
-                "status": "duplicate",
-                "folder": str(folder_rel),
-            })
+
+# Upload jako zadanie w tle + strumień zdarzeń (SSE) per plik / etap
+UPLOAD_JOB_WORKERS = int(os.getenv("UPLOAD_JOB_WORKERS", "2"))
+_upload_pool = ThreadPoolExecutor(max_workers=UPLOAD_JOB_WORKERS, thread_name_prefix="upload-job")
+
+
+def _run_upload_job(job_id: str, items: list):
+    with span("upload_job", job_id=job_id, files=len(items)):
+        results = [_run_upload_item(job_id, i, len(items), *item) for i, item in enumerate(items)]
+    QUEUE_DEPTH.set(0, queue="upload")
+    statuses = [r["status"] for r in results]
+    progress.publish(job_id, None, "completed", results=results,
+                     counts={s: statuses.count(s) for s in set(statuses)})
+
+
+def _run_upload_item(job_id: str, i: int, total: int, filename: str, tmp: Path, content_hash: str) -> dict:
+    QUEUE_DEPTH.set(total - i, queue="upload")
+    with progress.bind(job_id, filename):
+        progress.emit("started", index=i + 1, total=total)
+        try:
+            entry = _ingest_upload(filename, tmp, content_hash)
+            progress.emit("done", result=entry)
+        except Exception as e:
+            logger.error("[UPLOAD JOB] ❌ %s: %s", filename, e)
+            tmp.unlink(missing_ok=True)
+            entry = {"filename": filename, "status": "failed", "error": str(e)}
+            progress.emit("failed", error=str(e))
+    return entry
+
+
+async def _spool_upload(file: UploadFile) -> tuple[Path, str]:
+    """Zapisuje przesyłany plik kawałkami do pliku tymczasowego, licząc SHA-256."""
+    tmp = UPLOAD_FOLDER / f".upload-{uuid.uuid4().hex}.part"
+    h = hashlib.sha256()
+    with open(tmp, "wb") as out:
+        while chunk := await file.read(1024 * 1024):
+            h.update(chunk)
+            out.write(chunk)
+    return tmp, h.hexdigest()
+
+
+@router.post("/upload-jobs", status_code=202)
+async def create_upload_job(files: list[UploadFile] = File(...)):
+    """Przyjmuje pliki i od razu zwraca job_id; postęp: GET /upload-jobs/{job_id}/events (SSE)."""
+    items, skipped = [], []
+    for file in files:
+        if not file.filename.lower().endswith(".pdf"):
+            skipped.append({"filename": file.filename, "status": "skipped - not pdf"})
             continue
+        tmp, content_hash = await _spool_upload(file)
+        items.append((_safe_filename(file.filename), tmp, content_hash))
 
-        # 📥 Save new file
-        data = await file.read()
-        dest.write_bytes(data)
-        db.add_document(filename, dest)
+    job_id = progress.create_job(files=[name for name, _, _ in items], skipped=skipped)
+    _upload_pool.submit(_run_upload_job, job_id, items)
+    return {
+        "job_id": job_id,
+        "events": f"/documents/upload-jobs/{job_id}/events",
+        "files": [name for name, _, _ in items],
+        "skipped": skipped,
+    }
 
-        preview = extract_text_from_pdf(dest)[:500]
-        summary = analyze_pdf(dest)
-        index_pdf(dest, filename, summary)
 
-        results.append({
-            "filename": filename,
-            "status": "uploaded",
-            "preview": preview,
-            "summary": summary,
-        })
+@router.get("/upload-jobs/{job_id}/events")
+async def upload_job_events(job_id: str, request: Request):
+    """Server-Sent Events: `event: <etap>`, `data: {file, stage, ...}`; wznowienie od Last-Event-ID."""
+    if not progress.exists(job_id):
+        raise HTTPException(status_code=404, detail="Unknown upload job")
+    after = int(request.headers.get("last-event-id") or 0)
+
+    async def stream():
+        async for event in progress.subscribe(job_id, after):
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"id: {event['id']}\nevent: {event['stage']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+    return StreamingResponse(
+        stream(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Bulk import (katalog / ZIP / TAR na serwerze albo przesłane archiwum)
+# import ze ścieżki na serwerze tylko spod IMPORT_ROOT — bez niej endpoint jest wyłączony
+IMPORT_ROOT = os.getenv("IMPORT_ROOT")
+IMPORTS_DIR = UPLOAD_FOLDER / ".imports"
+
+@router.post("/import")
+async def start_bulk_import(data: dict = Body(...)):
+    """Startuje import w tle: {"path": katalog | archiwum, "workers": 4, "versions": false}. Zwraca job_id."""
+    if not IMPORT_ROOT:
+        raise HTTPException(status_code=403, detail="Server-side import is disabled (IMPORT_ROOT not set)")
+    if not data.get("path"):
+        raise HTTPException(status_code=400, detail="Import path required")
+    root = Path(IMPORT_ROOT).resolve()
+    source = (root / Path(data["path"]).expanduser()).resolve()   # względna → pod IMPORT_ROOT
+    if not source.is_relative_to(root):
+        raise HTTPException(status_code=403, detail="Import path outside IMPORT_ROOT")
+    if not source.exists():
+        raise HTTPException(status_code=400, detail="Import path does not exist")
+    workers = int(data.get("workers") or bulk_import.IMPORT_WORKERS)
+    return {"job_id": bulk_import.start_import(source, workers, versions=bool(data.get("versions")))}
+
+@router.post("/import/archive")
+async def import_archive(file: UploadFile = File(...), workers: int = bulk_import.IMPORT_WORKERS,
+                         versions: bool = False):
+    """Przyjmuje archiwum ZIP/TAR (zapis strumieniowy) i importuje je w tle."""
+    IMPORTS_DIR.mkdir(exist_ok=True)
+    dest = IMPORTS_DIR / f"{uuid.uuid4().hex}-{Path(file.filename).name}"
+    with open(dest, "wb") as out:
+        while chunk := await file.read(bulk_import.COPY_CHUNK):
+            out.write(chunk)
+    return {"job_id": bulk_import.start_import(dest, workers, cleanup=True, versions=versions)}
+
+@router.get("/import/{job_id}")
+async def bulk_import_status(job_id: str):
+    status = bulk_import.job_status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return status
 
-    return {"uploaded": results}
 # List
 @router.get("/")
 async def list_documents():
     """
     Zwraca listę dokumentów tylko z katalogu głównego (bez tych przeniesionych do folderów).
     """
-    docs = db.list_documents()
+    docs = db.list_documents(root_only=True)
     out = []
 
     for d in docs:
         filepath = Path(d["filepath"])
 
-        # 🔹 pomiń pliki, które znajdują się w folderach
-        if "folders" in filepath.parts:
-            continue
-
         try:
-            preview = extract_text_from_pdf(filepath)[:300]
+            text = extract_text_from_pdf(filepath)
+            preview = text[:300]
             summary = analyze_pdf(filepath)
-            lang_sample = extract_text_from_pdf(filepath)[:2000]
-            language = detect_language(lang_sample)
+            language = detect_language(text)
         except Exception:
             preview = ""
             summary = ""
@@ -165,29 +311,67 @@ async def list_documents():
 
     return out
 
-# View
-@router.get("/view/{filename}")
-async def view_pdf(filename: str):
+def _stored_pdf(filename: str):
+    """Jeden odczyt z bazy: (rekord, ścieżka); hash treści liczony leniwie dla starych wpisów."""
     rec = db.get_document(filename)
     if not rec:
         raise HTTPException(status_code=404, detail="File not found")
     path = Path(rec["filepath"])
     if not path.exists():
         raise HTTPException(status_code=404, detail="File missing on disk")
+    if not rec.get("content_hash"):
+        rec["content_hash"] = _hash_file(path)
+        db.set_content_hash(filename, rec["content_hash"])
+    return rec, path
+
+def _hash_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _thumbnail_path(content_hash: str, page: int) -> Path:
+    return THUMBNAILS_DIR / f"{content_hash}_p{page}.png"
+
+def _ensure_thumbnail(path: Path, content_hash: str, page: int = 1) -> Path | None:
+    from app.pdf_utils import render_thumbnail
+    thumb = _thumbnail_path(content_hash, page)
+    if thumb.exists():
+        return thumb
+    THUMBNAILS_DIR.mkdir(exist_ok=True)
+    return thumb if render_thumbnail(path, thumb, page=page) else None
+
+# View (Range + ETag → PDF.js może ładować przyrostowo, przeglądarka cache'uje)
+@router.get("/view/{filename}")
+async def view_pdf(filename: str, request: Request):
+    rec, path = _stored_pdf(filename)
     headers = _content_disposition_filename_header(filename, disposition="inline")
-    return FileResponse(path, media_type="application/pdf", headers=headers)
+    return file_response(request, path, rec["content_hash"], "application/pdf", headers)
 
 # Download
 @router.get("/download/{filename}")
-async def download_pdf(filename: str):
-    rec = db.get_document(filename)
+async def download_pdf(filename: str, request: Request):
+    rec, path = _stored_pdf(filename)
+    headers = _content_disposition_filename_header(filename, disposition="attachment")
+    return file_response(request, path, rec["content_hash"], "application/pdf", headers)
+
+# Thumbnail (cache na dysku po hashu treści)
+@router.get("/thumbnail/{filename}")
+async def thumbnail(filename: str, request: Request, page: int = 1):
+    rec, path = _stored_pdf(filename)
+    thumb = _ensure_thumbnail(path, rec["content_hash"], page)
+    if not thumb:
+        raise HTTPException(status_code=404, detail="Thumbnail unavailable")
+    return file_response(request, thumb, f"{rec['content_hash']}-p{page}", "image/png")
+
+# Versions (historia uploadów z listą zmienionych stron)
+@router.get("/versions/{filename}")
+async def document_versions(filename: str):
+    rec = db.get_document(_safe_filename(filename))
     if not rec:
         raise HTTPException(status_code=404, detail="File not found")
-    path = Path(rec["filepath"])
-    if not path.exists():
-        raise HTTPException(status_code=404, detail="File missing on disk")
-    headers = _content_disposition_filename_header(filename, disposition="attachment")
-    return FileResponse(path, media_type="application/pdf", headers=headers)
+    return {"filename": rec["filename"], "current": rec["version"], "versions": db.list_versions(rec["doc_id"])}
 
 # Delete
 @router.delete("/file/{filename:path}")
@@ -196,49 +380,32 @@ async def delete_document(filename: str):
     Deletes a PDF file from uploaded_pdfs/ or uploaded_pdfs/folders/.
     Works even if DB record is missing.
     """
-    import shutil
     from urllib.parse import unquote
 
     try:
         # 🔹 Decode special characters
         safe_name = unquote(filename)
-        print(f"🗑️ Request to delete: {safe_name}")
+        logger.debug("🗑️ Request to delete: %s", safe_name)
 
-        # 🔹 Look up DB first
+        # 🔹 Indexed DB lookup; bez wpisu sprawdzamy tylko katalog główny (bez przeszukiwania drzewa)
         rec = db.get_document(safe_name)
-        if rec and "filepath" in rec:
-            path = Path(rec["filepath"])
-        else:
-            # Try finding on disk
-            path = None
-            candidates = [
-                UPLOAD_FOLDER / safe_name,
-                UPLOAD_FOLDER / "folders" / safe_name,
-                ]
-            for c in candidates:
-                if c.exists():
-                    path = c
-                    break
-            if not path:
-                # recursive search
-                for root, _, files in os.walk(UPLOAD_FOLDER):
-                    if Path(safe_name).name in files:
-                        path = Path(root) / Path(safe_name).name
-                        break
+        path = Path(rec["filepath"]) if rec else UPLOAD_FOLDER / Path(safe_name).name
 
         if not path or not path.exists():
             raise HTTPException(status_code=404, detail=f"File not found: {safe_name}")
 
         # 🧹 Delete file
         path.unlink()
-        print(f"✅ Deleted: {path}")
+        logger.info("✅ Deleted: %s", path)
 
         # 🔄 Clean up index + DB
         try:
             db.delete_document(safe_name)
-            delete_from_index(safe_name)
+            delete_from_index(rec["doc_id"] if rec else safe_name)
+            if rec:
+                vector_store.delete(rec["doc_id"])
         except Exception as cleanup_err:
-            print(f"⚠️ Cleanup warning: {cleanup_err}")
+            logger.warning("⚠️ Cleanup warning: %s", cleanup_err)
 
         return {"deleted": safe_name}
 
@@ -254,33 +421,26 @@ async def search_documents(query: str):
         raise HTTPException(status_code=400, detail="Query required")
 
     results = es_search(query)
+    # streszczenia brakujące w ES uzupełniamy z SQLite (bez czytania PDF-ów)
+    records = db.get_documents([r.get("filename") for r in results if r.get("filename")])
     output = []
 
     for r in results:
         try:
-            # Pobierz dane ze źródła (Elasticsearch zwraca często pod "_source")
-            source = r.get("_source", r)
-
-            filepath = Path(source.get("path", ""))
-            preview = extract_text_from_pdf(filepath)[:300] if filepath.exists() else ""
-            summary = source.get("summary", "") or (analyze_pdf(filepath) if filepath.exists() else "")
-            language = source.get("language", "unknown")
-
-            # Jeśli language nie ma, spróbuj z metadanych pliku
-            if language == "unknown" and filepath.exists():
-                from app.ai_utils import detect_language
-                text_sample = extract_text_from_pdf(filepath)[:2000]
-                language = detect_language(text_sample) or "unknown"
+            record = records.get(r.get("filename")) or {}
+            summary = r.get("summary") or record.get("summary") or ""
+            # podgląd = fragmenty z highlightu ES (HTML-escaped, dopasowania w <em>)
+            preview = " … ".join(r.get("highlight", [])) or summary[:300]
 
             output.append({
-                "filename": source.get("filename", "unknown"),
+                "filename": r.get("filename", "unknown"),
                 "preview": preview,
                 "summary": summary,
-                "language": language
+                "language": r.get("language") or record.get("language") or "unknown",
             })
 
         except Exception as e:
-            print(f"[SEARCH ERROR] {e}")
+            logger.error("[SEARCH ERROR] %s", e)
             output.append({
                 "filename": r.get("filename", "unknown"),
                 "preview": "",
@@ -289,6 +449,29 @@ async def search_documents(query: str):
             })
 
     return output
+
+# Search-as-you-type (ES search_as_you_type albo lokalny indeks prefiksowy)
+@router.get("/suggest")
+def suggest_documents(q: str = "", size: int = 8):
+    # zwykłe `def` — ewentualne czekanie na ES idzie w puli wątków, nie blokuje pętli
+    return suggest.suggest(q, size)
+
+# Similar documents (embeddingi z magazynu int8 na dysku)
+@router.get("/similar/{filename}")
+async def similar_documents(filename: str, k: int = 5):
+    rec = db.get_document(filename)
+    if not rec:
+        raise HTTPException(status_code=404, detail="Document not found")
+    vector = vector_store.get(rec["doc_id"])
+    if vector is None:
+        return {"filename": rec["filename"], "similar": []}
+    similar = []
+    for doc_id, score in vector_store.search(vector, k=max(1, min(k, 50)), exclude={rec["doc_id"]}):
+        other = db.get_document_by_id(doc_id)
+        if other:
+            similar.append({"filename": other["filename"], "score": round(score, 4)})
+    return {"filename": rec["filename"], "similar": similar}
+
 # Clear index
 @router.delete("/clear-index")
 async def clear_elasticsearch_index():
@@ -298,79 +481,45 @@ async def clear_elasticsearch_index():
 # Reindex all
 @router.post("/reindex-all")
 async def reindex_all():
-    create_index()
-    docs = db.list_documents()
-    count = 0
-    for d in docs:
-        p = Path(d["filepath"])
-        if p.exists():
-            index_pdf(p, d["filename"])
-            count += 1
-    return {"message": f"✅ Reindexed {count} documents in Elasticsearch."}
+    """Przebudowa indeksu w tle (nowy indeks za aliasem); postęp: /reindex-status."""
+    state = es_reindex.start()
+    return {"message": "⏳ Reindex started – search keeps using the current index.", **state}
+
+@router.get("/reindex-status")
+async def reindex_status():
+    return es_reindex.status()
 
 # =============================
 # 🧠 ADMIN HEALTH ENDPOINT (pełny + stabilny)
 # =============================
 @router.get("/admin/health")
 async def admin_health():
-    """Zwraca stan aplikacji, Elasticsearch i Vertex AI (z automatycznym wykrywaniem modelu)."""
-    from app.elasticsearch_utils import check_connection
-    from app.vertex_utils import get_vertex_status
-    from app.db import list_documents
-
-    # 🔹 Elasticsearch
-    es_ok = check_connection()
-
-    # 🔹 Vertex AI – szybki status z vertex_utils
-    vertex_info = get_vertex_status()
-
-    # 🔹 Próba dynamicznego wykrycia modelu (tylko jeśli Vertex jest włączony)
-    vertex_model = vertex_info.get("model", "—")
-    if vertex_info.get("enabled"):
-        try:
-            import vertexai
-            from vertexai.generative_models import GenerativeModel
-
-            # próba inicjalizacji (nie blokuje, jeśli już zainicjalizowany)
-            vertexai.init(project=vertex_info.get("project"), location=vertex_info.get("region"))
-
-            # próbujemy sprawdzić realny model – jeśli się uda, nadpisz
-            model = GenerativeModel.from_pretrained("gemini-1.5-pro")
-            vertex_model = getattr(model, "name", None) or "gemini-1.5-pro"
-
-        except Exception as inner_e:
-            print(f"[VertexAI] Model detection failed: {inner_e}")
-            # nie blokujemy – zostawiamy dane z vertex_utils
-
-    # 🔹 Zbuduj pełną odpowiedź
-    return {
-        "app": "running",
-        "elasticsearch": {
-            "connected": es_ok,
-            "index": "pdf_documents" if es_ok else None,
-            "docs": "OK" if es_ok else "unavailable",
-        },
-        "vertex_ai": {
-            "enabled": vertex_info.get("enabled", False),
-            "model": vertex_model,
-        },
-    }
+    """Zwraca stan aplikacji, Elasticsearch i Vertex AI z cache sond działających w tle (bez I/O)."""
+    from app import health
+    return health.snapshot()
 
 # =============================
 # 📁 FOLDERS MANAGEMENT ENDPOINTS
 # =============================
-from fastapi import Body
 import shutil
 
 FOLDERS_ROOT = UPLOAD_FOLDER / "folders"
 FOLDERS_ROOT.mkdir(exist_ok=True)
+db.sync_folders_from_disk(FOLDERS_ROOT)
+
+
+def _folder_path(name: str) -> Path:
+    """Katalog folderu pod FOLDERS_ROOT; nazwy z separatorami / ".." → 400 (bez wychodzenia poza upload)."""
+    path = (FOLDERS_ROOT / name).resolve()
+    if not name or name in (".", "..") or "/" in name or "\\" in name or path.parent != FOLDERS_ROOT.resolve():
+        raise HTTPException(status_code=400, detail=f"Invalid folder name: {name!r}")
+    return FOLDERS_ROOT / name
 
 
 @router.get("/folders")
 async def list_folders():
-    """Zwraca listę wszystkich folderów w katalogu upload."""
-    folders = [f.name for f in FOLDERS_ROOT.iterdir() if f.is_dir()]
-    return {"folders": folders}
+    """Zwraca listę wszystkich folderów (z tabeli folders)."""
+    return {"folders": db.list_folders()}
 
 
 @router.post("/folders")
@@ -380,11 +529,12 @@ async def create_folder(data: dict = Body(...)):
     if not folder_name:
         raise HTTPException(status_code=400, detail="Folder name required")
 
-    new_folder = FOLDERS_ROOT / folder_name
-    if new_folder.exists():
+    new_folder = _folder_path(folder_name)
+    if db.get_folder(folder_name) or new_folder.exists():
         raise HTTPException(status_code=400, detail="Folder already exists")
 
     new_folder.mkdir(parents=True, exist_ok=False)
+    db.create_folder(folder_name)
     return {"message": f"✅ Folder '{folder_name}' created successfully."}
 
 @router.delete("/folders/{name}")
@@ -395,15 +545,17 @@ async def delete_folder(name: str):
     """
     folder_path = FOLDERS_ROOT / name
 
-    if not folder_path.exists() or not folder_path.is_dir():
+    if not db.get_folder(name):
         raise HTTPException(status_code=404, detail="Folder not found")
 
     # Sprawdź, czy folder jest pusty
-    if any(folder_path.iterdir()):
+    if db.count_folder_documents(name):
         raise HTTPException(status_code=400, detail="Folder is not empty. Remove files first.")
 
     try:
-        folder_path.rmdir()
+        if folder_path.exists():
+            folder_path.rmdir()
+        db.delete_folder(name)
         return {"message": f"✅ Folder '{name}' deleted successfully."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to delete folder: {e}")
@@ -415,55 +567,102 @@ async def move_file_to_folder(data: dict = Body(...)):
 
     if not filename or not folder:
         raise HTTPException(status_code=400, detail="Both filename and folder required")
+    dest_folder = _folder_path(folder)
+    if Path(filename).name != filename:
+        raise HTTPException(status_code=400, detail=f"Invalid filename: {filename!r}")
 
-    src = UPLOAD_FOLDER / filename
-    dest_folder = FOLDERS_ROOT / folder
+    # aktualna lokalizacja z bazy (indeks po filename) — bez przeszukiwania podfolderów
+    rec = db.get_document(filename)
+    src = Path(rec["filepath"]) if rec else UPLOAD_FOLDER / filename
     dest = dest_folder / filename
 
-    # szukaj także w podfolderach
-    if not src.exists():
-        for subfolder in FOLDERS_ROOT.iterdir():
-            candidate = subfolder / filename
-            if candidate.exists():
-                src = candidate
-                break
-
     if not src.exists():
         raise HTTPException(status_code=404, detail=f"File '{filename}' not found")
-    if not dest_folder.exists():
+    if not db.get_folder(folder):
         raise HTTPException(status_code=404, detail=f"Destination folder '{folder}' not found")
 
-    import shutil
+    dest_folder.mkdir(exist_ok=True)
     shutil.move(str(src), str(dest))
 
     # 🔴 BEZ TEGO view/download/delete po przeniesieniu będą się wywalać
-    from app import db
-    db.add_document(filename, dest)  # <— aktualizacja ścieżki w SQLite
+    db.move_document(filename, dest, folder)  # <— aktualizacja ścieżki i folderu w SQLite
+
+    # 🔹 aktualizacja ścieżki w Elasticsearch po _id (bez update_by_query)
+    update_fields(rec["doc_id"] if rec else filename, {"path": str(dest)})
+
+    return {"message": f"✅ File '{filename}' moved to folder '{folder}'"}
 
-    # (opcjonalnie) zaktualizuj ścieżkę w Elasticsearch, jeśli używasz:
+@router.post("/folders/move-batch")
+async def move_files_batch(data: dict = Body(...)):
+    """
+    Przenosi wiele plików naraz: jedna transakcja SQLite, jeden przebieg po
+    systemie plików i jedno żądanie bulk do ES (jeden refresh na końcu).
+    Body: { "moves": [{"filename": "a.pdf", "folder": "raporty"}, ...], "create_folders": true }
+    Wszystko albo nic — przy błędnych pozycjach nic nie jest przenoszone.
+    """
+    from app.elasticsearch_utils import bulk_update_fields
+
+    moves = data.get("moves") or []
+    if not moves or any(not m.get("filename") or not m.get("folder") for m in moves):
+        raise HTTPException(status_code=400, detail="Each move requires filename and folder")
+
+    # 🔹 walidacja: nazwy (nic nie może wyjść poza FOLDERS_ROOT), potem foldery
+    for m in moves:
+        _folder_path(m["folder"])
+        if Path(m["filename"]).name != m["filename"]:
+            raise HTTPException(status_code=400, detail=f"Invalid filename: {m['filename']!r}")
+    wanted_folders = {m["folder"] for m in moves}
+    missing_folders = wanted_folders - set(db.list_folders())
+    if missing_folders and not data.get("create_folders"):
+        raise HTTPException(status_code=404, detail=f"Folders not found: {sorted(missing_folders)}")
+
+    # 🔹 walidacja: pliki (jedno zapytanie po filename)
+    records = db.get_documents([m["filename"] for m in moves])
+    plan = []
+    for m in moves:
+        rec = records.get(m["filename"])
+        src = Path(rec["filepath"]) if rec else UPLOAD_FOLDER / m["filename"]
+        plan.append((m["filename"], src, FOLDERS_ROOT / m["folder"] / m["filename"], m["folder"]))
+    missing_files = [f for f, src, _, _ in plan if not src.exists()]
+    if missing_files:
+        raise HTTPException(status_code=404, detail=f"Files not found: {missing_files}")
+
+    # 📦 jeden przebieg po systemie plików (z wycofaniem przy błędzie)
+    done = []
     try:
-        from app.elasticsearch_utils import es, ES_INDEX
-        es.update_by_query(
-            index=ES_INDEX,
-            body={
-                "script": {"source": "ctx._source.path = params.p", "params": {"p": str(dest)}},
-                "query": {"term": {"filename": {"value": filename}}},
-            },
-            refresh=True,
-        )
+        for folder in wanted_folders:
+            (FOLDERS_ROOT / folder).mkdir(exist_ok=True)
+        for filename, src, dest, folder in plan:
+            if src != dest:
+                shutil.move(str(src), str(dest))
+            done.append((src, dest))
+        db.move_documents([(filename, dest, folder) for filename, _, dest, folder in plan])
     except Exception as e:
-        print(f"[ES WARN] Path update failed for {filename}: {e}")
+        for src, dest in reversed(done):
+            if src != dest and dest.exists():
+                shutil.move(str(dest), str(src))
+        raise HTTPException(status_code=500, detail=f"Batch move failed, rolled back: {e}")
 
-    return {"message": f"✅ File '{filename}' moved to folder '{folder}'"}
+    # 🔹 ES: jedno żądanie bulk
+    indexed = bulk_update_fields({
+        (records[filename]["doc_id"] if filename in records else filename): {"path": str(dest)}
+        for filename, _, dest, _ in plan
+    })
+
+    return {
+        "message": f"✅ Moved {len(plan)} files.",
+        "moved": len(plan),
+        "folders_created": sorted(missing_folders),
+        "es_updated": indexed,
+    }
 
 @router.get("/folders/{name}")
 async def list_folder_contents(name: str):
     """Zwraca listę plików w wybranym folderze."""
-    folder_path = FOLDERS_ROOT / name
-    if not folder_path.exists() or not folder_path.is_dir():
+    if not db.get_folder(name):
         raise HTTPException(status_code=404, detail="Folder not found")
 
-    files = [f.name for f in folder_path.iterdir() if f.is_file()]
+    files = [d["filename"] for d in db.list_folder_documents(name)]
     return {"folder": name, "files": files}
 
 # =============================
@@ -481,40 +680,28 @@ async def move_to_folder(data: dict = Body(...)):
 
     if not filename or not folder_name:
         raise HTTPException(status_code=400, detail="Missing filename or folder")
+    dest_folder = _folder_path(folder_name)
+    if Path(filename).name != filename:
+        raise HTTPException(status_code=400, detail=f"Invalid filename: {filename!r}")
 
-    src = UPLOAD_FOLDER / filename
-    dest_folder = FOLDERS_ROOT / folder_name
+    rec = db.get_document(filename)
+    src = Path(rec["filepath"]) if rec else UPLOAD_FOLDER / filename
     dest = dest_folder / filename
 
     if not src.exists():
         raise HTTPException(status_code=404, detail="File not found")
-    if not dest_folder.exists():
+    if not db.get_folder(folder_name):
         raise HTTPException(status_code=404, detail="Folder not found")
 
     # Przenieś fizycznie plik
+    dest_folder.mkdir(exist_ok=True)
     src.rename(dest)
 
-    # 🔹 aktualizuj ścieżkę w SQLite
-    from app import db
-    db.add_document(filename, dest)
+    # 🔹 aktualizuj ścieżkę i folder w SQLite
+    db.move_document(filename, dest, folder_name)
 
-    # 🔹 aktualizuj Elasticsearch (aktualizujemy tylko path)
-    from app.elasticsearch_utils import es, ES_INDEX
-    try:
-        es.update_by_query(
-            index=ES_INDEX,
-            body={
-                "script": {
-                    "source": "ctx._source.path = params.new_path",
-                    "params": {"new_path": str(dest)},
-                },
-                "query": {"term": {"filename": {"value": filename}}},
-            },
-            refresh=True
-        )
-        print(f"[ES] Path updated for {filename}")
-    except Exception as e:
-        print(f"[ES WARN] Could not update path for {filename}: {e}")
+    # 🔹 aktualizuj Elasticsearch po _id (aktualizujemy tylko path)
+    update_fields(rec["doc_id"] if rec else filename, {"path": str(dest)})
 
     return {"message": f"✅ File '{filename}' moved to folder '{folder_name}'."}
 
@@ -524,54 +711,40 @@ async def move_to_folder(data: dict = Body(...)):
 @router.get("/ai/suggest-dynamic-folders")
 async def ai_suggest_dynamic_folders():
     """
-    Analyze indexed documents and suggest smart folder groupings using Vertex AI.
+    Suggest smart folder groupings for the whole corpus (stored embeddings + incremental clustering).
     """
-    from app.elasticsearch_utils import es, ES_INDEX, check_connection
     from app.ai_utils import suggest_dynamic_folders
 
-    if not check_connection():
-        return {"error": "Elasticsearch not available"}
-
-    # Pobierz wszystkie dokumenty z Elasticsearch
     try:
-        docs = es.search(index=ES_INDEX, body={"query": {"match_all": {}}, "size": 50})
-        hits = docs.get("hits", {}).get("hits", [])
-        if not hits:
-            return {"folders": [], "message": "No indexed documents found."}
-
-        docs_data = [
-            {
-                "filename": h["_source"].get("filename", ""),
-                "summary": h["_source"].get("summary", ""),
-                "language": h["_source"].get("language", "unknown"),
-            }
-            for h in hits
-        ]
-
-        # AI grupuje dokumenty
-        suggestions = suggest_dynamic_folders(docs_data)
+        suggestions = await run_in_threadpool(suggest_dynamic_folders)
+        if not suggestions:
+            return {"folders": [], "message": "No documents found."}
         return {"folders": suggestions}
 
     except Exception as e:
-        print(f"[AI Dynamic Folder Error] {e}")
+        logger.error("[AI Dynamic Folder Error] %s", e)
         return {"error": str(e), "folders": []}
 
 # --- Q&A over documents ---
 from fastapi import Body
 
 @router.post("/qa")
-async def qa_endpoint(payload: dict = Body(...)):
+async def qa_endpoint(payload: dict = Body(...), mode: str | None = None, latency_budget_ms: float | None = None):
     """
-    Body: { "question": "..." }
-    Zwraca: { "answer": "...", "sources": ["file1.pdf", ...] }
+    Body: { "question": "...", "mode": "extractive|generative|auto", "latency_budget_ms": 3000 }
+    (mode / latency_budget_ms także jako parametry zapytania; domyślnie auto)
+    Zwraca: { "answer": "...", "sources": ["file1.pdf", ...], "mode": "...", "citations": [...] }
     """
+    from app.ai_chat import answer_question, QA_MODES
+
     question = (payload.get("question") or "").strip()
     if not question:
         raise HTTPException(status_code=400, detail="Question is required")
+    mode = mode or payload.get("mode") or "auto"
+    if mode not in QA_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of: {', '.join(QA_MODES)}")
 
-    from app.ai_chat import answer_question
-    result = answer_question(question)
-    return result
+    return await run_in_threadpool(answer_question, question, mode, latency_budget_ms or payload.get("latency_budget_ms"))
 
 # =============================
 # 💬 ASK AI ENDPOINT
@@ -587,5 +760,5 @@ async def ai_query(text: str):
     if not text or len(text.strip()) < 2:
         raise HTTPException(status_code=400, detail="Query too short")
 
-    answer = ask_ai(text)
+    answer = await run_in_threadpool(ask_ai, text)
     return {"query": text, "answer": answer}
\ No newline at end of file
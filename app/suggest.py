@@ -0,0 +1,140 @@
+# app/suggest.py
+"""
+Podpowiedzi przy wpisywaniu (/documents/suggest).
+
+Źródło: pole `suggest` (search_as_you_type) w ES z krótkim limitem czasu; gdy ES jest
+niedostępny albo nie zmieścił się w budżecie, lokalny indeks prefiksowy w pamięci
+(posortowane tokeny tytułów i fraz kluczowych z SQLite + bisect). Po przekroczeniu
+budżetu przez ES kolejne zapytania przez ES_BACKOFF_S idą od razu do indeksu
+lokalnego. Pusta odpowiedź ES też kończy się indeksem lokalnym — indeks sprzed
+szablonu v3 nie ma pola `suggest`, dopóki nie przejdzie /reindex-all, a lokalny
+indeks odpowiada w ułamku milisekundy. Wyniki są w cache z krótkim TTL (przestrzeń "suggest").
+"""
+import bisect
+import logging
+import re
+import threading
+import time
+import unicodedata
+
+from app import cache, db
+from app import elasticsearch_utils as esu
+from app.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+ES_TIMEOUT_S = 0.1          # budżet na zapytanie do ES, potem indeks lokalny
+ES_BACKOFF_S = 30.0
+LOCAL_REFRESH_S = 30.0      # co ile najwyżej sprawdzamy, czy korpus się zmienił
+MAX_SUGGESTIONS = 8
+MIN_PREFIX = 2
+
+_TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+_lock = threading.Lock()
+_local = {"tokens": [], "postings": [], "entries": [], "stamp": None, "checked": 0.0}
+_es_down_until = 0.0
+
+
+def _fold(text: str) -> str:
+    """Małe litery bez diakrytyków (zażółć → zazolc) — wpisywanie bez polskich znaków też trafia."""
+    text = unicodedata.normalize("NFKD", text.lower()).replace("ł", "l")
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def _tokens(text: str) -> list[str]:
+    return _TOKEN_RE.findall(_fold(text))
+
+
+def _build_local():
+    docs = db.list_documents()
+    entries, pairs = [], []
+    for d in docs:
+        phrases = esu.suggest_inputs(d["filename"], d.get("summary") or "")
+        entries.append({"filename": d["filename"], "label": phrases[0] or d["filename"]})
+        idx = len(entries) - 1
+        for token in {t for p in phrases for t in _tokens(p)}:
+            pairs.append((token, idx))
+    pairs.sort()
+    return [t for t, _ in pairs], [(i, t) for t, i in pairs], entries
+
+
+def _local_index():
+    """(tokeny, [(doc, token)], wpisy) — przebudowa, gdy zmieniła się liczba / data dokumentów."""
+    now = time.monotonic()
+    if now - _local["checked"] < LOCAL_REFRESH_S and _local["stamp"] is not None:
+        return _local
+    with _lock:
+        if now - _local["checked"] >= LOCAL_REFRESH_S or _local["stamp"] is None:
+            stamp = db.corpus_stamp()
+            if stamp != _local["stamp"]:
+                with timed("suggest_index_build"):
+                    tokens, postings, entries = _build_local()
+                _local.update(tokens=tokens, postings=postings, entries=entries, stamp=stamp)
+            _local["checked"] = now
+    return _local
+
+
+def _suggest_local(prefix: str, size: int) -> list[dict]:
+    words = _tokens(prefix)
+    if not words:
+        return []
+    index = _local_index()
+    tokens, postings, entries = index["tokens"], index["postings"], index["entries"]
+
+    def matching(word: str, is_prefix: bool) -> set:
+        lo = bisect.bisect_left(tokens, word)
+        hi = bisect.bisect_right(tokens, word + "\uffff") if is_prefix else bisect.bisect_right(tokens, word)
+        return {postings[i][0] for i in range(lo, hi)}
+
+    # pełne słowa muszą wystąpić, ostatnie może być początkiem słowa
+    docs = None
+    for i, word in enumerate(words):
+        found = matching(word, is_prefix=i == len(words) - 1)
+        docs = found if docs is None else docs & found
+        if not docs:
+            return []
+    ranked = sorted(docs, key=lambda i: (not _fold(entries[i]["label"]).startswith(_fold(prefix)), entries[i]["label"]))
+    return [{"filename": entries[i]["filename"], "label": entries[i]["label"]} for i in ranked[:size]]
+
+
+def _suggest_es(prefix: str, size: int) -> list[dict] | None:
+    """Podpowiedzi z ES albo None (ES niedostępny / poza budżetem)."""
+    global _es_down_until
+    if not esu.es or time.monotonic() < _es_down_until:
+        return None
+    try:
+        with timed("es_suggest"):
+            res = esu.es.options(request_timeout=ES_TIMEOUT_S).search(
+                index=esu.ES_INDEX, body=esu.suggest_body(prefix, size)
+            )
+    except Exception as e:
+        _es_down_until = time.monotonic() + ES_BACKOFF_S
+        logger.info("[SUGGEST] ES unavailable (%s) – local prefix index for %.0fs", type(e).__name__, ES_BACKOFF_S)
+        return None
+    out = []
+    for h in res.get("hits", {}).get("hits", []):
+        src = h["_source"]
+        label = (src.get("suggest") or [None])[0] or esu.title_from_filename(src.get("filename", ""))
+        out.append({"filename": src.get("filename"), "label": label})
+    return out
+
+
+def suggest(prefix: str, size: int = MAX_SUGGESTIONS) -> dict:
+    """{"query", "suggestions": [{filename, label}], "source": "es" | "local" | "cache"}."""
+    prefix = " ".join(prefix.split())[:100]
+    if len(prefix) < MIN_PREFIX:
+        return {"query": prefix, "suggestions": [], "source": "none"}
+    size = max(1, min(size, MAX_SUGGESTIONS))
+    results = cache.namespace("suggest")
+    key = cache.make_key(_fold(prefix), size)
+    cached = results.get(key)
+    if cached is not None:
+        return {**cached, "source": "cache"}
+
+    suggestions, source = _suggest_es(prefix, size), "es"
+    if not suggestions:   # ES niedostępny albo bez trafień (np. indeks bez pola suggest)
+        suggestions, source = _suggest_local(prefix, size), "local"
+    result = {"query": prefix, "suggestions": suggestions}
+    results.set(key, result)
+    return {**result, "source": source}
@@ -0,0 +1,122 @@
+# app/summarizer.py
+"""
+Hierarchiczne (map-reduce) streszczanie długich dokumentów.
+
+1. Tekst jest dzielony na fragmenty z granicami zależnymi od treści
+   (content-defined chunking), więc edycja jednego miejsca przesuwa tylko
+   sąsiednie granice, a reszta fragmentów ma te same hashe.
+2. Fragmenty są streszczane równolegle (ograniczony fan-out), a streszczenia
+   cache'owane w SQLite po hashu fragmentu.
+3. Streszczenia częściowe są redukowane (rekurencyjnie, jeśli nadal za długie).
+"""
+import hashlib
+import logging
+import os
+import re
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import List
+
+from app import db
+from app.metrics import record_cache, timed
+from app.prompt_builder import CHARS_PER_TOKEN, estimate_tokens, truncate_to_tokens
+from app.vertex_utils import summarize_text
+
+logger = logging.getLogger(__name__)
+
+CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "2500"))
+REDUCE_TOKENS = int(os.getenv("SUMMARY_REDUCE_TOKENS", "3500"))
+MAX_FANOUT = int(os.getenv("SUMMARY_FANOUT", "4"))
+MAX_DEPTH = 3
+
+# Średnio co ~BOUNDARY_MASK+1 zdań (po osiągnięciu minimum) wypada granica fragmentu.
+BOUNDARY_MASK = 0x7
+
+SUMMARY_PROMPTS = {
+    "pl": "Streść poniższy tekst w kilku zdaniach w języku polskim:",
+    "en": "Summarize the following text in English in a few sentences:",
+    "de": "Fasse den folgenden Text auf Deutsch in wenigen Sätzen zusammen:",
+}
+DEFAULT_SUMMARY_PROMPT = "Summarize the following text briefly:"
+
+CHUNK_PROMPTS = {
+    "pl": "Streść ten fragment dłuższego dokumentu w 3–5 zdaniach po polsku, zachowując kluczowe fakty:",
+    "en": "Summarize this section of a longer document in 3-5 English sentences, keeping key facts:",
+    "de": "Fasse diesen Abschnitt eines längeren Dokuments in 3–5 Sätzen auf Deutsch zusammen, mit den wichtigsten Fakten:",
+}
+DEFAULT_CHUNK_PROMPT = "Summarize this section of a longer document in 3-5 sentences, keeping key facts:"
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+
+
+def chunk_text(text: str, chunk_tokens: int = CHUNK_TOKENS) -> List[str]:
+    """Dzieli tekst na fragmenty ~chunk_tokens, tnąc na końcach zdań wybranych po hashu."""
+    max_chars = chunk_tokens * CHARS_PER_TOKEN
+    min_chars = max_chars // 2
+    chunks, current, size = [], [], 0
+
+    for sentence in _SENTENCE_SPLIT.split(text):
+        if not sentence:
+            continue
+        # bardzo długie "zdania" (np. tabele bez kropek) tniemy twardo
+        while len(sentence) > max_chars:
+            if current:
+                chunks.append(" ".join(current))
+                current, size = [], 0
+            chunks.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        current.append(sentence)
+        size += len(sentence) + 1
+        at_boundary = (zlib.crc32(sentence.encode("utf-8")) & BOUNDARY_MASK) == 0
+        if size >= max_chars or (size >= min_chars and at_boundary):
+            chunks.append(" ".join(current))
+            current, size = [], 0
+
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def _chunk_hash(prefix: str, chunk: str) -> str:
+    return hashlib.sha256(f"{prefix}\n{chunk}".encode("utf-8")).hexdigest()
+
+
+def _summarize_chunk(chunk: str, lang: str) -> str:
+    prefix = CHUNK_PROMPTS.get(lang, DEFAULT_CHUNK_PROMPT)
+    key = _chunk_hash(prefix, chunk)
+    cached = db.get_chunk_summary(key)
+    record_cache("chunk_summary", cached is not None)
+    if cached is not None:
+        return cached
+
+    summary = (summarize_text(f"{prefix}\n\n{chunk}", max_length=600, task="chunk_summary") or "").strip()
+    if summary:
+        db.save_chunk_summary(key, summary)
+    return summary
+
+
+def map_reduce_summarize(text: str, lang: str, depth: int = 0) -> str:
+    """
+    Streszcza długi tekst: map (równolegle po fragmentach) → reduce.
+    Zwraca "" jeśli Vertex nie zwrócił żadnego streszczenia (wołający robi fallback).
+    """
+    final_prefix = SUMMARY_PROMPTS.get(lang, DEFAULT_SUMMARY_PROMPT)
+    if estimate_tokens(text) <= REDUCE_TOKENS or depth >= MAX_DEPTH:
+        text = truncate_to_tokens(text, REDUCE_TOKENS)
+        return (summarize_text(f"{final_prefix}\n\n{text}", task="summary") or "").strip()
+
+    chunks = chunk_text(text)
+    with timed("summary_map") as sp:
+        sp.set(chunks=len(chunks), depth=depth)
+        with ThreadPoolExecutor(max_workers=max(1, min(MAX_FANOUT, len(chunks)))) as pool:
+            futures = [pool.submit(copy_context().run, _summarize_chunk, c, lang) for c in chunks]
+            partials = [f.result() for f in futures]
+
+    partials = [p for p in partials if p]
+    if not partials:
+        return ""
+    logger.debug("[SUMMARY] depth=%d chunks=%d partials=%d", depth, len(chunks), len(partials))
+
+    with timed("summary_reduce"):
+        return map_reduce_summarize("\n\n".join(partials), lang, depth + 1)
@@ -0,0 +1,127 @@
+# app/tracing.py
+"""
+Lekkie śledzenie żądań: zagnieżdżone spany trzymane w contextvars.
+
+    with span("es_search", query_chars=len(q)) as sp:
+        hits = ...
+        sp.set(hits=len(hits))
+
+Middleware w `app.main` otwiera span główny dla każdego żądania, dokleja
+opcjonalny nagłówek `Server-Timing` i loguje drzewo spanów wolnych żądań.
+"""
+import asyncio
+import logging
+import os
+import random
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+SERVER_TIMING_ENABLED = os.getenv("TRACE_SERVER_TIMING", "0") == "1"
+SLOW_REQUEST_MS = float(os.getenv("TRACE_SLOW_MS", "2000"))
+SLOW_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+
+_current_span: ContextVar["Span | None"] = ContextVar("smartdoc_current_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "attrs", "children", "start", "end")
+
+    def __init__(self, name: str, attrs: dict | None = None):
+        self.name = name
+        self.attrs = dict(attrs or {})
+        self.children = []
+        self.start = time.perf_counter()
+        self.end = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "ms": round(self.duration_ms, 2),
+            **({"attrs": self.attrs} if self.attrs else {}),
+            **({"children": [c.to_dict() for c in self.children]} if self.children else {}),
+        }
+
+    def walk(self, depth: int = 0):
+        yield depth, self
+        for child in self.children:
+            yield from child.walk(depth + 1)
+
+    def format_tree(self) -> str:
+        lines = []
+        for depth, sp in self.walk():
+            attrs = " ".join(f"{k}={v}" for k, v in sp.attrs.items())
+            lines.append(f"{'  ' * depth}{sp.name} {sp.duration_ms:.1f}ms {attrs}".rstrip())
+        return "\n".join(lines)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Otwiera span podpięty pod bieżący (poza żądaniem działa jako no-op z pomiarem)."""
+    parent = _current_span.get()
+    sp = Span(name, attrs)
+    if parent is not None:
+        parent.children.append(sp)
+    token = _current_span.set(sp)
+    try:
+        yield sp
+    except Exception as e:
+        sp.set(error=type(e).__name__)
+        raise
+    finally:
+        sp.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+def traced(name: str):
+    """Dekorator: cała funkcja (także async) w jednym spanie."""
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_span() -> Span | None:
+    return _current_span.get()
+
+
+def server_timing_header(root: Span, limit: int = 20) -> str:
+    """Spłaszcza drzewo do formatu `Server-Timing` (nazwa;dur=ms)."""
+    entries = []
+    for depth, sp in root.walk():
+        token = re.sub(r"[^A-Za-z0-9_.-]", "_", sp.name) if depth else "total"
+        entries.append(f"{token};dur={sp.duration_ms:.1f}")
+        if len(entries) >= limit:
+            break
+    return ", ".join(entries)
+
+
+def maybe_log_slow(root: Span):
+    """Loguje drzewo spanów, gdy żądanie przekroczyło próg (z próbkowaniem)."""
+    if root.duration_ms < SLOW_REQUEST_MS:
+        return
+    if random.random() >= SLOW_SAMPLE_RATE:
+        return
+    logger.warning("[TRACE] slow request %.0fms\n%s", root.duration_ms, root.format_tree())
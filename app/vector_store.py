@@ -0,0 +1,409 @@
+# app/vector_store.py
+"""
+Magazyn embeddingów na dysku: int8 + memory-map.
+
+- wektory (znormalizowane) są kwantyzowane do int8 ze skalą per wiersz — 4× mniej
+  niż float32; pełne float32 leżą obok tylko do przeliczenia wyników (re-scoring),
+  czytane z dysku dla kilkudziesięciu kandydatów, więc nie zajmują RAM-u,
+- pliki .npy są otwierane przez np.load(mmap_mode="r"): wszystkie workery uvicorna
+  dzielą jedną kopię w page cache zamiast trzymać macierz każdy u siebie,
+- zapis tylko dopisuje nowe segmenty (bufor → segment po FLUSH_ROWS wektorach albo
+  najpóźniej po FLUSH_SECONDS — z timera, więc inne workery widzą nowe wektory bez
+  czekania na kolejne `add`); nowsza wersja wektora i usunięcia (tombstones w manifeście,
+  z czasem usunięcia) przesłaniają stare wiersze, a kompaktacja scala segmenty, gdy jest
+  ich za dużo albo za dużo w nich martwych wierszy,
+- manifest i segmenty są zmieniane pod wyłączną blokadą pliku, a czytane pod wspólną —
+  kompaktacja w innym workerze nie usunie plików między odczytem manifestu a mmapem,
+- wyszukiwanie: iloczyny skalarne int8 × zapytanie blokami w NumPy → top kandydaci →
+  dokładny wynik z float32.
+
+SQLite (tabela embeddings) pozostaje źródłem prawdy; brakujące wektory są dociągane
+z niej przy pierwszym użyciu. Wszystkie odczyty (podobne dokumenty, klastrowanie
+przez `iter_vectors`) idą przez magazyn, nie przez SQLite.
+"""
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from app import db
+from app.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+STORE_DIR = Path(os.getenv("VECTOR_STORE_DIR", BASE_DIR / "vector_store"))
+FLUSH_ROWS = 256
+FLUSH_SECONDS = 5.0
+MAX_SEGMENTS = 16            # więcej → kompaktacja
+MAX_DEAD_RATIO = 0.2         # odsetek martwych wierszy → kompaktacja
+TOMBSTONE_KEEP_S = 60.0      # tyle kompaktacja trzyma tombstones (bufory innych workerów)
+SEARCH_BLOCK = 16384         # tyle wierszy int8 naraz trafia do iloczynu (pamięć tymczasowa)
+RESCORE_FACTOR = 4           # ilu kandydatów (× k) przeliczamy dokładnie
+
+_lock = threading.RLock()
+_pending: dict = {}          # doc_id → wektor float32 (jeszcze nie w segmencie)
+_pending_at: dict = {}       # doc_id → time.time() dodania (porównywany z czasem usunięcia)
+_timer = None
+_view = {"mtime": None, "segments": [], "dims": None, "deleted": set()}
+_synced = False
+
+
+def _manifest_path() -> Path:
+    return STORE_DIR / "manifest.json"
+
+
+@contextmanager
+def _file_lock(shared: bool = False):
+    """Blokada między procesami (workery): wyłączna na zmianę plików i manifestu, wspólna na odczyt.
+    flock nie jest re-entrant między deskryptorami — pod wyłączną wołamy _refresh_locked."""
+    STORE_DIR.mkdir(parents=True, exist_ok=True)
+    with open(STORE_DIR / ".lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _read_manifest() -> dict:
+    try:
+        manifest = json.loads(_manifest_path().read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return {"dims": None, "segments": [], "deleted": {}}
+    if isinstance(manifest["deleted"], list):   # starszy format: same doc_id, bez czasu usunięcia
+        manifest["deleted"] = dict.fromkeys(manifest["deleted"], 0.0)
+    return manifest
+
+
+def _write_manifest(manifest: dict):
+    tmp = _manifest_path().with_suffix(".tmp")
+    tmp.write_text(json.dumps(manifest), encoding="utf-8")
+    os.replace(tmp, _manifest_path())
+    _view["mtime"] = None   # mtime może się nie zmienić przy szybkich zapisach — wymuś odświeżenie
+
+
+def quantize(X):
+    """float32 (n × d) → (int8 kody, skale float32) — symetrycznie, skala per wiersz."""
+    import numpy as np
+    scales = np.abs(X).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(X / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def _write_segment(ids: list, X) -> dict:
+    import numpy as np
+    name = f"seg-{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:6]}"
+    codes, scales = quantize(X)
+    for suffix, arr in (("codes", codes), ("scales", scales), ("vectors", X.astype(np.float32)),
+                        ("ids", np.array([i.encode("utf-8") for i in ids]))):
+        np.save(STORE_DIR / f"{name}.{suffix}.npy", arr)
+    return {"name": name, "rows": len(ids)}
+
+
+def _drop_segment_files(name: str):
+    for suffix in ("codes", "scales", "vectors", "ids"):
+        (STORE_DIR / f"{name}.{suffix}.npy").unlink(missing_ok=True)
+
+
+def _open_segment(name: str) -> dict:
+    import numpy as np
+    load = lambda suffix: np.load(STORE_DIR / f"{name}.{suffix}.npy", mmap_mode="r")  # noqa: E731
+    return {"name": name, "codes": load("codes"), "scales": load("scales"),
+            "vectors": load("vectors"), "ids": load("ids")}
+
+
+def _manifest_mtime():
+    try:
+        return _manifest_path().stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _refresh():
+    """Ponownie otwiera segmenty, gdy manifest się zmienił (także w innym workerze)."""
+    if _manifest_mtime() == _view["mtime"]:
+        return
+    with _file_lock(shared=True):
+        _refresh_locked()
+
+
+def _refresh_locked():
+    """Jak _refresh, pod blokadą pliku (wspólną albo wyłączną) trzymaną przez wołającego."""
+    import numpy as np
+    mtime = _manifest_mtime()
+    if mtime == _view["mtime"]:
+        return
+    manifest = _read_manifest()
+    deleted = {d.encode("utf-8") for d in manifest["deleted"]}
+    segments = [_open_segment(s["name"]) for s in manifest["segments"]]
+
+    # żywe wiersze: najnowsze wystąpienie doc_id (segmenty i wiersze od końca), bez usuniętych
+    if segments:
+        newest_first = np.concatenate([seg["ids"][::-1] for seg in reversed(segments)])
+        _, first = np.unique(newest_first, return_index=True)
+        live = np.zeros(len(newest_first), dtype=bool)
+        live[first] = True
+        if deleted:
+            live &= ~np.isin(newest_first, np.array(sorted(deleted)))
+        start = 0
+        for seg in reversed(segments):
+            end = start + len(seg["ids"])
+            seg["live"] = live[start:end][::-1].copy()
+            start = end
+    _view.update(mtime=mtime, segments=segments, dims=manifest["dims"], deleted=deleted)
+
+
+def _flush_locked():
+    import numpy as np
+    if not _pending:
+        return
+    with _file_lock():
+        manifest = _read_manifest()
+        deleted = manifest["deleted"]
+        # usunięty (także w innym workerze) już po dodaniu do bufora → nie wraca
+        live = {k: v for k, v in _pending.items() if deleted.get(k, -1.0) < _pending_at[k]}
+        dims = manifest["dims"] or len(next(iter(_pending.values())))
+        rows = [(k, v) for k, v in live.items() if len(v) == dims]
+        if len(rows) < len(live):
+            logger.warning("[VECTORS] skipped %d vectors with dims ≠ %d", len(live) - len(rows), dims)
+        if rows:
+            seg = _write_segment([k for k, _ in rows], np.stack([v for _, v in rows]))
+            manifest["dims"] = dims
+            manifest["segments"].append(seg)
+            for k, _ in rows:   # nowszy od usunięcia — tombstone już niepotrzebny
+                deleted.pop(k, None)
+            _write_manifest(manifest)
+        _pending.clear()
+        _pending_at.clear()
+        _refresh_locked()
+        if _needs_compaction():
+            _compact_locked(manifest)
+            _refresh_locked()
+
+
+def flush():
+    with _lock:
+        _flush_locked()
+
+
+def _timed_flush():
+    global _timer
+    with _lock:
+        _timer = None
+        try:
+            _flush_locked()
+        except Exception as e:
+            logger.warning("[VECTORS] ⚠️ timed flush failed: %s", e)
+
+
+def add(doc_id: str, vector):
+    """Dopisuje (albo podmienia) wektor dokumentu; zapis na dysk paczkami, najpóźniej po FLUSH_SECONDS."""
+    global _timer
+    import numpy as np
+    vec = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    if not norm:
+        return
+    with _lock:
+        _pending[doc_id] = vec / norm
+        _pending_at[doc_id] = time.time()
+        if len(_pending) >= FLUSH_ROWS:
+            _flush_locked()
+        elif _timer is None:
+            _timer = threading.Timer(FLUSH_SECONDS, _timed_flush)
+            _timer.daemon = True
+            _timer.start()
+
+
+def delete(doc_id: str):
+    """Tombstone z czasem usunięcia — także gdy wektor czeka jeszcze w buforze innego workera."""
+    with _lock:
+        _pending.pop(doc_id, None)
+        _pending_at.pop(doc_id, None)
+        with _file_lock():
+            manifest = _read_manifest()
+            manifest["deleted"][doc_id] = time.time()
+            _write_manifest(manifest)
+        _refresh()
+
+
+def _needs_compaction() -> bool:
+    """Za dużo segmentów albo martwych wierszy (usunięte + nadpisane nowszą wersją)."""
+    segments = _view["segments"]
+    total = sum(len(s["ids"]) for s in segments)
+    dead = total - sum(int(s["live"].sum()) for s in segments)
+    return len(segments) > MAX_SEGMENTS or (total and dead / total > MAX_DEAD_RATIO)
+
+
+def _compact_locked(manifest: dict):
+    """Scala wszystkie segmenty w jeden (tylko żywe wiersze). Wołane pod _file_lock."""
+    import numpy as np
+    _view["mtime"] = None
+    _refresh_locked()
+    ids, blocks = [], []
+    for seg in _view["segments"]:
+        rows = np.flatnonzero(seg["live"])
+        if len(rows):
+            ids.extend(bytes(seg["ids"][r]).decode("utf-8") for r in rows)
+            blocks.append(np.asarray(seg["vectors"][rows]))
+    old = [s["name"] for s in manifest["segments"]]
+    manifest["segments"] = [_write_segment(ids, np.concatenate(blocks))] if ids else []
+    # świeże tombstones zostają: przesłaniają wektory z buforów innych workerów przy ich flushu
+    horizon = time.time() - TOMBSTONE_KEEP_S
+    manifest["deleted"] = {k: t for k, t in manifest["deleted"].items() if t > horizon}
+    _write_manifest(manifest)
+    for name in old:  # otwarte mmapy w innych workerach działają dalej (Linux trzyma inode)
+        _drop_segment_files(name)
+    logger.info("[VECTORS] compacted %d segments → %d rows", len(old), len(ids))
+
+
+def compact():
+    with _lock:
+        _flush_locked()
+        with _file_lock():
+            _compact_locked(_read_manifest())
+        _refresh()
+
+
+def _sync_from_db():
+    """Pierwsze użycie w procesie: dociąga z SQLite wektory, których nie ma jeszcze w magazynie."""
+    global _synced
+    import numpy as np
+    if _synced:
+        return
+    _synced = True
+    _refresh()
+    stored = set()
+    for seg in _view["segments"]:
+        stored.update(bytes(i).decode("utf-8") for i in seg["ids"][seg["live"]])
+    missing = set(db.embedding_doc_ids()) - stored - set(_pending)
+    if not missing:
+        return
+    for doc_id, _, _, blob in db.load_embeddings():
+        if doc_id in missing:
+            add(doc_id, np.frombuffer(blob, dtype=np.float32))
+    flush()
+    logger.info("[VECTORS] synced %d vectors from SQLite", len(missing))
+
+
+def search(query_vector, k: int = 10, exclude: set | None = None) -> list[tuple[str, float]]:
+    """Najbliższe wektory (kosinus): [(doc_id, score)] malejąco."""
+    import numpy as np
+    q = np.asarray(query_vector, dtype=np.float32)
+    q = q / (np.linalg.norm(q) or 1.0)
+    exclude = {e.encode("utf-8") for e in exclude or ()}
+    with _lock:
+        _sync_from_db()
+        _refresh()
+        segments, pending = _view["segments"], dict(_pending)
+    if _view["dims"] and len(q) != _view["dims"]:
+        return []
+
+    want = k * RESCORE_FACTOR
+    candidates = []  # (przybliżony wynik, segment, wiersz)
+    with timed("vector_search") as sp:
+        for seg in segments:
+            codes, scales, live = seg["codes"], seg["scales"], seg["live"]
+            for start in range(0, len(codes), SEARCH_BLOCK):
+                approx = (codes[start:start + SEARCH_BLOCK] @ q) * scales[start:start + SEARCH_BLOCK]
+                approx[~live[start:start + SEARCH_BLOCK]] = -np.inf
+                top = np.argpartition(-approx, min(want, len(approx)) - 1)[:want]
+                candidates.extend((float(approx[i]), seg, start + int(i)) for i in top if approx[i] > -np.inf)
+        candidates.sort(key=lambda c: c[0], reverse=True)
+
+        # re-scoring: dokładny iloczyn z float32 tylko dla kandydatów
+        results = {}
+        for _, seg, row in candidates[:want]:
+            doc_id = bytes(seg["ids"][row])
+            if doc_id in exclude or doc_id.decode("utf-8") in pending:
+                continue
+            results[doc_id.decode("utf-8")] = float(np.asarray(seg["vectors"][row]) @ q)
+        for doc_id, vec in pending.items():
+            if doc_id.encode("utf-8") not in exclude and len(vec) == len(q):
+                results[doc_id] = float(vec @ q)
+        sp.set(segments=len(segments), candidates=len(candidates))
+    return sorted(results.items(), key=lambda r: r[1], reverse=True)[:k]
+
+
+def _snapshot():
+    with _lock:
+        _sync_from_db()
+        _refresh()
+        return _view["segments"], dict(_pending)
+
+
+def _live_rows(seg, pending: dict):
+    """Żywe wiersze segmentu bez tych, które przesłania nowszy wektor z bufora."""
+    import numpy as np
+    rows = np.flatnonzero(seg["live"])
+    if pending and len(rows):
+        rows = rows[~np.isin(seg["ids"][rows], [k.encode("utf-8") for k in pending])]
+    return rows
+
+
+def live_ids() -> list[str]:
+    """doc_id wszystkich żywych wektorów — w kolejności, w jakiej zwraca je `iter_vectors`."""
+    segments, pending = _snapshot()
+    ids = []
+    for seg in segments:
+        ids.extend(bytes(i).decode("utf-8") for i in seg["ids"][_live_rows(seg, pending)])
+    return ids + [k for k, v in pending.items() if not _view["dims"] or len(v) == _view["dims"]]
+
+
+def iter_vectors(block: int = SEARCH_BLOCK):
+    """
+    Żywe wektory float32 blokami: (doc_ids, macierz ≤block × d). Bloki są czytane z mmapów,
+    więc konsument (np. klastrowanie) nie trzyma w RAM-ie workera całej macierzy.
+    """
+    import numpy as np
+    segments, pending = _snapshot()
+    for seg in segments:
+        rows = _live_rows(seg, pending)
+        for start in range(0, len(rows), block):
+            chunk = rows[start:start + block]
+            yield [bytes(i).decode("utf-8") for i in seg["ids"][chunk]], np.asarray(seg["vectors"][chunk])
+    items = [(k, v) for k, v in pending.items() if not _view["dims"] or len(v) == _view["dims"]]
+    if items:
+        yield [k for k, _ in items], np.stack([v for _, v in items])
+
+
+def get(doc_id: str):
+    """Wektor float32 dokumentu (albo None)."""
+    import numpy as np
+    with _lock:
+        if doc_id in _pending:
+            return _pending[doc_id]
+        _sync_from_db()
+        _refresh()
+        key = doc_id.encode("utf-8")
+        for seg in reversed(_view["segments"]):
+            rows = np.flatnonzero((seg["ids"] == key) & seg["live"])
+            if len(rows):
+                return np.asarray(seg["vectors"][rows[0]])
+    return None
+
+
+def stats() -> dict:
+    with _lock:
+        _refresh()
+        segments = _view["segments"]
+        live = sum(int(s["live"].sum()) for s in segments)
+        return {
+            "segments": len(segments),
+            "rows": sum(len(s["ids"]) for s in segments),
+            "live": live,
+            "pending": len(_pending),
+            "dims": _view["dims"],
+            "bytes_int8": sum(s["codes"].nbytes for s in segments),
+        }
+
+
+atexit.register(flush)
@@ -0,0 +1,224 @@
+# app/vertex_governor.py
+"""
+Klient-side governor dla wywołań Vertex AI.
+
+- token bucket per rodzaj wywołania (generate / embed) dopasowany do quoty
+  (VERTEX_GENERATE_RPM, VERTEX_EMBED_RPM); po 429 tempo spada o połowę i wraca
+  stopniowo (AIMD), więc bulk ingest jedzie tuż pod limitem zamiast w niego uderzać,
+- retry z wykładniczym backoffem i pełnym jitterem na 429 / 503,
+- opcjonalny hedging (VERTEX_HEDGE_MS): gdy odpowiedź nie przyszła w tym czasie,
+  wysyłamy drugie identyczne żądanie — tylko jeśli w bucket jest wolny token,
+- single-flight: identyczne równoległe prompty czekają na jedno wywołanie.
+
+Czas czekania na token i backoffu jest sumowany per wątek (`queue_wait_s`), żeby
+router mógł mierzyć samo wywołanie modelu, a nie kolejkę governora.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextvars import copy_context
+
+from app.metrics import Counter, QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRIES = int(os.getenv("VERTEX_MAX_RETRIES", "5"))
+BACKOFF_BASE = float(os.getenv("VERTEX_BACKOFF_BASE", "0.5"))
+BACKOFF_CAP = float(os.getenv("VERTEX_BACKOFF_CAP", "30"))
+HEDGE_MS = float(os.getenv("VERTEX_HEDGE_MS", "0"))       # 0 = hedging wyłączony
+ACQUIRE_TIMEOUT = float(os.getenv("VERTEX_ACQUIRE_TIMEOUT", "120"))
+RETRYABLE_CODES = {429, 503}
+
+VERTEX_CALLS = Counter(
+    "smartdoc_vertex_calls_total",
+    "Vertex AI calls by kind and outcome (ok/retry/error/hedged/coalesced/throttled).",
+    ["kind", "outcome"],
+)
+
+
+class TokenBucket:
+    """Token bucket z adaptacyjnym tempem (AIMD): `penalize()` po 429, `reward()` po sukcesie."""
+
+    def __init__(self, rate_per_min: float, burst: float | None = None):
+        self.base_rate = rate_per_min / 60.0
+        self.rate = self.base_rate
+        self.capacity = burst or max(1.0, rate_per_min / 6)   # ~10 s ruchu naraz
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self, timeout: float = ACQUIRE_TIMEOUT) -> bool:
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait_s = (1 - self.tokens) / self.rate
+            if time.monotonic() + wait_s > deadline:
+                return False
+            time.sleep(wait_s)
+
+    def penalize(self):
+        with self.lock:
+            self._refill()
+            self.rate = max(self.base_rate / 16, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+
+    def reward(self):
+        with self.lock:
+            if self.rate < self.base_rate:
+                self.rate = min(self.base_rate, self.rate + self.base_rate / 20)
+
+
+_buckets = {
+    "generate": TokenBucket(float(os.getenv("VERTEX_GENERATE_RPM", "60"))),
+    "embed": TokenBucket(float(os.getenv("VERTEX_EMBED_RPM", "600"))),
+}
+_inflight: dict = {}
+_inflight_lock = threading.Lock()
+_waits = threading.local()
+_hedge_pool = ThreadPoolExecutor(max_workers=int(os.getenv("VERTEX_HEDGE_WORKERS", "8")), thread_name_prefix="vertex")
+
+
+class QuotaTimeout(RuntimeError):
+    """Nie udało się dostać tokenu z bucket w ACQUIRE_TIMEOUT."""
+
+
+def status_code(exc) -> int | None:
+    """Kod HTTP z wyjątku google.api_core / grpc (bez twardej zależności od tych pakietów)."""
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        return code
+    if callable(code):  # grpc.RpcError: code() → StatusCode((8, "resource exhausted"))
+        try:
+            return {8: 429, 14: 503}.get(code().value[0])
+        except Exception:
+            pass
+    return {"ResourceExhausted": 429, "TooManyRequests": 429, "ServiceUnavailable": 503}.get(type(exc).__name__)
+
+
+def queue_wait_s() -> float:
+    """Łączny czas (s), jaki bieżący wątek spędził w governorze na czekaniu (token / backoff)."""
+    return getattr(_waits, "total", 0.0)
+
+
+def _add_wait(seconds: float):
+    _waits.total = queue_wait_s() + seconds
+
+
+def _backoff(attempt: int) -> float:
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
+
+
+def _attempt(kind: str, fn):
+    """Jedno wywołanie (ewentualnie z hedgingiem)."""
+    if HEDGE_MS <= 0:
+        return fn()
+    primary = _hedge_pool.submit(copy_context().run, fn)
+    done, _ = wait([primary], timeout=HEDGE_MS / 1000)
+    if done or not _buckets[kind].try_acquire():
+        return primary.result()
+    VERTEX_CALLS.inc(kind=kind, outcome="hedged")
+    hedge = _hedge_pool.submit(copy_context().run, fn)
+    pending = {primary, hedge}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for f in done:
+            if f.exception() is None:
+                return f.result()
+            error = f.exception()
+    raise error
+
+
+def _call_with_retries(kind: str, fn):
+    bucket = _buckets[kind]
+    for attempt in range(MAX_RETRIES + 1):
+        QUEUE_DEPTH.inc(queue=f"vertex_{kind}")
+        t0 = time.monotonic()
+        try:
+            acquired = bucket.acquire()
+        finally:
+            QUEUE_DEPTH.dec(queue=f"vertex_{kind}")
+            _add_wait(time.monotonic() - t0)
+        if not acquired:
+            VERTEX_CALLS.inc(kind=kind, outcome="throttled")
+            raise QuotaTimeout(f"Vertex {kind}: no quota token within {ACQUIRE_TIMEOUT}s")
+        try:
+            result = _attempt(kind, fn)
+            bucket.reward()
+            VERTEX_CALLS.inc(kind=kind, outcome="ok")
+            return result
+        except Exception as e:
+            code = status_code(e)
+            if code not in RETRYABLE_CODES or attempt == MAX_RETRIES:
+                VERTEX_CALLS.inc(kind=kind, outcome="error")
+                raise
+            if code == 429:
+                bucket.penalize()
+            delay = _backoff(attempt)
+            VERTEX_CALLS.inc(kind=kind, outcome="retry")
+            logger.info("[VertexAI] %s got %s – retry %d/%d in %.2fs", kind, code, attempt + 1, MAX_RETRIES, delay)
+            time.sleep(delay)
+            _add_wait(delay)
+
+
+def call(kind: str, fn, key=None):
+    """
+    Wywołuje `fn()` przez governor. `key` (np. (model, prompt)) włącza single-flight:
+    równoległe wywołania z tym samym kluczem dostają wynik (albo wyjątek) jednego żądania.
+    """
+    if key is None:
+        return _call_with_retries(kind, fn)
+
+    key = (kind, key)
+    with _inflight_lock:
+        leader = _inflight.get(key)
+        if leader is None:
+            future = _inflight[key] = Future()
+    if leader is not None:
+        VERTEX_CALLS.inc(kind=kind, outcome="coalesced")
+        return leader.result()
+
+    try:
+        result = _call_with_retries(kind, fn)
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+def stats() -> dict:
+    """Bieżące tempo bucketów i liczba żądań w locie (dla /admin/health)."""
+    with _inflight_lock:
+        inflight = len(_inflight)
+    return {
+        "buckets": {
+            kind: {"rate_per_min": round(b.rate * 60, 1), "quota_per_min": round(b.base_rate * 60, 1)}
+            for kind, b in _buckets.items()
+        },
+        "single_flight_inflight": inflight,
+        "hedge_ms": HEDGE_MS,
+    }
@@ -1,6 +1,11 @@
 import os
+import hashlib
 import logging
+from functools import lru_cache
 from typing import List
+from app import cache, model_router, vertex_governor
+from app.metrics import timed, VERTEX_TOKENS
+from app.tracing import current_span
 
 logger = logging.getLogger(__name__)
 
@@ -30,42 +35,91 @@ try:
         # fallback – jeśli Gemini nie jest dostępny, użyj Bisona
         ACTIVE_MODEL = "text-bison@002"
 
-    print(f"[VertexAI] ✅ Initialized with model: {ACTIVE_MODEL}")
+    logger.info("[VertexAI] ✅ Initialized with model: %s", ACTIVE_MODEL)
 
 except Exception as e:
-    print(f"[VertexAI] ⚠️ Vertex unavailable: {e}")
+    logger.warning("[VertexAI] ⚠️ Vertex unavailable: %s", e)
     VERTEX_AVAILABLE = False
     ACTIVE_MODEL = "—"
 
 
-def summarize_text(text: str, max_length: int = 300) -> str:
-    """Generate a short summary using Vertex AI with robust response handling."""
-    if not VERTEX_AVAILABLE:
-        return ""
+def _record_usage(resp, model_name: str | None = None):
+    """Zlicz tokeny z `usage_metadata` (jeśli SDK je zwraca) zamiast zrzucać całą odpowiedź."""
+    usage = getattr(resp, "usage_metadata", None)
+    if usage is None:
+        logger.debug("[VertexAI] response without usage_metadata type=%s", type(resp).__name__)
+        return
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    model_name = model_name or ACTIVE_MODEL
+    VERTEX_TOKENS.inc(prompt_tokens, model=model_name, kind="prompt")
+    VERTEX_TOKENS.inc(output_tokens, model=model_name, kind="output")
+    sp = current_span()
+    if sp is not None:
+        sp.set(prompt_tokens=prompt_tokens, output_tokens=output_tokens)
+    logger.debug("[VertexAI] model=%s prompt_tokens=%d output_tokens=%d", model_name, prompt_tokens, output_tokens)
+
+
+@lru_cache(maxsize=8)
+def _generative_model(name: str):
+    from vertexai.generative_models import GenerativeModel
+    return GenerativeModel(name)
+
+
+@lru_cache(maxsize=4)
+def _embedding_model(name: str = "text-embedding-004"):
+    from vertexai.language_models import TextEmbeddingModel
+    return TextEmbeddingModel.from_pretrained(name)
+
+
+def _prompt_key(model: str, prompt: str) -> tuple:
+    return model, hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+def _response_text(resp) -> str:
+    # ✅ różne wersje odpowiedzi — bezpieczny odczyt
+    if hasattr(resp, "text") and resp.text:
+        return resp.text.strip()
+    elif hasattr(resp, "candidates") and resp.candidates:
+        candidate = resp.candidates[0]
+        if hasattr(candidate, "content") and candidate.content.parts:
+            return candidate.content.parts[0].text.strip()
+        elif hasattr(candidate, "text"):
+            return candidate.text.strip()
+    elif isinstance(resp, str):
+        return resp.strip()
+
+    # 🧩 jeśli nic nie działa – konwersja całości do stringa
+    return str(resp).strip()
+
+
+def generate_with_model(model_name: str, prompt: str) -> str:
+    """Jedno wywołanie konkretnego modelu przez governor (wyjątki lecą do routera).
+    Odpowiedzi na identyczny prompt są brane z cache ("llm")."""
+    key = _prompt_key(model_name, prompt)
+    responses = cache.namespace("llm")
+    cached = responses.get(cache.make_key(*key))
+    if cached:
+        model_router.note_cache_hit()   # bez próbki opóźnienia w EWMA routera
+        return cached
+    model = _generative_model(model_name)
+    resp = vertex_governor.call("generate", lambda: model.generate_content(prompt), key=key)
+    _record_usage(resp, model_name)
+    text = _response_text(resp)
+    if text:
+        responses.set(cache.make_key(*key), text)
+    return text
+
+
+def summarize_text(text: str, max_length: int = 300, task: str = "summary",
+                   latency_budget_ms: float | None = None) -> str:
+    """Generate a short summary with the model picked by the router for `task`
+    (see model_router.TASKS) within `latency_budget_ms`. Returns "" when no model answered."""
     try:
-        from vertexai.generative_models import GenerativeModel
-        model = GenerativeModel(ACTIVE_MODEL)
         prompt = f"Summarize this text in one short paragraph (max {max_length} chars):\n\n{text}"
-        resp = model.generate_content(prompt)
-
-        # 🔍 DEBUG – zobacz strukturę odpowiedzi
-        print("🧠 RAW Vertex response:", repr(resp))
-
-        # ✅ różne wersje odpowiedzi — bezpieczny odczyt
-        if hasattr(resp, "text") and resp.text:
-            return resp.text.strip()
-        elif hasattr(resp, "candidates") and resp.candidates:
-            candidate = resp.candidates[0]
-            if hasattr(candidate, "content") and candidate.content.parts:
-                return candidate.content.parts[0].text.strip()
-            elif hasattr(candidate, "text"):
-                return candidate.text.strip()
-        elif isinstance(resp, str):
-            return resp.strip()
-
-        # 🧩 jeśli nic nie działa – konwersja całości do stringa
-        return str(resp).strip()
-
+        with timed("llm_generation") as sp:
+            sp.set(prompt_chars=len(prompt), task=task)
+            return model_router.generate(prompt, task=task, latency_budget_ms=latency_budget_ms)
     except Exception as e:
         logger.warning(f"[VertexAI] Summary failed: {e}")
         return ""
@@ -75,16 +129,46 @@ def generate_embedding(text: str) -> List[float]:
     """Generate text embedding (non-blocking)."""
     if not VERTEX_AVAILABLE:
         return []
+    key = _prompt_key("text-embedding-004", text)
+    embeddings = cache.namespace("embedding")
+    cached = embeddings.get(cache.make_key(*key))
+    if cached:
+        return cached
     try:
-        from vertexai.language_models import TextEmbeddingModel
-        model = TextEmbeddingModel.from_pretrained("text-embedding-004")
-        emb = model.get_embeddings([text])
-        return emb[0].values
+        model = _embedding_model()
+        with timed("embedding") as sp:
+            sp.set(text_chars=len(text))
+            emb = vertex_governor.call("embed", lambda: model.get_embeddings([text]), key=key)
+        vector = list(emb[0].values)
+        embeddings.set(cache.make_key(*key), vector)
+        return vector
     except Exception as e:
         logger.warning(f"[VertexAI] Embedding failed: {e}")
         return []
 
 
+def generate_embeddings(texts: List[str], batch_size: int = 100) -> List[List[float]]:
+    """Embeddingi wielu tekstów (paczkami); pusta lista dla tekstów, które się nie udały."""
+    if not VERTEX_AVAILABLE or not texts:
+        return [[] for _ in texts]
+    out = []
+    try:
+        model = _embedding_model()
+        for i in range(0, len(texts), batch_size):
+            batch = texts[i:i + batch_size]
+            try:
+                with timed("embedding") as sp:
+                    sp.set(texts=len(batch))
+                    out.extend(e.values for e in vertex_governor.call("embed", lambda: model.get_embeddings(batch)))
+            except Exception as e:
+                logger.warning("[VertexAI] Batch embedding failed: %s", e)
+                out.extend([] for _ in batch)
+    except Exception as e:
+        logger.warning("[VertexAI] Embedding model unavailable: %s", e)
+        out.extend([] for _ in texts[len(out):])
+    return out
+
+
 def get_vertex_status():
     """Zwraca podstawowy status Vertex AI (z automatycznym wykrywaniem modelu)."""
     return {
@@ -24,24 +24,50 @@ async function handleUpload(e) {
 
   result.textContent = "⏳ Uploading...";
   try {
-    const res = await fetch(`${API_BASE}/documents/upload-multiple`, { method: "POST", body: form });
-
+    // pliki trafiają na serwer od razu, przetwarzanie idzie w tle — postęp przez SSE
+    const res = await fetch(`${API_BASE}/documents/upload-jobs`, { method: "POST", body: form });
+    if (res.status === 429) {
+      const wait = res.headers.get("Retry-After") || "a few";
+      result.textContent = `⏳ Server busy – try again in ${wait} s.`;
+      return;
+    }
     if (!res.ok) throw new Error("Upload failed");
-    const data = await res.json();
+    const job = await res.json();
+
+    const status = {};   // plik → bieżąca linia statusu
+    for (const name of job.files) status[name] = "⏳ queued";
+    const render = () => {
+      result.innerHTML = Object.entries(status)
+        .map(([name, line]) => `<strong>${name}</strong>: ${line}`)
+        .join("<br>");
+    };
+    render();
 
-    let message = "";
-    for (const f of data.uploaded || []) {
-      if (f.status === "duplicate") {
-        message += `
-          ⚠️ <strong>${f.filename}</strong> already exists.<br>
-          📂 Location: <span style="color:#38bdf8;font-weight:bold;">${f.folder}</span><br><br>
-        `;
-      } else {
-        message += `✅ Uploaded <strong>${f.filename}</strong><br>`;
-      }
-    }
+    await new Promise((resolve) => {
+      const events = new EventSource(`${API_BASE}${job.events}`);
+      const on = (stage, fn) => events.addEventListener(stage, (ev) => {
+        fn(JSON.parse(ev.data));
+        render();
+      });
+      on("stored", (ev) => { status[ev.file] = "📥 stored"; });
+      on("extracting", (ev) => {
+        status[ev.file] = `📄 extracting page ${ev.page}${ev.pages ? "/" + ev.pages : ""}`;
+      });
+      on("ocr", (ev) => { status[ev.file] = `🔍 OCR page ${ev.page}/${ev.pages}`; });
+      on("summarised", (ev) => { status[ev.file] = ev.reused ? "♻️ summary reused" : "🧠 summarised"; });
+      on("indexed", (ev) => { status[ev.file] = "🔎 indexed"; });
+      on("done", (ev) => { status[ev.file] = uploadMessage(ev.result); });
+      on("failed", (ev) => { status[ev.file] = `❌ ${ev.error}`; });
+      on("completed", () => {
+        events.close();
+        resolve();
+      });
+      events.onerror = () => {
+        // EventSource wznawia sam (Last-Event-ID); zamknięte połączenie = koniec
+        if (events.readyState === EventSource.CLOSED) resolve();
+      };
+    });
 
-    result.innerHTML = message || "✅ Uploaded successfully.";
     await loadDocuments();
     await refreshAdmin();
 
@@ -51,6 +77,17 @@ async function handleUpload(e) {
   }
 }
 
+function uploadMessage(f) {
+  if (f.status === "duplicate") {
+    return `⚠️ already exists in <span style="color:#38bdf8;font-weight:bold;">${f.folder}</span>`;
+  }
+  if (f.status === "updated") {
+    const pages = (f.changed_pages || []).length;
+    return `🔄 updated to version ${f.version} (${pages} changed page${pages === 1 ? "" : "s"})`;
+  }
+  return "✅ uploaded";
+}
+
 // ==========================
 // 📄 FUNCTION: loadDocuments
 // ==========================
@@ -273,6 +310,49 @@ document.getElementById("search-btn").addEventListener("click", async () => {
   }
 });
 
+// ==========================
+// ⌨️ Search-as-you-type: podpowiedzi w <datalist> (debounce + anulowanie starych zapytań)
+// ==========================
+(() => {
+  const input = document.getElementById("search-query");
+  const datalist = document.getElementById("search-suggestions");
+  if (!input || !datalist) return;
+  let timer = null;
+  let controller = null;
+
+  input.addEventListener("input", () => {
+    clearTimeout(timer);
+    const q = input.value.trim();
+    if (q.length < 2) {
+      datalist.innerHTML = "";
+      return;
+    }
+    timer = setTimeout(async () => {
+      controller?.abort();
+      controller = new AbortController();
+      try {
+        const res = await fetch(`${API_BASE}/documents/suggest?q=${encodeURIComponent(q)}`, { signal: controller.signal });
+        if (!res.ok) return;
+        const data = await res.json();
+        datalist.innerHTML = "";
+        (data.suggestions || []).forEach(s => {
+          const opt = document.createElement("option");
+          opt.value = s.label;
+          opt.label = s.filename;
+          datalist.appendChild(opt);
+        });
+      } catch (err) {
+        if (err.name !== "AbortError") console.warn("⚠️ Suggest error:", err);
+      }
+    }, 150);
+  });
+
+  // Enter w polu wyszukiwania = kliknięcie "Search"
+  input.addEventListener("keydown", (e) => {
+    if (e.key === "Enter") document.getElementById("search-btn").click();
+  });
+})();
+
 // ==========================
 // ♻️ FUNCTION: refreshAdmin (dashboard bottom cards)
 // ==========================
@@ -282,6 +362,20 @@ function setCardState(cardEl, ok) {
   cardEl.classList.add(ok ? "ok" : "err");
 }
 
+// Przebudowa indeksu działa w tle — czekamy na koniec odpytując status
+async function runReindex(onProgress) {
+  const res = await fetch(`${API_BASE}/documents/reindex-all`, { method: "POST" });
+  if (!res.ok) throw new Error(`HTTP ${res.status}`);
+  let state = await res.json();
+  while (state.status === "starting" || state.status === "running") {
+    onProgress?.(state);
+    await new Promise((r) => setTimeout(r, 1000));
+    state = await (await fetch(`${API_BASE}/documents/reindex-status`)).json();
+  }
+  if (state.status !== "completed") throw new Error(state.error || "Reindex failed");
+  return `✅ Reindexed ${state.count} documents in Elasticsearch.`;
+}
+
 async function refreshAdmin() {
   const errBox = document.getElementById("admin-error");
 
@@ -296,7 +390,7 @@ async function refreshAdmin() {
     document.getElementById("es-index").textContent =
       `index: ${data.elasticsearch?.index || "—"}`;
     document.getElementById("es-index-exists").textContent =
-      `exists: ${data.elasticsearch?.connected ? "✅" : "❌"}`;
+      `exists: ${data.elasticsearch?.index_exists ? "✅" : "❌"}`;
     document.getElementById("docs-count").textContent =
       data.elasticsearch?.docs ?? "—";
     document.getElementById("vertex-enabled").textContent =
@@ -421,9 +515,13 @@ async function showAdminTab(tab) {
         if (!confirm("Rebuild Elasticsearch index?")) return;
         const log = document.getElementById("status-log");
         log.textContent = "⏳ Reindexing all documents...";
-        const res = await fetch(`${API_BASE}/documents/reindex-all`, { method: "POST" });
-        const data = await res.json();
-        log.textContent = data.message || "✅ Reindex complete.";
+        try {
+          log.textContent = await runReindex((s) => {
+            log.textContent = `⏳ Reindexing… ${s.expected || 0} documents queued`;
+          });
+        } catch (err) {
+          log.textContent = `❌ ${err.message}`;
+        }
         await refreshAdmin();
       });
       return;
@@ -845,34 +943,36 @@ async function aiOrganizeFolders() {
         e.target.textContent = "Working…";
 
         try {
-          // 1️⃣ Create folder if not exists
-          const resCreate = await fetch(`${API_BASE}/documents/folders`, {
+          // 1️⃣ No files suggested → just create the folder
+          if (files.length === 0) {
+            const resCreate = await fetch(`${API_BASE}/documents/folders`, {
+              method: "POST",
+              headers: { "Content-Type": "application/json" },
+              body: JSON.stringify({ name: newName }),
+            });
+            const dataCreate = await resCreate.json();
+            if (!resCreate.ok && !dataCreate?.detail?.includes("already exists")) {
+              throw new Error(dataCreate.detail || "Folder creation failed");
+            }
+            alert(`✅ Folder '${newName}' ready.`);
+            await showAdminTab("folders");
+            return;
+          }
+
+          // 2️⃣ Create folder (if needed) + move all files in one batch request
+          const moveRes = await fetch(`${API_BASE}/documents/folders/move-batch`, {
             method: "POST",
             headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ name: newName }),
+            body: JSON.stringify({
+              moves: files.map((file) => ({ filename: file, folder: newName })),
+              create_folders: true,
+            }),
           });
-          const dataCreate = await resCreate.json();
-          if (!resCreate.ok && !dataCreate?.detail?.includes("already exists")) {
-            throw new Error(dataCreate.detail || "Folder creation failed");
-          }
+          const moveData = await moveRes.json();
+          if (!moveRes.ok) throw new Error(moveData.detail || "Batch move failed");
 
-          // 2️⃣ Move each file
-          let ok = 0;
-          let fail = 0;
-          for (const file of files) {
-            try {
-              const moveRes = await fetch(`${API_BASE}/documents/folders/move`, {
-                method: "POST",
-                headers: { "Content-Type": "application/json" },
-                body: JSON.stringify({ filename: file, folder: newName }),
-              });
-              if (moveRes.ok) ok++;
-              else fail++;
-            } catch {
-              fail++;
-            }
-            moveLog.textContent = `Moved ${ok}/${files.length} files (failed: ${fail})`;
-          }
+          const ok = moveData.moved || 0;
+          moveLog.textContent = `Moved ${ok}/${files.length} files`;
 
           alert(`✅ Folder '${newName}' ready — moved ${ok}/${files.length} files.`);
           await showAdminTab("folders");
@@ -1081,10 +1181,7 @@ document.addEventListener("click", async (e) => {
     btn.textContent = "Reindexing…";
 
     try {
-      const res = await fetch(`${API_BASE}/documents/reindex-all`, { method: "POST" });
-      if (!res.ok) throw new Error(`HTTP ${res.status}`);
-      const data = await res.json();
-      alert(data.message || "✅ Reindex completed successfully.");
+      alert(await runReindex());
       await refreshAdmin();
     } catch (err) {
       console.error("❌ Reindex error:", err);